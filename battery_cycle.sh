@@ -43,10 +43,19 @@ CPU_STRESS="high"   # off, low, medium, high
 GPU_STRESS="off"    # off, low, medium, high
 
 CHECK_INTERVAL=10  # Shorter interval to catch dead processes faster
+# Adaptive polling: between these while the time to the next limit is known
+MIN_CHECK_INTERVAL=2
+MAX_CHECK_INTERVAL=60
+ADAPTIVE_POLLING=true
+STRESS_STANDBY=false  # suspend stress workers while charging instead of killing them
+NEXT_INTERVAL=$CHECK_INTERVAL
 LOG_FILE=~/battery_cycles.log
 HEALTH_LOG=~/battery_health.csv
 STATE_FILE=~/battery_cycle_state.txt
 CONFIG_FILE=~/battery_cycle_config.json
+# system_profiler output cache, shared with the menu bar app
+PROFILER_CACHE=~/.battery_cycler/system_profiler_power.txt
+PROFILER_CACHE_TTL=3600
 
 # Check for bundled battery CLI
 if [ ! -x "$BATTERY_CMD" ]; then
@@ -55,24 +64,33 @@ if [ ! -x "$BATTERY_CMD" ]; then
 fi
 
 # Load config from JSON file
+# Re-parsed only when the file's mtime/inode/size changes (one stat per tick),
+# and all keys are read by a single python3 run
+CONFIG_STAMP=""
 load_config() {
-    if [ -f "$CONFIG_FILE" ]; then
-        UPPER_LIMIT=$(python3 -c "import json; print(json.load(open('$CONFIG_FILE')).get('upper_limit', 80))" 2>/dev/null || echo 80)
-        LOWER_LIMIT=$(python3 -c "import json; print(json.load(open('$CONFIG_FILE')).get('lower_limit', 20))" 2>/dev/null || echo 20)
-        # Handle both old boolean and new string levels
-        CPU_STRESS=$(python3 -c "
-import json
-v = json.load(open('$CONFIG_FILE')).get('cpu_stress', 'high')
-if isinstance(v, bool): v = 'high' if v else 'off'
-print(str(v).lower())
-" 2>/dev/null || echo "high")
-        GPU_STRESS=$(python3 -c "
-import json
-v = json.load(open('$CONFIG_FILE')).get('gpu_stress', 'off')
-if isinstance(v, bool): v = 'high' if v else 'off'
-print(str(v).lower())
-" 2>/dev/null || echo "off")
+    [ -f "$CONFIG_FILE" ] || return
+    local stamp=$(stat -f "%m %i %z" "$CONFIG_FILE" 2>/dev/null)
+    if [ -n "$stamp" ] && [ "$stamp" = "$CONFIG_STAMP" ]; then
+        return
     fi
+    local values
+    # Handle both old boolean and new string stress levels
+    values=$(python3 - "$CONFIG_FILE" 2>/dev/null <<'PYTHON'
+import json, sys
+config = json.load(open(sys.argv[1]))
+def level(key, default):
+    v = config.get(key, default)
+    if isinstance(v, bool): v = 'high' if v else 'off'
+    return str(v).lower()
+print(int(config.get('upper_limit', 80)), int(config.get('lower_limit', 20)),
+      level('cpu_stress', 'high'), level('gpu_stress', 'off'),
+      int(config.get('profiler_cache_ttl', 3600)),
+      'true' if config.get('adaptive_polling', True) else 'false',
+      'true' if config.get('stress_standby', False) else 'false')
+PYTHON
+) || return  # unreadable or half-written: keep the last good values
+    read UPPER_LIMIT LOWER_LIMIT CPU_STRESS GPU_STRESS PROFILER_CACHE_TTL ADAPTIVE_POLLING STRESS_STANDBY <<< "$values"
+    CONFIG_STAMP="$stamp"
 }
 
 load_config
@@ -83,6 +101,77 @@ echo "Logging to: $LOG_FILE"
 echo "Health tracking: $HEALTH_LOG"
 echo "Press Ctrl+C to stop"
 
+# Stress workers run in their own process group (job control is on while
+# forking) and are tracked by PID, so checks are a kill -0 rather than a
+# process table scan and only our own stress-ng/ffmpeg are ever killed.
+# The PIDs are also written for the menu bar app (see battery_cycler/stress.py).
+CPU_STRESS_PID=""
+GPU_STRESS_PID=""
+CPU_WORKER_LEVEL=""  # level the running workers were started at
+GPU_WORKER_LEVEL=""
+STRESS_SUSPENDED=false
+STRESS_PIDS_FILE=~/.battery_cycler/stress.pids
+
+spawn_worker() {
+    set -m
+    "$@" > /dev/null 2>&1 &
+    SPAWNED_PID=$!
+    set +m
+}
+
+worker_running() {
+    [ -n "$1" ] && kill -0 "$1" 2>/dev/null
+}
+
+kill_worker() {
+    [ -n "$1" ] || return
+    kill -9 -- "-$1" 2>/dev/null
+    wait "$1" 2>/dev/null
+}
+
+write_stress_pids() {
+    mkdir -p "$(dirname "$STRESS_PIDS_FILE")"
+    {
+        [ -n "$CPU_STRESS_PID" ] && echo "cpu $CPU_STRESS_PID"
+        [ -n "$GPU_STRESS_PID" ] && echo "gpu $GPU_STRESS_PID"
+    } > "$STRESS_PIDS_FILE"
+}
+
+# CPU stress using stress-ng (levels: off, low, medium, high)
+enable_cpu_stress() {
+    local level="$1" verb="${2:-Started}"
+    if worker_running "$CPU_STRESS_PID"; then
+        return
+    fi
+    case "$level" in
+        low)
+            spawn_worker "$STRESS_CMD" --cpu 2 --vm 1 --vm-bytes 1G --timeout 0
+            log "CPU-STRESS: $verb LOW (2 CPU, 1GB RAM)"
+            ;;
+        medium)
+            spawn_worker "$STRESS_CMD" --cpu 4 --vm 2 --vm-bytes 2G --timeout 0
+            log "CPU-STRESS: $verb MEDIUM (4 CPU, 2GB RAM)"
+            ;;
+        high)
+            spawn_worker "$STRESS_CMD" --cpu 0 --vm 4 --vm-bytes 4G --timeout 0
+            log "CPU-STRESS: $verb HIGH (all CPUs, 4GB RAM)"
+            ;;
+        *)
+            return
+            ;;
+    esac
+    CPU_STRESS_PID=$SPAWNED_PID
+    CPU_WORKER_LEVEL=$level
+    write_stress_pids
+}
+
+disable_cpu_stress() {
+    kill_worker "$CPU_STRESS_PID"
+    CPU_STRESS_PID=""
+    write_stress_pids
+    log "CPU-STRESS: Stopped"
+}
+
 # GPU stress using ffmpeg VideoToolbox encoding (levels: off, low, medium, high)
 # Note: ffmpeg is optional - uses system install if available
 enable_gpu_stress() {
@@ -94,30 +183,70 @@ enable_gpu_stress() {
         log "GPU-STRESS: ffmpeg not found - GPU stress disabled"
         return
     fi
-    if ! pgrep -f "ffmpeg.*videotoolbox" > /dev/null; then
+    if ! worker_running "$GPU_STRESS_PID"; then
         case "$level" in
             low)
-                "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=640x480:rate=30 \
-                       -c:v hevc_videotoolbox -b:v 10M -f null - 2>/dev/null &
+                spawn_worker "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=640x480:rate=30 \
+                       -c:v hevc_videotoolbox -b:v 10M -f null -
                 log "GPU-STRESS: Started LOW (640x480@30fps, 10Mbps)"
                 ;;
             medium)
-                "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=1280x720:rate=60 \
-                       -c:v hevc_videotoolbox -b:v 30M -f null - 2>/dev/null &
+                spawn_worker "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=1280x720:rate=60 \
+                       -c:v hevc_videotoolbox -b:v 30M -f null -
                 log "GPU-STRESS: Started MEDIUM (720p@60fps, 30Mbps)"
                 ;;
             high)
-                "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=1920x1080:rate=60 \
-                       -c:v hevc_videotoolbox -b:v 50M -f null - 2>/dev/null &
+                spawn_worker "$FFMPEG_CMD" -f lavfi -i testsrc=duration=99999:size=1920x1080:rate=60 \
+                       -c:v hevc_videotoolbox -b:v 50M -f null -
                 log "GPU-STRESS: Started HIGH (1080p@60fps, 50Mbps)"
                 ;;
+            *)
+                return
+                ;;
         esac
+        GPU_STRESS_PID=$SPAWNED_PID
+        GPU_WORKER_LEVEL=$level
+        write_stress_pids
+    fi
+}
+
+# Warm standby: keep the workers resident but stopped while charging, so
+# the next discharge skips stress-ng's memory allocation and ffmpeg's setup
+suspend_stress() {
+    local pid suspended=false
+    for pid in $CPU_STRESS_PID $GPU_STRESS_PID; do
+        worker_running "$pid" && kill -STOP -- "-$pid" 2>/dev/null && suspended=true
+    done
+    if [ "$suspended" = "true" ]; then
+        STRESS_SUSPENDED=true
+        log "STRESS: Suspended (standby until next discharge)"
+    fi
+}
+
+# Continue suspended workers still at the configured level, drop the rest
+resume_stress() {
+    [ "$STRESS_SUSPENDED" = "true" ] || return
+    STRESS_SUSPENDED=false
+    if [ "$CPU_WORKER_LEVEL" != "$CPU_STRESS" ]; then
+        kill_worker "$CPU_STRESS_PID"
+        CPU_STRESS_PID=""
     fi
+    if [ "$GPU_WORKER_LEVEL" != "$GPU_STRESS" ]; then
+        kill_worker "$GPU_STRESS_PID"
+        GPU_STRESS_PID=""
+    fi
+    write_stress_pids
+    local pid
+    for pid in $CPU_STRESS_PID $GPU_STRESS_PID; do
+        kill -CONT -- "-$pid" 2>/dev/null
+    done
+    [ -n "$CPU_STRESS_PID$GPU_STRESS_PID" ] && log "STRESS: Resumed from standby"
 }
 
 disable_gpu_stress() {
-    pkill -f "ffmpeg.*videotoolbox" 2>/dev/null
-    pkill -f "ffmpeg.*testsrc" 2>/dev/null
+    kill_worker "$GPU_STRESS_PID"
+    GPU_STRESS_PID=""
+    write_stress_pids
     log "GPU-STRESS: Stopped"
 }
 
@@ -138,57 +267,127 @@ ensure_caffeinate_running() {
 # Track last check time to detect timer throttling
 LAST_STRESS_CHECK=0
 
+# Pick the next sleep (see battery_cycler/polling.py): half the predicted
+# time to the limit we're heading for, from the rate since the phase
+# started. CHECK_INTERVAL until at least 2% and 2 minutes have passed.
+# Levels are BATTERY_LEVEL in hundredths of a percent, the scale the limit
+# checks use.
+RATE_STATE=""
+RATE_START_TIME=0
+RATE_START_LEVEL=0
+next_check_interval() {
+    local now=$(date +%s)
+    NEXT_INTERVAL=$CHECK_INTERVAL
+    if [ "$CURRENT_STATE" != "$RATE_STATE" ]; then
+        RATE_STATE=$CURRENT_STATE
+        RATE_START_TIME=$now
+        RATE_START_LEVEL=$BATTERY_LEVEL_C
+        return
+    fi
+    local moved distance elapsed=$((now - RATE_START_TIME))
+    case "$CURRENT_STATE" in
+        discharging) moved=$((RATE_START_LEVEL - BATTERY_LEVEL_C)); distance=$((BATTERY_LEVEL_C - LOWER_LIMIT * 100)) ;;
+        charging) moved=$((BATTERY_LEVEL_C - RATE_START_LEVEL)); distance=$((UPPER_LIMIT * 100 - BATTERY_LEVEL_C)) ;;
+        *) return ;;
+    esac
+    if [ "$ADAPTIVE_POLLING" != "true" ] || [ $moved -lt 200 ] || [ $elapsed -lt 120 ] || [ $distance -le 0 ]; then
+        return
+    fi
+    # A reading rounded to LEVEL_STEP_C shows the limit half a step early
+    NEXT_INTERVAL=$(( (2 * distance - LEVEL_STEP_C) * elapsed / moved / 4 ))
+    [ $NEXT_INTERVAL -lt $MIN_CHECK_INTERVAL ] && NEXT_INTERVAL=$MIN_CHECK_INTERVAL
+    [ $NEXT_INTERVAL -gt $MAX_CHECK_INTERVAL ] && NEXT_INTERVAL=$MAX_CHECK_INTERVAL
+}
+
 # Ensure stress processes are running during discharge (resilience)
 ensure_stress_running() {
     local now=$(date +%s)
     local elapsed=$((now - LAST_STRESS_CHECK))
 
     # Log if check interval was much longer than expected (throttled)
-    if [ $LAST_STRESS_CHECK -gt 0 ] && [ $elapsed -gt 60 ]; then
-        log "WARNING: Check interval was ${elapsed}s (expected ~${CHECK_INTERVAL}s) - timer may have been throttled"
+    local limit=$((NEXT_INTERVAL * 2))
+    [ $limit -lt 60 ] && limit=60
+    if [ $LAST_STRESS_CHECK -gt 0 ] && [ $elapsed -gt $limit ]; then
+        log "WARNING: Check interval was ${elapsed}s (expected ~${NEXT_INTERVAL}s) - timer may have been throttled"
     fi
     LAST_STRESS_CHECK=$now
 
     # Only run stress during discharge - kill any stragglers if charging
     if [ "$CURRENT_STATE" != "discharging" ]; then
+        if [ "$STRESS_SUSPENDED" = "true" ] && [ "$STRESS_STANDBY" = "true" ]; then
+            return
+        fi
+        STRESS_SUSPENDED=false
         # Make sure stress is stopped if we're not discharging
-        if pgrep -x "stress-ng" > /dev/null; then
-            pkill -9 stress-ng 2>/dev/null
+        if worker_running "$CPU_STRESS_PID"; then
+            kill_worker "$CPU_STRESS_PID"
+            CPU_STRESS_PID=""
+            write_stress_pids
             log "CPU-STRESS: Killed (not in discharge mode)"
         fi
-        if pgrep -f "ffmpeg.*videotoolbox" > /dev/null; then
-            pkill -f "ffmpeg.*videotoolbox" 2>/dev/null
+        if worker_running "$GPU_STRESS_PID"; then
+            kill_worker "$GPU_STRESS_PID"
+            GPU_STRESS_PID=""
+            write_stress_pids
             log "GPU-STRESS: Killed (not in discharge mode)"
         fi
         return
     fi
 
     # Check and restart CPU stress if needed
-    if [ "$CPU_STRESS" != "off" ] && ! pgrep -x "stress-ng" > /dev/null; then
+    if [ "$CPU_STRESS" != "off" ] && ! worker_running "$CPU_STRESS_PID"; then
         log "CPU-STRESS: Process died, restarting..."
-        case "$CPU_STRESS" in
-            low)
-                "$STRESS_CMD" --cpu 2 --vm 1 --vm-bytes 1G --timeout 0 &
-                log "CPU-STRESS: Restarted LOW (2 CPU, 1GB RAM)"
-                ;;
-            medium)
-                "$STRESS_CMD" --cpu 4 --vm 2 --vm-bytes 2G --timeout 0 &
-                log "CPU-STRESS: Restarted MEDIUM (4 CPU, 2GB RAM)"
-                ;;
-            high)
-                "$STRESS_CMD" --cpu 0 --vm 4 --vm-bytes 4G --timeout 0 &
-                log "CPU-STRESS: Restarted HIGH (all CPUs, 4GB RAM)"
-                ;;
-        esac
+        enable_cpu_stress "$CPU_STRESS" Restarted
     fi
 
     # Check and restart GPU stress if needed
-    if [ "$GPU_STRESS" != "off" ] && [ -n "$FFMPEG_CMD" ] && ! pgrep -f "ffmpeg.*videotoolbox" > /dev/null; then
+    if [ "$GPU_STRESS" != "off" ] && [ -n "$FFMPEG_CMD" ] && ! worker_running "$GPU_STRESS_PID"; then
         log "GPU-STRESS: Process died, restarting..."
         enable_gpu_stress "$GPU_STRESS"
     fi
 }
 
+# Phase-switch latency (see battery_cycler/transitions.py): stage marks
+# from the reading that crossed a limit until the SMC change, logged as one
+# SWITCH line. bin/battery adds its own steps to BATTERY_TIMING_FILE. perl
+# for a sub-second clock.
+now_precise() {
+    perl -MTime::HiRes=time -e 'printf "%.3f", time'
+}
+
+begin_switch() {
+    SWITCH_MARKS="detected $(now_precise)"
+    BATTERY_TIMING_FILE=$(mktemp "${TMPDIR:-/tmp}/battery-timing.XXXXXX")
+    export BATTERY_TIMING_FILE
+}
+
+switch_mark() {
+    [ -n "$BATTERY_TIMING_FILE" ] || return
+    SWITCH_MARKS="$SWITCH_MARKS
+$1 $(now_precise)"
+}
+
+end_switch() {
+    local summary
+    # Stages are the gaps between marks; the change counts as applied at
+    # bin/battery's SMC write when it reported one, else when the command returned
+    summary=$( { echo "$SWITCH_MARKS"; sed 's/^/command./' "$BATTERY_TIMING_FILE"; } | awk '
+        $1 ~ /^command\./ { if ($1 == "command.smc_write") written = $2; next }
+        prev == "" { first = $2; prev = $2; next }
+        {
+            stages = stages sep sprintf("%s %.1fs", $1, $2 - prev); sep = ", "
+            if ($1 == "command") returned = $2
+            prev = $2
+        }
+        END {
+            applied = written != "" ? written : (returned != "" ? returned : prev)
+            printf "%.1fs (%s)", applied - first, stages
+        }')
+    log "SWITCH: $1 applied in $summary"
+    rm -f "$BATTERY_TIMING_FILE"
+    unset BATTERY_TIMING_FILE
+}
+
 # Run battery command with timeout to prevent hanging (macOS compatible)
 run_battery_cmd() {
     local cmd="$1"
@@ -220,58 +419,85 @@ run_battery_cmd() {
 enable_discharge() {
     # Set battery to discharge to lower limit
     run_battery_cmd discharge $LOWER_LIMIT
+    switch_mark command
     log "BATTERY: Discharge enabled (target: ${LOWER_LIMIT}%)"
+    resume_stress
 
     # Start CPU stress based on level (off, low, medium, high)
     if [ "$CPU_STRESS" != "off" ]; then
-        if ! pgrep -x "stress-ng" > /dev/null; then
-            case "$CPU_STRESS" in
-                low)
-                    "$STRESS_CMD" --cpu 2 --vm 1 --vm-bytes 1G --timeout 0 &
-                    log "CPU-STRESS: Started LOW (2 CPU, 1GB RAM)"
-                    ;;
-                medium)
-                    "$STRESS_CMD" --cpu 4 --vm 2 --vm-bytes 2G --timeout 0 &
-                    log "CPU-STRESS: Started MEDIUM (4 CPU, 2GB RAM)"
-                    ;;
-                high)
-                    "$STRESS_CMD" --cpu 0 --vm 4 --vm-bytes 4G --timeout 0 &
-                    log "CPU-STRESS: Started HIGH (all CPUs, 4GB RAM)"
-                    ;;
-            esac
-        fi
+        enable_cpu_stress "$CPU_STRESS"
     fi
 
     # Start GPU stress based on level
     if [ "$GPU_STRESS" != "off" ]; then
         enable_gpu_stress "$GPU_STRESS"
     fi
+    switch_mark stress
 }
 
 disable_discharge() {
-    # Stop CPU stress
-    pkill -9 stress-ng 2>/dev/null
-    log "CPU-STRESS: Stopped"
+    if [ "$STRESS_STANDBY" = "true" ]; then
+        # Keep CPU/GPU stress resident but stopped
+        suspend_stress
+    else
+        # Stop CPU stress
+        disable_cpu_stress
 
-    # Stop GPU stress
-    disable_gpu_stress
+        # Stop GPU stress
+        disable_gpu_stress
+    fi
+    switch_mark stress
 
     # Set battery to charge to upper limit
     run_battery_cmd charge $UPPER_LIMIT
+    switch_mark command
     log "BATTERY: Charging enabled (target: ${UPPER_LIMIT}%)"
 }
 
 # Get battery health info
+# The AppleSmartBattery node is read once by refresh_ioreg and the getters
+# below parse that copy, instead of spawning ioreg once per key
+refresh_ioreg() {
+    IOREG_SNAPSHOT=$(ioreg -rn AppleSmartBattery)
+}
+
+# Sets battery (pmset's whole percent, for display) and BATTERY_LEVEL, the
+# state of charge the limits are checked against: from the raw mAh counters,
+# which are finer than pmset's rounded and smoothed percent, else pmset's
+read_battery_level() {
+    battery=$(pmset -g batt | grep -Eo "\d+%" | head -1 | cut -d% -f1)
+    refresh_ioreg
+    BATTERY_LEVEL=$(echo "$IOREG_SNAPSHOT" | awk -F' = ' '
+        $1 ~ /"AppleRawCurrentCapacity"$/ { raw = $2 }
+        $1 ~ /"AppleRawMaxCapacity"$/ { full = $2 }
+        END { if (raw != "" && full > 0) printf "%.2f", raw * 100 / full }')
+    # The same in hundredths of a percent, for shell arithmetic, and the
+    # reading's step on that scale
+    if [ -n "$BATTERY_LEVEL" ]; then
+        BATTERY_LEVEL_C=$((10#${BATTERY_LEVEL/./}))
+        LEVEL_STEP_C=1
+    else
+        BATTERY_LEVEL=$battery
+        BATTERY_LEVEL_C=$((battery * 100))
+        LEVEL_STEP_C=100
+    fi
+}
+
+# level_is LEVEL OP LIMIT - compare a fractional level (OP: <=, >= or >)
+level_is() {
+    awk -v level="$1" -v limit="$3" "BEGIN { exit !(level $2 limit) }"
+}
+
 get_max_capacity_mah() {
-    ioreg -rn AppleSmartBattery | grep '"NominalChargeCapacity"' | awk -F' = ' '{print $2}'
+    echo "$IOREG_SNAPSHOT" | grep '"NominalChargeCapacity"' | awk -F' = ' '{print $2}'
 }
 
 get_design_capacity() {
-    ioreg -rn AppleSmartBattery | grep -o '"DesignCapacity"=[0-9]*' | awk -F'=' '{print $2}'
+    echo "$IOREG_SNAPSHOT" | grep -o '"DesignCapacity"=[0-9]*' | awk -F'=' '{print $2}'
 }
 
 get_cycle_count() {
-    ioreg -rn AppleSmartBattery | grep -o '"CycleCount"=[0-9]*' | awk -F'=' '{print $2}'
+    echo "$IOREG_SNAPSHOT" | grep -o '"CycleCount"=[0-9]*' | awk -F'=' '{print $2}'
 }
 
 get_health_percent() {
@@ -284,16 +510,40 @@ get_health_percent() {
     fi
 }
 
+# system_profiler is slow (seconds) and its values change a few times a day,
+# so reuse the cached output until it expires or a cycle completes
+get_power_profile() {
+    if [ -f "$PROFILER_CACHE" ]; then
+        local age=$(( $(date +%s) - $(stat -f %m "$PROFILER_CACHE" 2>/dev/null || echo 0) ))
+        if [ $age -lt $PROFILER_CACHE_TTL ]; then
+            cat "$PROFILER_CACHE"
+            return
+        fi
+    fi
+    mkdir -p "$(dirname "$PROFILER_CACHE")"
+    local tmp="$PROFILER_CACHE.$$"
+    if system_profiler SPPowerDataType > "$tmp" 2>/dev/null && [ -s "$tmp" ]; then
+        mv -f "$tmp" "$PROFILER_CACHE"
+        cat "$PROFILER_CACHE"
+    else
+        rm -f "$tmp"
+    fi
+}
+
+invalidate_power_profile() {
+    rm -f "$PROFILER_CACHE"
+}
+
 get_battery_condition() {
-    system_profiler SPPowerDataType 2>/dev/null | grep "Condition" | awk -F': ' '{print $2}'
+    get_power_profile | grep "Condition" | awk -F': ' '{print $2}'
 }
 
 get_apple_health() {
-    system_profiler SPPowerDataType 2>/dev/null | grep "Maximum Capacity" | awk -F': ' '{print $2}' | tr -d '%'
+    get_power_profile | grep "Maximum Capacity" | awk -F': ' '{print $2}' | tr -d '%'
 }
 
 get_temperature() {
-    ioreg -rn AppleSmartBattery | grep '"Temperature"' | head -1 | awk -F' = ' '{print $2}'
+    echo "$IOREG_SNAPSHOT" | grep '"Temperature"' | head -1 | awk -F' = ' '{print $2}'
 }
 
 # Send notification with sound
@@ -333,6 +583,7 @@ log() {
 # Log battery health
 log_health() {
     local timestamp=$(date '+%Y-%m-%d %H:%M:%S')
+    refresh_ioreg
     local max_cap=$(get_max_capacity_mah)
     local design_cap=$(get_design_capacity)
     local apple_cycles=$(get_cycle_count)
@@ -390,8 +641,9 @@ cleanup() {
     log_health "script_stopped"
     kill $CAFFEINATE_PID 2>/dev/null
     kill $PMSET_PID 2>/dev/null
-    pkill -9 stress-ng 2>/dev/null
+    disable_cpu_stress
     disable_gpu_stress
+    rm -f "$STRESS_PIDS_FILE"
 
     # Restore battery to normal state (maintain at 80%)
     run_battery_cmd maintain 80
@@ -435,6 +687,7 @@ log "RESUMED: $TOTAL_DISCHARGE_CYCLES cycles completed previously"
 
 # Record initial health if not set
 if [ -z "$INITIAL_HEALTH" ]; then
+    refresh_ioreg
     INITIAL_HEALTH=$(get_health_percent)
     INITIAL_APPLE_CYCLES=$(get_cycle_count)
     save_state
@@ -448,17 +701,17 @@ notify "Battery Cycling Started" "Range: ${LOWER_LIMIT}% to ${UPPER_LIMIT}%"
 
 # Get initial battery level and set initial state
 # If above lower limit, discharge first. If at/below lower limit, charge.
-battery=$(pmset -g batt | grep -Eo "\d+%" | head -1 | cut -d% -f1)
-if [ "$battery" -gt $LOWER_LIMIT ]; then
+read_battery_level
+if level_is "$BATTERY_LEVEL" ">" "$LOWER_LIMIT"; then
     enable_discharge
     CURRENT_STATE="discharging"
     CYCLE_START_TIME=$(date +%s)
-    log "INITIAL: Battery at ${battery}% > ${LOWER_LIMIT}%, starting discharge"
+    log "INITIAL: Battery at ${BATTERY_LEVEL}% > ${LOWER_LIMIT}%, starting discharge"
 else
     disable_discharge
     CURRENT_STATE="charging"
     CHARGE_START_TIME=$(date +%s)
-    log "INITIAL: Battery at ${battery}% <= ${LOWER_LIMIT}%, starting charge"
+    log "INITIAL: Battery at ${BATTERY_LEVEL}% <= ${LOWER_LIMIT}%, starting charge"
 fi
 save_state
 
@@ -470,13 +723,13 @@ while true; do
     update_time_stats
     save_state
 
-    battery=$(pmset -g batt | grep -Eo "\d+%" | head -1 | cut -d% -f1)
+    read_battery_level
     power_source=$(pmset -g batt | head -1 | grep -o "'.*'" | tr -d "'")
     apple_health=$(get_apple_health)
-    cpu_running=$(pgrep -x "stress-ng" > /dev/null && echo "yes" || echo "no")
-    gpu_running=$(pgrep -f "ffmpeg.*videotoolbox" > /dev/null && echo "yes" || echo "no")
+    cpu_running=$(worker_running "$CPU_STRESS_PID" && echo "yes" || echo "no")
+    gpu_running=$(worker_running "$GPU_STRESS_PID" && echo "yes" || echo "no")
 
-    echo "$(date '+%H:%M:%S') - Battery: $battery% | AppleHealth: ${apple_health}% | Source: $power_source | CPU: $cpu_running | GPU: $gpu_running | Cycles: $TOTAL_DISCHARGE_CYCLES | State: $CURRENT_STATE"
+    echo "$(date '+%H:%M:%S') - Battery: $BATTERY_LEVEL% | AppleHealth: ${apple_health}% | Source: $power_source | CPU: $cpu_running | GPU: $gpu_running | Cycles: $TOTAL_DISCHARGE_CYCLES | State: $CURRENT_STATE"
 
     # Ensure caffeinate is running (prevents sleep)
     ensure_caffeinate_running
@@ -484,9 +737,10 @@ while true; do
     # Ensure stress processes are running during discharge (resilience check)
     ensure_stress_running
 
-    if [ "$battery" -le $LOWER_LIMIT ]; then
+    if level_is "$BATTERY_LEVEL" "<=" "$LOWER_LIMIT"; then
         if [ "$CURRENT_STATE" != "charging" ]; then
             # Completed a discharge cycle
+            begin_switch
             CYCLE_END_TIME=$(date +%s)
             if [ -n "$CYCLE_START_TIME" ] && [ "$CYCLE_START_TIME" -gt 0 ]; then
                 CYCLE_DURATION=$(( (CYCLE_END_TIME - CYCLE_START_TIME) / 60 ))
@@ -494,11 +748,15 @@ while true; do
             fi
 
             TOTAL_DISCHARGE_CYCLES=$((TOTAL_DISCHARGE_CYCLES + 1))
-            log "CYCLE #$TOTAL_DISCHARGE_CYCLES - Started charging at $battery%"
-            log_health "discharge_complete"
+            log "CYCLE #$TOTAL_DISCHARGE_CYCLES - Started charging at $BATTERY_LEVEL%"
 
-            # Disable discharge, enable charging
+            # Disable discharge, enable charging (before the health log,
+            # which may wait on system_profiler)
+            switch_mark prepare
             disable_discharge
+            end_switch charging
+            invalidate_power_profile
+            log_health "discharge_complete"
             notify "Cycle $TOTAL_DISCHARGE_CYCLES Complete" "Discharge done. Health: $(get_health_percent)% | Now charging to ${UPPER_LIMIT}%"
 
             CURRENT_STATE="charging"
@@ -506,20 +764,23 @@ while true; do
             save_state
         fi
 
-    elif [ "$battery" -ge $UPPER_LIMIT ]; then
+    elif level_is "$BATTERY_LEVEL" ">=" "$UPPER_LIMIT"; then
         if [ "$CURRENT_STATE" != "discharging" ]; then
             # Completed a charge cycle
+            begin_switch
             if [ -n "$CHARGE_START_TIME" ] && [ "$CHARGE_START_TIME" -gt 0 ]; then
                 CHARGE_END_TIME=$(date +%s)
                 CHARGE_DURATION=$(( (CHARGE_END_TIME - CHARGE_START_TIME) / 60 ))
                 log "CHARGE COMPLETE - Took ${CHARGE_DURATION} minutes"
             fi
 
-            log "CYCLE #$((TOTAL_DISCHARGE_CYCLES + 1)) - Started discharging at $battery%"
-            log_health "charge_complete"
+            log "CYCLE #$((TOTAL_DISCHARGE_CYCLES + 1)) - Started discharging at $BATTERY_LEVEL%"
 
             # Enable discharge
+            switch_mark prepare
             enable_discharge
+            end_switch discharging
+            log_health "charge_complete"
             notify "Charge Complete" "Battery at ${battery}%. Starting discharge cycle #$((TOTAL_DISCHARGE_CYCLES + 1))"
 
             CURRENT_STATE="discharging"
@@ -528,5 +789,6 @@ while true; do
         fi
     fi
 
-    sleep $CHECK_INTERVAL
+    next_check_interval
+    sleep $NEXT_INTERVAL
 done
@@ -0,0 +1,3 @@
+"""Battery Cycler core - probing, state and control logic shared by the
+menu bar app. Nothing in this package imports rumps, so it can be used
+(and exercised) outside the app bundle."""
@@ -0,0 +1,143 @@
+"""Running totals for the Show Stats dialog.
+
+SessionAggregates is updated in O(1) per tick/sample by the engine and
+persisted inside every journal record, so opening the stats view is a read
+of precomputed values - no probes, no re-parsing of history. Totals cover
+the whole cycling session, i.e. since the state was first created (the same
+span as the legacy TOTAL_*_SECS counters).
+"""
+
+FIELDS = (
+    "active_secs",
+    "discharge_secs",
+    "charge_secs",
+    "hold_secs",
+    "initial_health",
+    "current_health",
+    "initial_apple_cycles",
+    "current_apple_cycles",
+    "min_temperature",
+    "max_temperature",
+    "samples",
+    "discharged_mah",
+    "charged_mah",
+    "equivalent_cycles",
+    "delivered_wh",
+    "absorbed_wh",
+)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SessionAggregates:
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for name in FIELDS:
+            setattr(self, name, values.get(name))
+        for name in ("active_secs", "discharge_secs", "charge_secs", "hold_secs", "samples",
+                     "discharged_mah", "charged_mah", "equivalent_cycles", "delivered_wh", "absorbed_wh"):
+            if getattr(self, name) is None:
+                setattr(self, name, 0)
+
+    @classmethod
+    def from_state(cls, state):
+        """Restore from a journal state dict, or seed from legacy keys
+        (a state file written by battery_cycle.sh has no aggregates)."""
+        saved = state.get("AGGREGATES")
+        if isinstance(saved, dict):
+            return cls(**{k: v for k, v in saved.items() if k in FIELDS})
+        return cls(
+            active_secs=_int(state.get("TOTAL_ACTIVE_SECS")) or 0,
+            discharge_secs=_int(state.get("TOTAL_DISCHARGE_SECS")) or 0,
+            charge_secs=_int(state.get("TOTAL_CHARGE_SECS")) or 0,
+            initial_health=_float(state.get("INITIAL_HEALTH")),
+            initial_apple_cycles=_int(state.get("INITIAL_APPLE_CYCLES")),
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def legacy_fields(self):
+        """The KEY=value fields battery_cycle.sh keeps for the same totals."""
+        return {
+            "TOTAL_ACTIVE_SECS": self.active_secs,
+            "TOTAL_DISCHARGE_SECS": self.discharge_secs,
+            "TOTAL_CHARGE_SECS": self.charge_secs,
+            "INITIAL_HEALTH": "{:.2f}".format(self.initial_health) if self.initial_health else "",
+            "INITIAL_APPLE_CYCLES": self.initial_apple_cycles if self.initial_apple_cycles is not None else "",
+        }
+
+    # --- O(1) updates ---
+
+    def add_time(self, phase, secs):
+        self.active_secs += secs
+        if phase == "discharging":
+            self.discharge_secs += secs
+        elif phase == "charging":
+            self.charge_secs += secs
+        elif phase == "holding":
+            self.hold_secs += secs
+
+    def observe(self, battery):
+        """Fold one BatterySnapshot into the running values."""
+        if battery is None:
+            return
+        self.samples += 1
+        health = battery.health_percent
+        if health:
+            self.current_health = health
+            if self.initial_health is None:
+                self.initial_health = health
+        if battery.cycle_count is not None:
+            self.current_apple_cycles = battery.cycle_count
+            if self.initial_apple_cycles is None:
+                self.initial_apple_cycles = battery.cycle_count
+        t = battery.temperature
+        if t is not None:
+            if self.min_temperature is None or t < self.min_temperature:
+                self.min_temperature = t
+            if self.max_temperature is None or t > self.max_temperature:
+                self.max_temperature = t
+
+    def add_throughput(self, step):
+        """Add a throughput.Throughput (Coulomb-counted since the last reading)."""
+        self.discharged_mah += step.discharged_mah
+        self.charged_mah += step.charged_mah
+        self.equivalent_cycles += step.equivalent_cycles
+        self.delivered_wh += step.delivered_wh
+        self.absorbed_wh += step.absorbed_wh
+
+    # --- derived values ---
+
+    @property
+    def health_delta(self):
+        if self.initial_health is None or self.current_health is None:
+            return None
+        return self.current_health - self.initial_health
+
+    @property
+    def apple_cycles_added(self):
+        if self.initial_apple_cycles is None or self.current_apple_cycles is None:
+            return None
+        return self.current_apple_cycles - self.initial_apple_cycles
+
+    @property
+    def cycles_per_equivalent(self):
+        """Apple cycles added per equivalent full cycle of throughput."""
+        added = self.apple_cycles_added
+        if added is None or not self.equivalent_cycles:
+            return None
+        return added / self.equivalent_cycles
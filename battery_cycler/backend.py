@@ -0,0 +1,291 @@
+"""The battery backend protocol shared by the engine, the sampler and the GUI.
+
+A backend does four things to the battery:
+
+    read_snapshot()          -> BatterySnapshot or None (blocking; sampler thread)
+    await read_battery()     -> the same, without blocking the engine's loop
+    await set_charge(N)      -> charge towards N%          (`battery charge N`)
+    await set_discharge(N)   -> discharge on the adapter   (`battery discharge N`)
+    await hold(N)            -> maintain N%; hold(None) releases (`battery maintain N|stop`)
+
+The control calls return True when the change was applied. A backend also
+owns the machine-side chores the engine needs while cycling (keep_awake,
+allow_sleep, notify, and optionally watch for battery events) and says
+whether it can discharge at all (can_discharge); Backend
+gives no-op defaults.
+
+Implementations: macos.MacHardware (ioreg + battery CLI / SMC helper),
+linux.LinuxHardware (sysfs), sim.SimulatedHardware and ReplayBackend below,
+which plays back a recording made with Recorder. Wrap any of them in
+Instrumented to get per-operation call counts, failures and latencies in
+the metrics registry.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+
+from . import metrics
+from .ioreg import BatterySnapshot
+
+OPERATIONS = ("read_snapshot", "read_battery", "set_charge", "set_discharge", "hold")
+
+
+class Backend:
+    name = "backend"
+    # [(step, secs)] of the latest set_charge/set_discharge up to the point
+    # the change was applied, when the backend can tell (transitions.py)
+    command_stages = None
+
+    def read_snapshot(self):
+        raise NotImplementedError
+
+    async def read_battery(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_snapshot)
+
+    async def set_charge(self, target):
+        raise NotImplementedError
+
+    async def set_discharge(self, target):
+        raise NotImplementedError
+
+    async def hold(self, level):
+        raise NotImplementedError
+
+    def can_discharge(self):
+        """False if set_discharge can never drain the battery on the
+        adapter; the engine stops rather than wait for a discharge that
+        doesn't come."""
+        return True
+
+    def keep_awake(self):
+        """Hold sleep assertions; returns (name, pid) for any restarted."""
+        return []
+
+    def allow_sleep(self):
+        pass
+
+    def notify(self, title, message):
+        pass
+
+    def watch(self, callback):
+        """Call `callback()` on the running loop when the battery changes.
+        Returns False if the backend has no event source."""
+        return False
+
+    def unwatch(self):
+        pass
+
+
+def run_sync(coro):
+    """Run a backend call from a thread without an event loop (the UI)."""
+    return asyncio.run(coro)
+
+
+class Instrumented:
+    """Counts and times every backend operation.
+
+    Everything else (keep_awake, notify, attributes) is passed through to
+    the wrapped backend. Totals go to the metrics registry and to
+    `stats()`, which the benchmarks and Show Stats can read directly.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+    def _record(self, op, seconds, ok):
+        metrics.BACKEND_CALLS.inc(backend=self.name, op=op)
+        metrics.BACKEND_LATENCY.observe(seconds, backend=self.name, op=op)
+        if not ok:
+            metrics.BACKEND_FAILURES.inc(backend=self.name, op=op)
+        with self._lock:
+            entry = self._stats.setdefault(op, {"calls": 0, "failures": 0, "total_secs": 0.0, "max_secs": 0.0})
+            entry["calls"] += 1
+            entry["failures"] += 0 if ok else 1
+            entry["total_secs"] += seconds
+            entry["max_secs"] = max(entry["max_secs"], seconds)
+
+    def stats(self):
+        """{op: {calls, failures, total_secs, max_secs, mean_secs}}"""
+        with self._lock:
+            return {op: dict(entry, mean_secs=entry["total_secs"] / entry["calls"])
+                    for op, entry in self._stats.items()}
+
+    def read_snapshot(self):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = self.backend.read_snapshot()
+            return result
+        finally:
+            self._record("read_snapshot", time.perf_counter() - started, result is not None)
+
+    async def _timed(self, op, coro, ok=bool):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await coro
+            return result
+        finally:
+            self._record(op, time.perf_counter() - started, ok(result))
+
+    async def read_battery(self):
+        return await self._timed("read_battery", self.backend.read_battery(), lambda r: r is not None)
+
+    async def set_charge(self, target):
+        return await self._timed("set_charge", self.backend.set_charge(target))
+
+    async def set_discharge(self, target):
+        return await self._timed("set_discharge", self.backend.set_discharge(target))
+
+    async def hold(self, level):
+        return await self._timed("hold", self.backend.hold(level))
+
+
+class Recorder(Instrumented):
+    """Instrumented, plus every operation appended to a JSON-lines file
+    that ReplayBackend can play back."""
+
+    def __init__(self, backend, path):
+        super().__init__(backend)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _write(self, op, arg, result):
+        record = {"ts": round(time.time(), 3), "op": op}
+        if op in ("read_snapshot", "read_battery"):
+            record["op"] = "read"
+            record["battery"] = result.to_dict() if result is not None else None
+        else:
+            record["arg"] = arg
+            record["ok"] = bool(result)
+        with self._lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def read_snapshot(self):
+        result = super().read_snapshot()
+        self._write("read_snapshot", None, result)
+        return result
+
+    async def read_battery(self):
+        result = await super().read_battery()
+        self._write("read_battery", None, result)
+        return result
+
+    async def set_charge(self, target):
+        result = await super().set_charge(target)
+        self._write("set_charge", target, result)
+        return result
+
+    async def set_discharge(self, target):
+        result = await super().set_discharge(target)
+        self._write("set_discharge", target, result)
+        return result
+
+    async def hold(self, level):
+        result = await super().hold(level)
+        self._write("hold", level, result)
+        return result
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayBackend(Backend):
+    """Plays back a Recorder file: reads return the recorded snapshots in
+    order (the last one repeats once they run out, or the sequence starts
+    over with `loop`), control calls return the recorded result for that
+    operation and are kept in `calls` for inspection."""
+
+    name = "replay"
+
+    def __init__(self, path, loop=False):
+        self.reads = []
+        self.results = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a live recording
+                if record.get("op") == "read":
+                    battery = record.get("battery")
+                    self.reads.append(BatterySnapshot.from_dict(battery) if battery else None)
+                else:
+                    self.results.setdefault(record.get("op"), []).append(record.get("ok", True))
+        self.loop = loop
+        self.position = 0
+        self.calls = []
+
+    def read_snapshot(self):
+        if not self.reads:
+            return None
+        if self.position >= len(self.reads):
+            self.position = 0 if self.loop else len(self.reads) - 1
+        battery = self.reads[self.position]
+        self.position += 1
+        return battery
+
+    async def read_battery(self):
+        return self.read_snapshot()
+
+    def _control(self, op, arg):
+        self.calls.append((op, arg))
+        results = self.results.get(op)
+        return results.pop(0) if results else True
+
+    async def set_charge(self, target):
+        return self._control("set_charge", target)
+
+    async def set_discharge(self, target):
+        return self._control("set_discharge", target)
+
+    async def hold(self, level):
+        return self._control("hold", level)
+
+
+def default_backend():
+    """The real backend for this machine."""
+    if sys.platform == "darwin":
+        from .macos import MacHardware
+        return MacHardware("battery")
+    from .linux import LinuxHardware
+    return LinuxHardware()
+
+
+def main():
+    # python -m battery_cycler.backend record FILE - sample the real battery
+    # into a recording for ReplayBackend
+    parser = argparse.ArgumentParser(description="Record battery readings for ReplayBackend.")
+    parser.add_argument("command", choices=["record"])
+    parser.add_argument("file")
+    parser.add_argument("--count", type=int, default=60, help="readings to take")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between readings")
+    args = parser.parse_args()
+
+    recorder = Recorder(default_backend(), args.file)
+    try:
+        for i in range(args.count):
+            if i:
+                time.sleep(args.interval)
+            battery = recorder.read_snapshot()
+            print(battery.current_capacity if battery is not None else "no battery", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print(json.dumps(recorder.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
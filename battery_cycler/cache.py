@@ -0,0 +1,128 @@
+"""Shared on-disk cache for `system_profiler SPPowerDataType`.
+
+system_profiler is the slowest probe we run (1-3 s, up to 10 s on a busy
+machine) while the values we take from it - Maximum Capacity, Condition,
+Cycle Count - change a few times a day at most. The raw output is cached in
+~/.battery_cycler so battery_cycle.sh (get_power_profile) and the app share
+one copy. The cache expires after `ttl` seconds and is invalidated
+explicitly whenever a cycle completes, by deleting the file. When
+system_profiler fails or times out, the last good copy (stale or not) is
+served and the command isn't rerun for FAILURE_BACKOFF seconds.
+"""
+
+import os
+import threading
+import time
+
+from .paths import POWER_PROFILE_CACHE
+
+DEFAULT_TTL = 3600  # seconds; config key "profiler_cache_ttl"
+FAILURE_BACKOFF = 300  # seconds before retrying a failed system_profiler
+
+
+def fetch_power_profile():
+    from .probes import run_command
+    return run_command(["system_profiler", "SPPowerDataType"], timeout=10)
+
+
+def parse_power_profile(text):
+    """Pull the fields we use out of SPPowerDataType output.
+
+    Values are returned as displayed (strings), missing ones as None.
+    """
+    info = {"max_capacity": None, "condition": None, "cycle_count": None}
+    for line in text.split('\n'):
+        line = line.strip()
+        if ":" not in line:
+            continue
+        value = line.split(':')[-1].strip()
+        if line.startswith("Maximum Capacity") and info["max_capacity"] is None:
+            info["max_capacity"] = value
+        elif line.startswith("Condition") and info["condition"] is None:
+            info["condition"] = value
+        elif line.startswith("Cycle Count") and info["cycle_count"] is None:
+            info["cycle_count"] = value
+    return info
+
+
+class PowerProfileCache:
+    """TTL cache over a file, safe to use from several threads.
+
+    The parsed result is memoised against the file's (mtime, inode), so
+    repeated hits cost one stat() and no parsing; an invalidation by
+    another process (rm of the file) is noticed on the next get().
+    """
+
+    def __init__(self, path=POWER_PROFILE_CACHE, ttl=DEFAULT_TTL, fetch=fetch_power_profile):
+        self.path = path
+        self.ttl = ttl
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._memo_key = None
+        self._memo = None
+        self._retry_at = None  # time.time() at which a failed fetch may rerun
+
+    def get(self):
+        """Return parsed power info, running system_profiler only on a miss."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                st = None
+            if st is not None and time.time() - st.st_mtime < self.ttl:
+                key = (st.st_mtime_ns, st.st_ino)
+                if key != self._memo_key:
+                    self._memo = parse_power_profile(self._read())
+                    self._memo_key = key
+                return self._memo
+            if self._retry_at is not None and time.time() < self._retry_at:
+                return self._memo
+
+            text = self._fetch()
+            if not text:
+                # Keep the last good values rather than blanking them, and
+                # don't rerun a failing or hanging command on every refresh
+                self._retry_at = time.time() + FAILURE_BACKOFF
+                if self._memo is None:
+                    self._memo = parse_power_profile(self._read() if st is not None else "")
+                return self._memo
+            self._retry_at = None
+            self._memo = parse_power_profile(text)
+            self._memo_key = self._store(text)
+            return self._memo
+
+    def invalidate(self):
+        """Drop the cached copy (call when a cycle completes)."""
+        with self._lock:
+            self._memo_key = None
+            self._memo = None
+            self._retry_at = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read().decode('utf-8', 'replace')
+        except OSError:
+            return ""
+
+    def _store(self, text):
+        if not text:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = "{}.{}".format(self.path, os.getpid())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_ino)
+        except OSError:
+            return None
+
+
+# Process-wide instance used by the probes and the stats dialog
+power_profile = PowerProfileCache()
@@ -0,0 +1,61 @@
+"""Time source for the cycling engine.
+
+The engine never calls time.time() or sleeps directly; it asks its clock.
+SystemClock is the real thing. VirtualClock (used by the simulator, see
+sim.py) jumps straight to the end of every wait, so days of cycling run in
+seconds with the same controller code.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class SystemClock:
+    def time(self):
+        return time.time()
+
+    async def wait(self, event, timeout):
+        """Wait for asyncio `event` or `timeout` seconds. True if it was set."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class VirtualClock:
+    """Simulated time: waits return at once and move the clock forward."""
+
+    def __init__(self, start=None):
+        self.now = float(time.time() if start is None else start)
+        self._alarms = []
+        self._order = itertools.count()
+
+    def time(self):
+        return self.now
+
+    def advance(self, secs):
+        self.now += secs
+
+    def call_at(self, when, callback):
+        """Run `callback()` when a wait reaches virtual time `when`."""
+        heapq.heappush(self._alarms, (when, next(self._order), callback))
+
+    async def wait(self, event, timeout):
+        # Yield so callbacks queued from other threads (stop, hold) get a
+        # chance to set the event before time jumps
+        await asyncio.sleep(0)
+        if event.is_set():
+            return True
+        deadline = self.now + timeout
+        while self._alarms and self._alarms[0][0] <= deadline:
+            when, _, callback = heapq.heappop(self._alarms)
+            self.now = max(self.now, when)
+            callback()
+            await asyncio.sleep(0)
+            if event.is_set():
+                return True
+        self.now = deadline
+        return False
@@ -0,0 +1,115 @@
+"""Settings in ~/battery_cycle_config.json, shared by the app and
+battery_cycle.sh.
+
+ConfigStore re-reads the file only when its (mtime, inode, size) stamp
+changes, so checking for edits costs a single stat(). Subscribers are
+called with the set of changed keys whenever the config changes, either
+through save() in this process or an edit picked up by reload().
+"""
+
+import json
+import os
+import threading
+
+from .paths import CONFIG_FILE
+
+DEFAULT_CONFIG = {
+    "upper_limit": 80,
+    "lower_limit": 20,
+    "pause_limit": 50,
+    "reset_limit": 80,
+    "cpu_stress": "high",  # off, low, medium, high
+    "gpu_stress": "off",   # off, low, medium, high
+    "discharge_target_watts": 0,    # closed-loop CPU stress, 0 = use cpu_stress
+    "discharge_target_minutes": 0,  # or: reach lower_limit in this long, 0 = off
+    "stress_standby": False,  # suspend stress workers while charging instead of killing them
+    "profiler_cache_ttl": 3600,  # seconds to reuse system_profiler output
+    "adaptive_polling": True,  # poll less often while far from a limit
+    "predictive_switching": False,  # switch ahead of a limit by the measured switch latency
+    "metrics_port": 0,  # Prometheus endpoint, 0 = off
+    "metrics_address": "127.0.0.1"
+}
+
+
+def _normalize(config):
+    """Merge defaults and migrate old boolean stress settings."""
+    for key in DEFAULT_CONFIG:
+        if key not in config:
+            config[key] = DEFAULT_CONFIG[key]
+    for key in ("cpu_stress", "gpu_stress"):
+        if isinstance(config[key], bool):
+            config[key] = "high" if config[key] else "off"
+        else:
+            config[key] = str(config[key]).lower()
+    return config
+
+
+class ConfigStore:
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.data = DEFAULT_CONFIG.copy()
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._saved = dict(self.data)
+        self._listeners = []
+        self.reload()
+
+    def subscribe(self, callback):
+        """Call `callback(changed_keys, config)` after every change."""
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def get(self):
+        """Return the current config, re-reading the file if it changed."""
+        self.reload()
+        return self.data
+
+    def reload(self):
+        """Re-parse the file if its stamp changed. Returns True on change."""
+        with self._lock:
+            stamp = self._stat()
+            if stamp is None or stamp == self._stamp:
+                return False
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+            except (OSError, ValueError):
+                # Missing or half-written - keep the last good values
+                return False
+            self._stamp = stamp
+            # Update in place so holders of `data` see the new values
+            self.data.clear()
+            self.data.update(_normalize(loaded))
+            return self._changed()
+
+    def save(self):
+        """Write `data` atomically and notify subscribers of what changed."""
+        with self._lock:
+            tmp = "{}.{}".format(self.path, os.getpid())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp, self.path)
+            self._stamp = self._stat()
+            self._changed()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _changed(self):
+        changed = {k for k in set(self.data) | set(self._saved)
+                   if self.data.get(k) != self._saved.get(k)}
+        self._saved = dict(self.data)
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(changed, self.data)
+                except Exception as e:
+                    print(f"config listener failed: {e}")
+        return bool(changed)
@@ -0,0 +1,92 @@
+"""Closed-loop discharge: hold the battery drain at a target power.
+
+The fixed low/medium/high stress levels drain at whatever rate the
+machine, its thermals and the room make of them. With a target discharge
+power ("discharge_target_watts") or a target discharge duration
+("discharge_target_minutes", turned into the power that would reach the
+lower limit on time), DrainController compares the measured battery power
+with the target on every engine tick and sets the CPU stress load, in
+worker-equivalents: e.g. 4.6 = 5 stress-ng workers each gated to a 92%
+duty cycle (see stress.StressManager.set_cpu_load).
+
+The controller is a velocity-form PI loop, so clamping the load to
+[0, max_workers] can't wind it up. Worker count only changes when the
+load leaves the band the current count covers, since changing it means
+restarting stress-ng; the duty cycle takes up the rest.
+"""
+
+import math
+
+# Load per watt of error, and per watt-second of accumulated error. One
+# stress-ng CPU worker draws roughly 2-5 W on current laptops.
+KP = 0.08
+KI = 0.0008
+# Starting guess while the loop settles: watts per worker, idle draw
+WATTS_PER_WORKER = 3.5
+IDLE_WATTS = 6.0
+# Keep the current worker count while load stays above count - 1 - this
+WORKER_HYSTERESIS = 0.25
+MIN_DUTY = 0.1
+
+
+def target_watts(config, battery_percent, lower_limit, elapsed_secs, capacity_wh):
+    """The discharge power to aim for, or None when not in closed-loop mode.
+
+    A duration target asks for the power that drains what is left above
+    the lower limit in the time left; once overdue, as fast as possible.
+    """
+    watts = config.get("discharge_target_watts") or 0
+    minutes = config.get("discharge_target_minutes") or 0
+    if minutes > 0 and capacity_wh and battery_percent is not None:
+        remaining = minutes * 60 - (elapsed_secs or 0)
+        if remaining <= 0:
+            return float("inf")
+        to_drain_wh = max(0.0, battery_percent - lower_limit) / 100.0 * capacity_wh
+        return to_drain_wh * 3600 / remaining
+    if watts > 0:
+        return float(watts)
+    return None
+
+
+class DrainController:
+    def __init__(self, max_workers, kp=KP, ki=KI):
+        self.max_workers = max(1, max_workers)
+        self.kp = kp
+        self.ki = ki
+        self.load = None
+        self.workers = 0
+        self.duty = 1.0
+        self._error = None
+
+    def reset(self, target):
+        """Start a discharge phase from an open-loop guess for `target` W."""
+        guess = (min(target, 1e6) - IDLE_WATTS) / WATTS_PER_WORKER
+        self.load = max(0.0, min(float(self.max_workers), guess))
+        self._error = None
+        return self._split()
+
+    def update(self, dt, target, measured):
+        """One step with measured discharge power `measured` (positive W).
+        Returns (workers, duty)."""
+        if self.load is None:
+            return self.reset(target)
+        if measured is None or dt <= 0:
+            return self._split()
+        error = min(target, 1e6) - measured
+        previous = self._error if self._error is not None else error
+        self.load += self.kp * (error - previous) + self.ki * error * dt
+        self.load = max(0.0, min(float(self.max_workers), self.load))
+        self._error = error
+        return self._split()
+
+    def _split(self):
+        load = self.load
+        if load < MIN_DUTY:
+            self.workers, self.duty = 0, 1.0
+            return self.workers, self.duty
+        workers = self.workers
+        if not workers or load > workers or load < workers - 1 - WORKER_HYSTERESIS:
+            workers = min(self.max_workers, max(1, int(math.ceil(load))))
+        self.workers = workers
+        self.duty = max(MIN_DUTY, min(1.0, load / workers))
+        return self.workers, self.duty
@@ -0,0 +1,701 @@
+"""In-process cycling controller, replacing the battery_cycle.sh loop.
+
+CyclingEngine is a small state machine (charging / discharging / holding)
+running on an asyncio loop in its own thread. A tick costs one ioreg probe:
+limits and stress levels come from the app's in-memory config, stress
+workers are tracked by handle instead of pgrep, and the state file and logs
+are journaled from Python (see journal.py). Health samples and cycle events go
+to the SQLite history store (store.py), and the Show Stats totals are kept
+up to date as it runs (aggregates.py). The log format and legacy state
+file match battery_cycle.sh's, so either controller can resume the other's
+run.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from . import probes
+from .aggregates import SessionAggregates
+from .cache import power_profile
+from .clock import SystemClock
+from .drain import DrainController, target_watts
+from .journal import JOURNAL_SEQ_KEY, StateJournal
+from .paths import LOG_FILE
+from .polling import AdaptivePoller
+from .rate import RateEstimator, battery_level, battery_watts
+from .store import HistoryStore
+from .stress import CLOSED_LOOP
+from .throughput import CoulombCounter, Throughput
+from .transitions import Transition, TransitionStats, crossing_time
+
+CHARGING = "charging"
+DISCHARGING = "discharging"
+HOLDING = "holding"
+
+CHECK_INTERVAL = 10  # seconds between ticks
+# Config keys that should be acted on right away rather than at the next tick
+LIVE_CONFIG_KEYS = {"upper_limit", "lower_limit", "cpu_stress", "gpu_stress",
+                    "discharge_target_watts", "discharge_target_minutes", "stress_standby",
+                    "predictive_switching"}
+THROTTLE_WARNING_SECS = 60
+# Time counters are journaled at most this often; transitions always are
+JOURNAL_INTERVAL = 60
+# Periodic (non-event) rows in the history store
+SAMPLE_INTERVAL = 60
+CLI_VERBS = {"set_charge": "charge", "set_discharge": "discharge", "hold": "maintain"}
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+class CyclingEngine:
+    """Cycles the battery between the configured limits.
+
+    `hardware` is a battery backend (see backend.py), `stress` is a
+    StressManager and `config` a config.ConfigStore; edits to limits or
+    stress levels wake the engine immediately. `clock` and `profile` (the
+    system_profiler cache) are swapped out by the simulator. The
+    start/stop/hold/resume methods are safe to call from the UI thread.
+    """
+
+    def __init__(self, hardware, stress, config, interval=CHECK_INTERVAL,
+                 journal=None, store=None, log_file=LOG_FILE, clock=None, profile=power_profile):
+        self.hw = hardware
+        self.clock = clock if clock is not None else SystemClock()
+        self.profile = profile
+        self.stress = stress
+        self.stress.log = self.log
+        self.config = config
+        self.interval = interval
+        # Charge/discharge rate, and the time to the next tick adapted to
+        # the distance from the next limit
+        self.rate_estimator = RateEstimator()
+        self.poller = AdaptivePoller(interval, self.rate_estimator)
+        self.next_wait = interval
+        # Sets the CPU load when discharging to a target power or duration
+        self.drain = DrainController(os.cpu_count() or 4)
+        self.drain_target = None
+        self._last_drain = None
+        self.journal = journal if journal is not None else StateJournal()
+        self.log_file = log_file
+        self.store = store
+        self.session_id = None
+
+        self.state = "unknown"
+        self.hold_level = None
+        self.cycles = 0
+        self.percent = None
+        # State of charge the limits are checked against: from the raw mAh
+        # counters when the backend has them, else `percent`
+        self.level = None
+        self.resolution = 1.0
+        self.battery = None  # latest BatterySnapshot
+        self.aggregates = SessionAggregates()
+        # Coulomb-counted mAh moved, for the session (in aggregates) and
+        # the cycle in progress
+        self.coulombs = CoulombCounter()
+        self.cycle_throughput = Throughput()
+        self.transition_stats = TransitionStats()
+        self.stopping = False
+
+        self._persisted = {}
+        self._last_journaled = 0
+        self._last_sample = 0
+        self._last_check = None
+        self._last_stress_check = None
+        self._maintain_on_stop = 80
+        self._thread = None
+        self._loop = None
+        self._stop_event = None
+        self._wake = None
+        self._lock = None
+        self._stress_levels = None
+        self._transition = None  # phase switch being timed
+
+    # --- UI thread API ---
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._thread_main, args=(ready,),
+                                        name="cycling-engine", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, maintain_level=80):
+        """Stop cycling; the battery is left maintaining `maintain_level`."""
+        if not self.running or self.stopping:
+            return
+        self.stopping = True
+        self._maintain_on_stop = maintain_level
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def hold(self, level):
+        """Pause cycling and hold the battery at `level` percent."""
+        self._submit(self._hold(level))
+
+    def resume(self):
+        """Leave the holding state and continue cycling."""
+        self._submit(self._resume())
+
+    def estimate(self, config=None):
+        """Current rate (%/h), battery power (W) and ETA to the limit the
+        phase is heading for, as a rate.Estimate; None until known."""
+        return self.rate_estimator.estimate(self._targets(config or self.config.get()))
+
+    def _targets(self, config):
+        if self.state == DISCHARGING:
+            return [config["lower_limit"]]
+        if self.state == CHARGING:
+            return [config["upper_limit"]]
+        return []
+
+    def _submit(self, coro):
+        if self.running and not self.stopping:
+            asyncio.run_coroutine_threadsafe(coro, self._loop)
+        else:
+            coro.close()
+
+    def _thread_main(self, ready):
+        # Create the loop's primitives on this thread with the loop current,
+        # so they bind to it on Python versions that bind at construction
+        asyncio.set_event_loop(self._loop)
+        self._stop_event = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.config.subscribe(self._on_config_change)
+        ready.set()
+        try:
+            self._loop.run_until_complete(self.run())
+        finally:
+            self.config.unsubscribe(self._on_config_change)
+            self._loop.close()
+
+    def _on_config_change(self, changed, config):
+        # May be called from the UI thread (save) or the engine (reload)
+        if changed & LIVE_CONFIG_KEYS and self.running and not self.stopping:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # --- engine loop ---
+
+    async def run(self):
+        try:
+            async with self._lock:
+                await self._startup()
+            while not self._stop_event.is_set():
+                await self.clock.wait(self._wake, self.next_wait)
+                self._wake.clear()
+                if self._stop_event.is_set():
+                    break
+                async with self._lock:
+                    try:
+                        await self.tick()
+                    except Exception as e:
+                        self.log("ERROR: {}".format(e))
+        except Exception as e:
+            self.log("ERROR: Engine failed: {}".format(e))
+        finally:
+            async with self._lock:
+                await self._shutdown()
+
+    async def _startup(self):
+        saved = self.journal.load_state()
+        self.cycles = _int(saved.get("TOTAL_DISCHARGE_CYCLES"))
+        self.state = saved.get("CURRENT_STATE") or "unknown"
+        self._persisted = saved
+        self.aggregates = SessionAggregates.from_state(saved)
+        self.cycle_throughput = Throughput.from_dict(saved.get("CYCLE_THROUGHPUT"))
+        self._last_check = self.clock.time()
+        if self.store is None:
+            self.store = HistoryStore()
+        self.hw.keep_awake()
+        # Backends that get battery/adapter events (linux.py) wake us early
+        if self._wake is not None:
+            self.hw.watch(self._wake.set)
+
+        config = self.config.get()
+        self.log("========== SCRIPT STARTED ==========")
+        self.log("CONFIG: Upper={}% Lower={}% Interval={}s".format(
+            config["upper_limit"], config["lower_limit"], self.interval))
+        self.log("MODE: In-app engine ({} backend)".format(self.hw.name))
+        self.log("RESUMED: {} cycles completed previously".format(self.cycles))
+        if not self.hw.can_discharge():
+            # Every discharge phase would sit on the adapter forever
+            self.log("ERROR: The {} backend can't discharge this battery on the adapter - stopping".format(
+                self.hw.name))
+            self.hw.notify("Battery Cycling Stopped", "This battery can't be discharged while plugged in")
+            self.stopping = True
+            self._stop_event.set()
+            return
+
+        # The last Stop left a `battery maintain` daemon rewriting the
+        # charging keys. The CLI's charge/discharge stop it themselves, the
+        # SMC helper's key writes don't, so stop it once before any switch
+        await self._battery("hold", None)
+
+        battery = await self.hw.read_battery()
+        agg = self.aggregates
+        first_run = agg.initial_health is None
+        agg.observe(battery)
+        self._count_throughput(battery)
+        if battery is not None and _int(saved.get("CYCLE_APPLE_CYCLES"), None) is None:
+            self._persisted["CYCLE_APPLE_CYCLES"] = battery.cycle_count
+        if first_run and agg.initial_health is not None:
+            self.save_state("initial_health")
+
+        self.session_id = self.store.begin_session(config, agg.initial_health, agg.initial_apple_cycles,
+                                                   ts=self.clock.time())
+        await self.log_health("script_started", battery)
+        legacy = agg.legacy_fields()
+        self.log("INITIAL HEALTH: {}% | Apple Cycles: {}".format(
+            legacy["INITIAL_HEALTH"], legacy["INITIAL_APPLE_CYCLES"]))
+        self.hw.notify("Battery Cycling Started", "Range: {}% to {}%".format(
+            config["lower_limit"], config["upper_limit"]))
+
+        await self._enter_cycling(config, battery, "INITIAL")
+
+    async def _enter_cycling(self, config, battery, reason):
+        # If above lower limit, discharge first. If at/below lower limit, charge.
+        await self._read_percent(battery)
+        lower = config["lower_limit"]
+        if self.level > lower:
+            await self._start_discharge(config)
+            self.state = DISCHARGING
+            self._persisted["CYCLE_START_TIME"] = str(int(self.clock.time()))
+            self.log("{}: Battery at {}% > {}%, starting discharge".format(reason, self._level_text(), lower))
+            self._event("discharge_start", self.cycles + 1)
+        else:
+            await self._start_charge(config)
+            self.state = CHARGING
+            self._persisted["CHARGE_START_TIME"] = str(int(self.clock.time()))
+            self.log("{}: Battery at {}% <= {}%, starting charge".format(reason, self._level_text(), lower))
+            self._event("charge_start", self.cycles)
+        self.save_state(self.state)
+
+    async def tick(self):
+        """One controller iteration: probe once, switch phase if a limit is hit."""
+        config = self.config.get()
+        self._update_time_stats()
+
+        read_started = self.clock.time()
+        battery = await self.hw.read_battery()
+        percent = await self._read_percent(battery)
+        read_done = self.clock.time()
+        self.aggregates.observe(battery)
+        self._count_throughput(battery)
+
+        if self.state != HOLDING:
+            for name, pid in self.hw.keep_awake():
+                self.log("{}: Process died, restarted (PID: {})".format(name, pid))
+        self._ensure_stress(config)
+
+        if self.state != HOLDING:
+            if self._at_limit(config, DISCHARGING, config["lower_limit"], self.level <= config["lower_limit"]):
+                if self.state != CHARGING:
+                    self._begin_transition(CHARGING, config["lower_limit"], read_started, read_done)
+                    await self._complete_discharge(config, battery, percent)
+                    self._end_transition()
+            elif self._at_limit(config, CHARGING, config["upper_limit"], self.level >= config["upper_limit"]):
+                if self.state != DISCHARGING:
+                    self._begin_transition(DISCHARGING, config["upper_limit"], read_started, read_done)
+                    await self._complete_charge(config, battery, percent)
+                    self._end_transition()
+        if self.clock.time() - self._last_sample >= SAMPLE_INTERVAL:
+            self.stress.sample_cpu()
+            self._record_sample(battery)
+        self.store.maybe_flush()
+        if self.clock.time() - self._last_journaled >= JOURNAL_INTERVAL:
+            self.save_state("tick", durable=False)
+        self._schedule(config)
+
+    def _schedule(self, config):
+        """Pick the wait before the next tick from the predicted time to the
+        limit the current phase is heading for."""
+        self.rate_estimator.observe(self.clock.time(), self.battery, self.percent, self.state)
+        if not config.get("adaptive_polling", True):
+            self.next_wait = self.interval
+            return
+        lead = 0.0
+        if config.get("predictive_switching") and self.state in (CHARGING, DISCHARGING):
+            lead = self.transition_stats.lead(CHARGING if self.state == DISCHARGING else DISCHARGING)
+        self.next_wait = self.poller.next_interval(self.level, self._targets(config), self.resolution, lead)
+
+    def _at_limit(self, config, phase, limit, reached):
+        """Whether to switch out of `phase` at `limit`. `reached` is the
+        latest reading's verdict; with predictive switching, once
+        the rate is known, the switch is instead made when the level is
+        due at the limit within the time a switch typically takes."""
+        if not config.get("predictive_switching") or self.state != phase:
+            return reached
+        estimator = self.rate_estimator
+        rate = estimator.rate
+        if not estimator.ready or not rate or (rate > 0) != (phase == CHARGING):
+            return reached
+        kind = CHARGING if phase == DISCHARGING else DISCHARGING
+        return (limit - self.level) / rate <= self.transition_stats.lead(kind)
+
+    def _begin_transition(self, kind, limit, read_started, read_done):
+        # The estimator hasn't seen this reading yet (see _schedule), so it
+        # still extrapolates from before the crossing
+        estimator = self.rate_estimator
+        crossed = crossing_time(estimator, limit, kind == CHARGING, read_started, self.resolution)
+        self._transition = Transition(kind, read_started, read_done, crossed, limit=limit, level=self.level,
+                                      rate=estimator.rate if estimator.ready else None)
+
+    def _mark(self, stage):
+        if self._transition is not None:
+            self._transition.mark(stage, self.clock.time())
+
+    def _end_transition(self):
+        transition, self._transition = self._transition, None
+        if transition is None:
+            return
+        self.transition_stats.add(transition)
+        self.log("SWITCH: {} applied in {}".format(transition.kind, transition.describe()))
+
+    async def _complete_discharge(self, config, battery, percent):
+        now = int(self.clock.time())
+        started = _int(self._persisted.get("CYCLE_START_TIME"))
+        duration = now - started if started > 0 else None
+        if duration is not None:
+            self.log("DISCHARGE COMPLETE - Took {} minutes".format(duration // 60))
+
+        self.cycles += 1
+        # Make the completed cycle durable before anything else can fail
+        self.save_state("discharge_complete")
+        self._event("discharge_complete", self.cycles, duration)
+        self.log("CYCLE #{} - Started charging at {}%".format(self.cycles, self._level_text()))
+
+        # Switch first: the health log below may wait seconds on system_profiler
+        await self._stop_discharge(config)
+        # Apple's Cycle Count/Maximum Capacity may have moved with this cycle
+        self.profile.invalidate()
+        await self.log_health("discharge_complete", battery)
+        health = battery.health_percent if battery is not None else None
+        self.hw.notify("Cycle {} Complete".format(self.cycles),
+                       "Discharge done. Health: {}% | Now charging to {}%".format(
+                           "{:.2f}".format(health) if health else "N/A", config["upper_limit"]))
+
+        self.state = CHARGING
+        self._persisted["CHARGE_START_TIME"] = str(now)
+        self.save_state(CHARGING)
+
+    async def _complete_charge(self, config, battery, percent):
+        now = int(self.clock.time())
+        started = _int(self._persisted.get("CHARGE_START_TIME"))
+        duration = now - started if started > 0 else None
+        if duration is not None:
+            self.log("CHARGE COMPLETE - Took {} minutes".format(duration // 60))
+        self.log("CYCLE #{} - Started discharging at {}%".format(self.cycles + 1, self._level_text()))
+
+        await self._start_discharge(config)
+        # Only once the switch has been made, so a failing one can't record
+        # the same cycle again on every later tick
+        self._event("charge_complete", self.cycles + 1, duration)
+        self._end_cycle(battery)
+        await self.log_health("charge_complete", battery)
+        self.hw.notify("Charge Complete", "Battery at {}%. Starting discharge cycle #{}".format(
+            percent, self.cycles + 1))
+
+        self.state = DISCHARGING
+        self._persisted["CYCLE_START_TIME"] = str(now)
+        self.save_state(DISCHARGING)
+
+    async def _hold(self, level):
+        async with self._lock:
+            if self.stress.cpu_running or self.stress.gpu_running:
+                self.stress.stop()
+            await self._battery("hold", level)
+            self.hw.allow_sleep()
+            self.state = HOLDING
+            self.hold_level = level
+            self.log("PAUSED: Holding at {}%".format(level))
+            self._event("hold", self.cycles)
+            self.save_state(HOLDING)
+
+    async def _resume(self):
+        async with self._lock:
+            if self.state != HOLDING:
+                return
+            self.hw.keep_awake()
+            await self._battery("hold", None)
+            self.hold_level = None
+            self.log("RESUMED: Cycling from hold")
+            self._event("resume", self.cycles)
+            await self._enter_cycling(self.config.get(), await self.hw.read_battery(), "RESUME")
+
+    async def _shutdown(self):
+        self.log("========== SCRIPT STOPPED ==========")
+        await self.log_health("script_stopped", await self.hw.read_battery())
+        self.hw.allow_sleep()
+        self.stress.stop()
+        self.hw.unwatch()
+
+        # Restore battery to normal state (maintain at the reset level)
+        await self._battery("hold", self._maintain_on_stop)
+        self._update_time_stats()
+        self.save_state("stopped")
+        try:
+            self.journal.checkpoint()
+        except OSError as e:
+            self.log("WARNING: State checkpoint failed: {}".format(e))
+        self.journal.close()
+        if self.store is not None:
+            if self.session_id is not None:
+                self._event("stopped", self.cycles)
+                self.store.end_session(self.session_id, ts=self.clock.time())
+            self.store.close()
+
+    # --- phase actions ---
+
+    async def _start_discharge(self, config):
+        # Set battery to discharge to lower limit
+        self._mark("prepare")
+        await self._battery("set_discharge", config["lower_limit"])
+        self.log("BATTERY: Discharge enabled (target: {}%)".format(config["lower_limit"]))
+        levels = self._levels(config)
+        if self.stress.suspended:
+            # Warm standby from the last discharge - reuse it if the levels still match
+            if levels == self._stress_levels:
+                self.stress.resume()
+            else:
+                self.stress.stop()
+        self._stress_levels = levels
+        self.stress.start(*levels)
+        if self._stress_levels[0] == CLOSED_LOOP:
+            self._drive_stress(config, elapsed=0, reset=True)
+        self._mark("stress")
+
+    async def _start_charge(self, config):
+        await self._battery("set_charge", config["upper_limit"])
+        self.log("BATTERY: Charging enabled (target: {}%)".format(config["upper_limit"]))
+
+    async def _stop_discharge(self, config):
+        self._mark("prepare")
+        if config.get("stress_standby"):
+            self.stress.suspend()
+        else:
+            self.stress.stop()
+        self._mark("stress")
+        await self._start_charge(config)
+
+    async def _battery(self, op, arg):
+        ok = await getattr(self.hw, op)(arg)
+        if self._transition is not None and op != "hold":
+            self._transition.command(self.clock.time(), self.hw.command_stages)
+        if not ok:
+            # Named after the battery CLI command, as battery_cycle.sh logs it
+            self.log("WARNING: Battery command '{} {}' failed or timed out".format(
+                CLI_VERBS[op], "stop" if arg is None else arg))
+
+    def _ensure_stress(self, config):
+        now = self.clock.time()
+        expected = self.next_wait
+        if self._last_stress_check is not None and now - self._last_stress_check > max(THROTTLE_WARNING_SECS, 2 * expected):
+            self.log("WARNING: Check interval was {}s (expected ~{}s) - timer may have been throttled".format(
+                int(now - self._last_stress_check), int(expected)))
+        self._last_stress_check = now
+
+        # Only run stress during discharge - stop any stragglers otherwise
+        if self.state != DISCHARGING:
+            if self.stress.suspended and config.get("stress_standby") and self.state == CHARGING:
+                return
+            if self.stress.cpu_running:
+                self.stress.stop_cpu()
+                self.log("CPU-STRESS: Killed (not in discharge mode)")
+            if self.stress.gpu_running:
+                self.stress.stop_gpu()
+                self.log("GPU-STRESS: Killed (not in discharge mode)")
+            return
+        levels = self._levels(config)
+        if levels != self._stress_levels:
+            # Level changed from the menu mid-discharge - restart at the new level
+            self.log("STRESS: Level changed to CPU={} GPU={}".format(*levels))
+            self.stress.stop()
+            self._stress_levels = levels
+            self.stress.start(*levels)
+            if levels[0] == CLOSED_LOOP:
+                self._drive_stress(config, reset=True)
+            return
+        self.stress.ensure(*levels)
+        if levels[0] == CLOSED_LOOP:
+            self._drive_stress(config)
+
+    def _drive_stress(self, config, elapsed=None, reset=False):
+        """Closed-loop step: set the CPU load from the gap between the
+        target discharge power and the measured one (see drain.py)."""
+        now = self.clock.time()
+        battery = self.battery
+        if elapsed is None:
+            started = _int(self._persisted.get("CYCLE_START_TIME"))
+            elapsed = now - started if started > 0 else 0
+        capacity_wh = None
+        if battery is not None and battery.raw_max_capacity and battery.voltage:
+            capacity_wh = battery.raw_max_capacity * battery.voltage / 1e6
+        level = self.rate_estimator.level if self.rate_estimator.ready else self.level
+        target = target_watts(config, level, config["lower_limit"], elapsed, capacity_wh)
+        if target is None:
+            return
+        if reset or self._last_drain is None:
+            workers, duty = self.drain.reset(target)
+            self.log("DRAIN: Targeting {} discharge".format(
+                "maximum" if target == float("inf") else "{:.1f} W".format(target)))
+        else:
+            watts = battery_watts(battery)
+            if watts is None:
+                watts = self.rate_estimator.watts
+            measured = -watts if watts is not None else None
+            workers, duty = self.drain.update(now - self._last_drain, target, measured)
+        self._last_drain = now
+        self.drain_target = target
+        self.stress.set_cpu_load(workers, duty)
+
+    @staticmethod
+    def _levels(config):
+        if (config.get("discharge_target_watts") or 0) > 0 or (config.get("discharge_target_minutes") or 0) > 0:
+            return (CLOSED_LOOP, config["gpu_stress"])
+        return (config["cpu_stress"], config["gpu_stress"])
+
+    async def _read_percent(self, battery):
+        self.battery = battery
+        if battery is not None and battery.current_capacity is not None:
+            self.percent = battery.current_capacity
+        else:
+            # ioreg failed - fall back to pmset
+            loop = asyncio.get_running_loop()
+            self.percent, _ = await loop.run_in_executor(None, probes.read_pmset_batt)
+        self.level, self.resolution = battery_level(battery, self.percent)
+        return self.percent
+
+    def _level_text(self):
+        """The level for log lines: two decimals when finer than a percent."""
+        if self.resolution < 1:
+            return "{:.2f}".format(self.level)
+        return str(self.percent)
+
+    # --- bookkeeping ---
+
+    def _update_time_stats(self):
+        now = self.clock.time()
+        elapsed = int(now - self._last_check)
+        if elapsed <= 0:
+            return
+        self._last_check += elapsed
+        self.aggregates.add_time(self.state, elapsed)
+
+    def save_state(self, event, durable=True):
+        """Journal the current state; transitions are fsync'd (`durable`)."""
+        self._persisted["TOTAL_DISCHARGE_CYCLES"] = self.cycles
+        self._persisted["CURRENT_STATE"] = self.state
+        self._persisted.update(self.aggregates.legacy_fields())
+        self._persisted["AGGREGATES"] = self.aggregates.to_dict()
+        self._persisted["CYCLE_THROUGHPUT"] = self.cycle_throughput.to_dict()
+        self._persisted.pop(JOURNAL_SEQ_KEY, None)
+        try:
+            self.journal.append(dict(self._persisted), event, durable, ts=self.clock.time())
+            self._last_journaled = self.clock.time()
+        except OSError as e:
+            self.log("WARNING: Saving state failed: {}".format(e))
+
+    def log(self, message):
+        line = "{} | {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.clock.time())), message)
+        try:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError:
+            print(line)
+
+    def _count_throughput(self, battery):
+        step = self.coulombs.observe(battery)
+        if step is not None:
+            self.aggregates.add_throughput(step)
+            self.cycle_throughput.add(step)
+
+    def _end_cycle(self, battery):
+        """Record the throughput and energy of the cycle that ends as this
+        charge does (discharge #cycles and its recharge), with the Apple
+        cycles it added."""
+        throughput, self.cycle_throughput = self.cycle_throughput, Throughput()
+        apple = battery.cycle_count if battery is not None else None
+        started_apple = _int(self._persisted.get("CYCLE_APPLE_CYCLES"), None)
+        added = apple - started_apple if apple is not None and started_apple is not None else None
+        self.log("THROUGHPUT: Cycle #{} moved {}{} | Apple cycles added: {}".format(
+            self.cycles, throughput.describe(),
+            " ({}s bridged)".format(int(throughput.gap_secs)) if throughput.gap_secs else "",
+            "N/A" if added is None else added))
+        self.log("ENERGY: Cycle #{} {}".format(self.cycles, throughput.describe_energy()))
+        self.store.add_cycle(ts=self.clock.time(), session_id=self.session_id, cycle=self.cycles,
+                             started_at=_int(self._persisted.get("CYCLE_START_TIME"), None),
+                             discharged_mah=round(throughput.discharged_mah, 1),
+                             charged_mah=round(throughput.charged_mah, 1),
+                             equivalent_cycles=round(throughput.equivalent_cycles, 4),
+                             gap_secs=round(throughput.gap_secs), apple_cycles_added=added,
+                             delivered_wh=round(throughput.delivered_wh, 2),
+                             absorbed_wh=round(throughput.absorbed_wh, 2),
+                             discharge_avg_watts=_round(throughput.discharge_watts),
+                             discharge_peak_watts=round(throughput.peak_discharge_watts, 1),
+                             charge_avg_watts=_round(throughput.charge_watts),
+                             charge_peak_watts=round(throughput.peak_charge_watts, 1),
+                             adapter_wh=round(throughput.adapter_wh, 2),
+                             adapter_avg_watts=_round(throughput.adapter_watts),
+                             adapter_peak_watts=round(throughput.peak_adapter_watts, 1))
+        self._persisted["CYCLE_APPLE_CYCLES"] = apple if apple is not None else ""
+
+    def _event(self, event, cycle, duration=None):
+        self.store.add_event(event, cycle, percent=self.percent, duration_secs=duration,
+                             session_id=self.session_id, ts=self.clock.time())
+
+    def _record_sample(self, battery, **fields):
+        b = battery
+        if b is not None:
+            fields.update(
+                apple_cycles=b.cycle_count,
+                max_capacity_mah=b.nominal_capacity,
+                design_capacity_mah=b.design_capacity,
+                calc_health=b.health_percent,
+                temperature_c=b.temperature,
+                voltage_mv=b.voltage,
+                amperage_ma=b.amperage,
+            )
+        self.store.add_sample(ts=self.clock.time(), session_id=self.session_id,
+                              script_cycles=self.cycles, percent=self.percent, **fields)
+        self._last_sample = self.clock.time()
+
+    async def log_health(self, event, battery=None):
+        """Record a health sample in the history store and a HEALTH log line."""
+        loop = asyncio.get_running_loop()
+        profile = await loop.run_in_executor(None, self.profile.get)
+        apple_health = (profile["max_capacity"] or "").replace("%", "")
+        condition = profile["condition"] or ""
+
+        b = battery
+        max_cap = b.nominal_capacity if b and b.nominal_capacity is not None else ""
+        apple_cycles = b.cycle_count if b and b.cycle_count is not None else ""
+        health = b.health_percent if b else None
+        health_pct = "{:.2f}".format(health) if health else "N/A"
+        temp_c = "{:.1f}".format(b.temperature) if b and b.temperature is not None else ""
+
+        self._record_sample(battery, event=event, condition=condition or None,
+                            apple_health=_int(apple_health, None))
+        self.store.flush()
+
+        self.log("HEALTH: Calc={}% Apple={}% | MaxCap: {}mAh | AppleCycles: {} | Temp: {}C | Condition: {}".format(
+            health_pct, apple_health, max_cap, apple_cycles, temp_c, condition))
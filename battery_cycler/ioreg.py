@@ -0,0 +1,146 @@
+"""Structured AppleSmartBattery snapshot from a single `ioreg -a` read.
+
+`ioreg -a -rn AppleSmartBattery` prints the registry node as an XML plist,
+so one spawn plus plistlib gives us every counter we care about instead of
+one `ioreg | grep` per key. Recorded dumps live in fixtures/ioreg/ so the
+parser can be exercised on machines without IOKit.
+"""
+
+import plistlib
+import sys
+import time
+
+from .probes import read_output
+
+IOREG_ARGS = ["ioreg", "-a", "-rn", "AppleSmartBattery"]
+
+
+def _signed(value):
+    """ioreg reports negative currents as unsigned 64-bit integers."""
+    if isinstance(value, int) and value >= 1 << 63:
+        return value - (1 << 64)
+    return value
+
+
+class BatterySnapshot:
+    """One reading of the AppleSmartBattery node.
+
+    Capacities are in mAh, voltages in mV, currents in mA (negative while
+    discharging), temperature in degrees C. Fields missing from the node
+    are None.
+    """
+
+    __slots__ = (
+        "taken_at",
+        "current_capacity",       # percent on Apple Silicon
+        "raw_current_capacity",   # AppleRawCurrentCapacity, mAh
+        "raw_max_capacity",       # AppleRawMaxCapacity, mAh
+        "nominal_capacity",       # NominalChargeCapacity, mAh
+        "design_capacity",        # DesignCapacity, mAh
+        "cycle_count",
+        "temperature",
+        "voltage",
+        "amperage",
+        "instant_amperage",
+        "cell_voltages",
+        "is_charging",
+        "external_connected",
+        "fully_charged",
+        "adapter_watts",
+        "adapter_input_watts",    # PowerTelemetryData SystemPowerIn, W
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+        if self.cell_voltages is None:
+            self.cell_voltages = ()
+
+    @property
+    def state_of_charge(self):
+        """AppleRawCurrentCapacity / AppleRawMaxCapacity in percent: finer
+        than CurrentCapacity, which macOS rounds and smooths."""
+        if self.raw_current_capacity is not None and self.raw_max_capacity:
+            return self.raw_current_capacity * 100.0 / self.raw_max_capacity
+        return None
+
+    @property
+    def health_percent(self):
+        """NominalChargeCapacity / DesignCapacity, as the controller logs it."""
+        if self.nominal_capacity and self.design_capacity:
+            return self.nominal_capacity * 100.0 / self.design_capacity
+        return None
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["cell_voltages"] = list(self.cell_voltages)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = {name: data[name] for name in cls.__slots__ if name in data}
+        fields["cell_voltages"] = tuple(fields.get("cell_voltages") or ())
+        return cls(**fields)
+
+    def __repr__(self):
+        return "BatterySnapshot({})".format(", ".join(
+            "{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+
+def parse_ioreg_plist(data, taken_at=None):
+    """Parse `ioreg -a -rn AppleSmartBattery` output into a BatterySnapshot.
+
+    Returns None if the output holds no battery node (desktop Macs, or a
+    failed probe).
+    """
+    try:
+        nodes = plistlib.loads(data)
+    except Exception:
+        return None
+    if isinstance(nodes, list):
+        nodes = nodes[0] if nodes else None
+    if not isinstance(nodes, dict):
+        return None
+    node = nodes
+    battery_data = node.get("BatteryData") or {}
+    adapter = node.get("AdapterDetails") or {}
+    telemetry = node.get("PowerTelemetryData") or {}
+    power_in = telemetry.get("SystemPowerIn")
+
+    temperature = node.get("Temperature")
+    if temperature is not None:
+        temperature = temperature / 100.0
+
+    return BatterySnapshot(
+        taken_at=time.time() if taken_at is None else taken_at,
+        current_capacity=node.get("CurrentCapacity"),
+        raw_current_capacity=node.get("AppleRawCurrentCapacity"),
+        raw_max_capacity=node.get("AppleRawMaxCapacity"),
+        nominal_capacity=node.get("NominalChargeCapacity"),
+        design_capacity=node.get("DesignCapacity", battery_data.get("DesignCapacity")),
+        cycle_count=node.get("CycleCount"),
+        temperature=temperature,
+        voltage=node.get("Voltage", node.get("AppleRawBatteryVoltage")),
+        amperage=_signed(node.get("Amperage")),
+        instant_amperage=_signed(node.get("InstantAmperage")),
+        cell_voltages=tuple(battery_data.get("CellVoltage") or ()),
+        is_charging=node.get("IsCharging"),
+        external_connected=node.get("ExternalConnected"),
+        fully_charged=node.get("FullyCharged"),
+        adapter_watts=adapter.get("Watts"),
+        adapter_input_watts=power_in / 1000.0 if power_in is not None else None,
+    )
+
+
+def read_ioreg_snapshot():
+    """Probe the battery once. Returns a BatterySnapshot or None."""
+    return parse_ioreg_plist(read_output(IOREG_ARGS, timeout=5))
+
+
+if __name__ == "__main__":
+    # python -m battery_cycler.ioreg [dump.plist] - parse a recorded dump
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            print(parse_ioreg_plist(f.read()))
+    else:
+        print(read_ioreg_snapshot())
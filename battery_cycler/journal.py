@@ -0,0 +1,214 @@
+"""Crash-safe cycling state: an append-only journal plus atomic checkpoints.
+
+Every record is one JSON line holding the full (small) state with an
+increasing sequence number, so the latest state is always the last
+complete line - readers seek to the end of the file and parse one record
+instead of re-reading everything. Phase transitions are fsync'd before the
+engine acts on them, so a crash or reboot can lose at most the time counters
+accumulated since the last periodic record, never a completed cycle. When
+the journal grows past `max_bytes` the newest record is written to the
+checkpoint (temp file + fsync + rename) and the journal is truncated.
+
+The KEY=value STATE_FILE that battery_cycle.sh sources is still written at
+checkpoints and on shutdown so the shell controller can resume a session.
+"""
+
+import json
+import os
+import time
+
+from .paths import DATA_DIR, STATE_FILE
+
+STATE_JOURNAL = os.path.join(DATA_DIR, "state.journal")
+STATE_CHECKPOINT = os.path.join(DATA_DIR, "state.checkpoint.json")
+
+# Legacy state file keys, in battery_cycle.sh's save_state order. String
+# values are quoted since the file is `source`d by the shell script.
+STATE_KEYS = [
+    ("TOTAL_DISCHARGE_CYCLES", False),
+    ("CURRENT_STATE", True),
+    ("CYCLE_START_TIME", True),
+    ("CHARGE_START_TIME", True),
+    ("INITIAL_HEALTH", True),
+    ("INITIAL_APPLE_CYCLES", True),
+    ("TOTAL_ACTIVE_SECS", False),
+    ("TOTAL_DISCHARGE_SECS", False),
+    ("TOTAL_CHARGE_SECS", False),
+]
+# Written by the engine only; battery_cycle.sh drops it when it saves, which
+# is how we tell which controller wrote the file last
+JOURNAL_SEQ_KEY = "JOURNAL_SEQ"
+
+
+def read_legacy_state(path=STATE_FILE):
+    """Read the KEY=value state file into a dict of strings."""
+    state = {}
+    try:
+        with open(path, 'rb') as f:
+            content = f.read().decode('ascii', 'replace')
+    except OSError:
+        return state
+    for line in content.split('\n'):
+        if "=" in line:
+            key, value = line.split("=", 1)
+            state[key.strip()] = value.strip().strip('"')
+    return state
+
+
+def write_legacy_state(state, path=STATE_FILE, seq=None):
+    """Write the KEY=value state file atomically (temp file + rename)."""
+    lines = []
+    for key, quoted in STATE_KEYS:
+        value = state.get(key, "")
+        lines.append('{}="{}"'.format(key, value) if quoted else "{}={}".format(key, value or 0))
+    if seq is not None:
+        lines.append("{}={}".format(JOURNAL_SEQ_KEY, seq))
+    _atomic_write(path, ("\n".join(lines) + "\n").encode('ascii', 'replace'))
+
+
+def _atomic_write(path, data):
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+def read_last_record(path, window=1024):
+    """Return the last complete, valid JSON line of `path`, or None.
+
+    Reads backwards from the end in growing windows, so the cost does not
+    depend on the journal's length. A torn final line (crash mid-append)
+    is skipped.
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            lines = f.read(size - start).split(b"\n")
+            if start > 0:
+                lines = lines[1:]  # first piece may be the tail of an earlier line
+            for line in reversed(lines):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "seq" in record:
+                    return record
+            if start == 0:
+                return None
+            window *= 4
+
+
+class StateJournal:
+    def __init__(self, path=STATE_JOURNAL, checkpoint_path=STATE_CHECKPOINT,
+                 legacy_path=STATE_FILE, max_bytes=64 * 1024):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.legacy_path = legacy_path
+        self.max_bytes = max_bytes
+        self.seq = 0
+        self.last_record = None
+        self._file = None
+
+    def load(self):
+        """Return the newest record ({seq, ts, event, state}) or None."""
+        best = None
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                best = json.loads(f.read())
+        except (OSError, ValueError):
+            pass
+        tail = read_last_record(self.path)
+        if tail is not None and (best is None or tail["seq"] > best["seq"]):
+            best = tail
+        if best is not None:
+            self.seq = max(self.seq, best["seq"])
+        self.last_record = best
+        return best
+
+    def load_state(self):
+        """Latest state as a dict of legacy keys.
+
+        If battery_cycle.sh saved the legacy file after our last record (it
+        carries no JOURNAL_SEQ), that newer file wins.
+        """
+        record = self.load()
+        try:
+            legacy_mtime = os.stat(self.legacy_path).st_mtime
+        except OSError:
+            legacy_mtime = None
+        if legacy_mtime is not None and (record is None or legacy_mtime > record["ts"]):
+            legacy = read_legacy_state(self.legacy_path)
+            if JOURNAL_SEQ_KEY not in legacy:
+                return legacy
+        return dict(record["state"]) if record else {}
+
+    def append(self, state, event="tick", durable=False, ts=None):
+        """Append a record stamped `ts` (the caller's clock, default now);
+        `durable` fsyncs it before returning."""
+        self.seq += 1
+        record = {"seq": self.seq, "ts": int(time.time() if ts is None else ts), "event": event, "state": state}
+        line = json.dumps(record, separators=(",", ":"), sort_keys=True) + "\n"
+        f = self._open()
+        f.write(line.encode('utf-8'))
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+        self.last_record = record
+        if f.tell() > self.max_bytes:
+            self.checkpoint()
+        return record
+
+    def checkpoint(self):
+        """Persist the newest record atomically and truncate the journal."""
+        record = self.last_record
+        if record is None:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        _atomic_write(self.checkpoint_path,
+                      json.dumps(record, separators=(",", ":"), sort_keys=True).encode('utf-8'))
+        write_legacy_state(record["state"], self.legacy_path, seq=record["seq"])
+        # Only now is it safe to drop the journal; a crash before this point
+        # leaves records the loader still orders by seq
+        f = self._open()
+        f.truncate(0)
+        os.fsync(f.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'ab')
+            # A crash mid-append left a torn line; end it so the next record
+            # starts on a line of its own instead of joining the fragment
+            if self._file.tell() > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+                if torn:
+                    self._file.write(b"\n")
+        return self._file
+
+
+def load_current_state():
+    """Latest cycling state for readers (menu, stats dialog)."""
+    return StateJournal().load_state()
@@ -0,0 +1,492 @@
+"""Linux hardware access for the cycling engine, through sysfs.
+
+Stands in for macos.MacHardware on Linux laptops. The battery is read
+from /sys/class/power_supply/BAT*: a handful of small attribute files
+instead of a spawned probe. Charging is controlled by the driver's
+charge_control_start/end_threshold and charge_behaviour attributes (root
+only by default; see README for a udev rule that hands them to your user).
+
+The kernel sends a power_supply uevent when the battery or adapter changes
+state, so the engine is woken as soon as the charger stops or the cable is
+pulled, with its tick interval as the fallback for drivers that don't
+announce capacity changes. A fake tree (e.g. fixtures/sysfs/*) is watched
+with inotify instead, so the whole backend can be exercised off-hardware:
+
+    python -m battery_cycler.linux show --root fixtures/sysfs/thinkpad
+"""
+
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import glob
+import os
+import signal
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from . import metrics
+from .backend import Backend
+from .ioreg import BatterySnapshot
+
+SYSFS_ROOT = "/sys/class/power_supply"
+SYSFS_PROBE = ["sysfs"]  # probe name in the metrics
+
+# `maintain N` lets the level sag this far below N before charging resumes
+MAINTAIN_BAND = 5
+# charge_behaviour modes that take the battery off charge, best first
+DISCHARGE_BEHAVIOURS = ("force-discharge", "inhibit-charge")
+
+NETLINK_KOBJECT_UEVENT = 15
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _read(directory, name):
+    """Attribute `name` as a stripped string, or None if missing/unreadable."""
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _int(directory, name):
+    value = _read(directory, name)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def find_battery(root=SYSFS_ROOT):
+    """First power supply of type Battery (BAT0, BAT1, ...), or None."""
+    for path in sorted(glob.glob(os.path.join(root, "*"))):
+        if _read(path, "type") == "Battery" and _read(path, "present") != "0":
+            return path
+    return None
+
+
+def find_adapters(root=SYSFS_ROOT):
+    return [path for path in sorted(glob.glob(os.path.join(root, "*")))
+            if _read(path, "type") in ("Mains", "USB", "USB_C", "USB_PD")]
+
+
+def parse_behaviour(text):
+    """`[auto] inhibit-charge force-discharge` -> (current, available)."""
+    current, available = None, []
+    for word in (text or "").split():
+        if word.startswith("[") and word.endswith("]"):
+            word = word[1:-1]
+            current = word
+        available.append(word)
+    return current, available
+
+
+def read_sysfs_snapshot(battery_dir, adapters=(), taken_at=None):
+    """Read one BAT* directory into a BatterySnapshot, in the units ioreg
+    uses (mAh, mV, mA negative while discharging, degrees C).
+
+    Drivers report either charge_* (uAh) or energy_* (uWh); energies are
+    converted with the design voltage. Returns None if the battery is gone.
+    """
+    status = _read(battery_dir, "status")
+    if status is None:
+        return None
+    voltage = _int(battery_dir, "voltage_now")
+    design_voltage = _int(battery_dir, "voltage_min_design") or voltage
+
+    def mah(name):
+        value = _int(battery_dir, "charge_" + name)
+        if value is not None:
+            return value // 1000
+        value = _int(battery_dir, "energy_" + name)
+        if value is not None and design_voltage:
+            return value * 1000 // design_voltage
+        return None
+
+    current = _int(battery_dir, "current_now")
+    if current is None:
+        power = _int(battery_dir, "power_now")
+        if power is not None and voltage:
+            current = power * 1000000 // voltage
+    if current is not None:
+        # Most drivers report magnitudes; some sign it already
+        current = abs(current) // 1000
+        if status == "Discharging":
+            current = -current
+
+    temperature = _int(battery_dir, "temp")
+    external = None
+    for adapter in adapters:
+        if _read(adapter, "online") == "1":
+            external = True
+            break
+        external = False
+    if external is None:
+        external = status != "Discharging"
+    now_mah = mah("now")
+    full_mah = mah("full")
+
+    return BatterySnapshot(
+        taken_at=time.time() if taken_at is None else taken_at,
+        current_capacity=_int(battery_dir, "capacity"),
+        raw_current_capacity=now_mah,
+        raw_max_capacity=full_mah,
+        nominal_capacity=full_mah,
+        design_capacity=mah("full_design"),
+        cycle_count=_int(battery_dir, "cycle_count"),
+        temperature=temperature / 10.0 if temperature is not None else None,
+        voltage=voltage // 1000 if voltage is not None else None,
+        amperage=current,
+        instant_amperage=current,
+        is_charging=status == "Charging",
+        external_connected=external,
+        fully_charged=status == "Full",
+    )
+
+
+class UeventSocket:
+    """Kernel uevents for the power_supply subsystem (no root needed)."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.setblocking(False)
+        self.sock.bind((0, 1))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def drain(self):
+        """Read all pending messages. True if any concerned a power supply."""
+        relevant = False
+        while True:
+            try:
+                data = self.sock.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                return relevant
+            if b"\0SUBSYSTEM=power_supply\0" in data:
+                relevant = True
+
+    def close(self):
+        self.sock.close()
+
+
+class InotifyWatch:
+    """inotify on the battery/adapter directories of a fake sysfs tree."""
+
+    _libc = None
+
+    def __init__(self, directories):
+        if InotifyWatch._libc is None:
+            InotifyWatch._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc = InotifyWatch._libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, "inotify_add_watch failed: " + directory)
+
+    def fileno(self):
+        return self.fd
+
+    def drain(self):
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except (BlockingIOError, InterruptedError):
+                return relevant
+            if len(data) >= struct.calcsize("iIII"):
+                relevant = True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LinuxHardware(Backend):
+    """Battery, charge control, sleep inhibition and notifications on Linux.
+
+    The control calls apply what the battery CLI verbs (charge N,
+    discharge N, maintain N|stop) leave set on a Mac.
+    """
+
+    name = "linux"
+
+    def __init__(self, root=SYSFS_ROOT, battery_dir=None):
+        self.root = root
+        self.battery_dir = battery_dir or find_battery(root)
+        self.adapters = find_adapters(root)
+        self.inhibitor = None
+        self.inhibit_cmd = shutil.which("systemd-inhibit")
+        self._saved_thresholds = None
+        self._behaviours = None
+        self._watch = None
+
+    # --- reading ---
+
+    def read_snapshot(self):
+        if self.battery_dir is None:
+            return None
+        started = time.perf_counter()
+        battery = read_sysfs_snapshot(self.battery_dir, self.adapters)
+        metrics.observe_probe(SYSFS_PROBE, time.perf_counter() - started, ok=battery is not None)
+        return battery
+
+    async def read_battery(self):
+        """File reads are cheap enough to do on the loop."""
+        return self.read_snapshot()
+
+    # --- charge control ---
+
+    def _write(self, name, value):
+        with open(os.path.join(self.battery_dir, name), 'w') as f:
+            f.write(str(value))
+
+    def _has(self, name):
+        return os.path.exists(os.path.join(self.battery_dir, name))
+
+    def _available_behaviours(self):
+        # The choices are fixed per driver; keep the first list we saw
+        if self._behaviours is None and self._has("charge_behaviour"):
+            self._behaviours = parse_behaviour(_read(self.battery_dir, "charge_behaviour"))[1]
+        return self._behaviours or []
+
+    def discharge_behaviour(self):
+        """The charge_behaviour used to discharge: force-discharge, else
+        inhibit-charge (the battery then only drains when the load
+        outgrows the adapter or it is unplugged), else None."""
+        if self.battery_dir is None:
+            return None
+        available = self._available_behaviours()
+        return next((mode for mode in DISCHARGE_BEHAVIOURS if mode in available), None)
+
+    def can_discharge(self):
+        return self.discharge_behaviour() is not None
+
+    def _set_behaviour(self, mode):
+        if not self._has("charge_behaviour"):
+            return mode == "auto"
+        current = parse_behaviour(_read(self.battery_dir, "charge_behaviour"))[0]
+        if mode not in self._available_behaviours():
+            return False
+        if current != mode:
+            self._write("charge_behaviour", mode)
+        return True
+
+    def _set_thresholds(self, start, end):
+        has_start = self._has("charge_control_start_threshold")
+        has_end = self._has("charge_control_end_threshold")
+        if not has_end:
+            return False
+        if self._saved_thresholds is None:
+            self._saved_thresholds = (
+                _int(self.battery_dir, "charge_control_start_threshold") if has_start else None,
+                _int(self.battery_dir, "charge_control_end_threshold"))
+        if not has_start:
+            self._write("charge_control_end_threshold", end)
+            return True
+        # Drivers reject start >= end, so order the writes to never pass
+        # through an invalid pair
+        current_end = _int(self.battery_dir, "charge_control_end_threshold") or 100
+        if start >= current_end:
+            self._write("charge_control_end_threshold", end)
+            self._write("charge_control_start_threshold", start)
+        else:
+            self._write("charge_control_start_threshold", start)
+            self._write("charge_control_end_threshold", end)
+        return True
+
+    def _restore_thresholds(self):
+        if self._saved_thresholds is None:
+            return self._set_thresholds(99, 100) if self._has("charge_control_end_threshold") else True
+        start, end = self._saved_thresholds
+        ok = self._set_thresholds(start if start is not None else 0, end or 100)
+        self._saved_thresholds = None
+        return ok
+
+    def apply(self, action, setting=None):
+        if self.battery_dir is None:
+            return False
+        if action == "discharge":
+            mode = self.discharge_behaviour()
+            return mode is not None and self._set_behaviour(mode)
+        if action == "charge":
+            return self._set_behaviour("auto") and self._set_thresholds(99, 100)
+        if action == "maintain":
+            if not self._set_behaviour("auto"):
+                return False
+            if setting == "stop":
+                return self._restore_thresholds()
+            level = max(1, min(100, int(setting)))
+            return self._set_thresholds(max(0, level - MAINTAIN_BAND), level)
+        return False
+
+    async def run_battery(self, *args):
+        """Apply a battery CLI verb. Returns False if the driver can't do it
+        or we may not write the attributes."""
+        started = time.perf_counter()
+        try:
+            ok = self.apply(*args[:2])
+        except (OSError, ValueError):
+            ok = False
+        metrics.observe_probe(["sysfs-control"], time.perf_counter() - started, ok)
+        return ok
+
+    async def set_charge(self, target):
+        return await self.run_battery("charge", target)
+
+    async def set_discharge(self, target):
+        return await self.run_battery("discharge", target)
+
+    async def hold(self, level):
+        return await self.run_battery("maintain", "stop" if level is None else level)
+
+    # --- events ---
+
+    def watch(self, callback):
+        """Call `callback()` on the running loop when the battery or adapter
+        changes. Returns False if no event source is available."""
+        if self.battery_dir is None:
+            return False
+        try:
+            if os.path.realpath(self.root) == os.path.realpath(SYSFS_ROOT):
+                source = UeventSocket()
+            else:
+                source = InotifyWatch([self.battery_dir] + self.adapters)
+        except (OSError, AttributeError):
+            return False
+        loop = asyncio.get_running_loop()
+
+        def ready():
+            if source.drain():
+                callback()
+        loop.add_reader(source.fileno(), ready)
+        self._watch = (loop, source)
+        return True
+
+    def unwatch(self):
+        if self._watch is not None:
+            loop, source = self._watch
+            loop.remove_reader(source.fileno())
+            source.close()
+            self._watch = None
+
+    # --- sleep and notifications ---
+
+    def keep_awake(self):
+        """Hold a systemd-inhibit sleep/idle lock, restarting it if it died.
+
+        The lock is held by `tail --pid` on our pid, so it goes away with us
+        like caffeinate -w does.
+        """
+        if self.inhibit_cmd is None:
+            return []
+        if self.inhibitor is not None and self.inhibitor.poll() is None:
+            return []
+        was_running = self.inhibitor is not None
+        self.inhibitor = subprocess.Popen(
+            [self.inhibit_cmd, "--what=sleep:idle:handle-lid-switch", "--who=Battery Cycler",
+             "--why=Battery cycling in progress", "--mode=block",
+             "tail", "--pid={}".format(os.getpid()), "-f", "/dev/null"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return [("SYSTEMD-INHIBIT", self.inhibitor.pid)] if was_running else []
+
+    def allow_sleep(self):
+        if self.inhibitor is not None and self.inhibitor.poll() is None:
+            self.inhibitor.terminate()
+            self.inhibitor.wait()
+        self.inhibitor = None
+
+    def notify(self, title, message):
+        try:
+            subprocess.Popen(["notify-send", "-a", "Battery Cycler", title, message],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            pass
+
+
+class SysfsProfile:
+    """Stands in for cache.PowerProfileCache: the Maximum Capacity/Condition/
+    Cycle Count that system_profiler gives on a Mac, from sysfs."""
+
+    def __init__(self, hardware):
+        self.hardware = hardware
+
+    def get(self):
+        info = {"max_capacity": None, "condition": None, "cycle_count": None}
+        battery = self.hardware.read_snapshot()
+        if battery is None:
+            return info
+        if battery.health_percent is not None:
+            info["max_capacity"] = "{:.0f}%".format(battery.health_percent)
+        if battery.cycle_count is not None:
+            info["cycle_count"] = str(battery.cycle_count)
+        if self.hardware.battery_dir is not None:
+            info["condition"] = _read(self.hardware.battery_dir, "health")
+        return info
+
+    def invalidate(self):
+        pass
+
+
+def create_engine(root=SYSFS_ROOT, interval=None, config=None, **options):
+    """A CyclingEngine on this machine's battery with the usual config/state
+    files; `config` (a ConfigStore) and CyclingEngine keyword `options`
+    (journal, store, log_file, clock) replace them."""
+    from .config import ConfigStore
+    from .engine import CHECK_INTERVAL, CyclingEngine
+    from .stress import StressManager
+
+    hardware = LinuxHardware(root)
+    # Without stress-ng the engine logs CPU stress as disabled and
+    # discharges on the machine's own load. The GPU worker encodes with
+    # VideoToolbox, which only exists on macOS
+    stress = StressManager(shutil.which("stress-ng"), ffmpeg_cmd=None)
+    return CyclingEngine(hardware, stress, config if config is not None else ConfigStore(),
+                         interval=interval or CHECK_INTERVAL, profile=SysfsProfile(hardware), **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battery Cycler on Linux (sysfs power_supply).")
+    parser.add_argument("command", choices=["show", "cycle"],
+                        help="show: print one battery reading; cycle: run the engine until SIGINT/SIGTERM")
+    parser.add_argument("--root", default=SYSFS_ROOT, help="power_supply directory (default: %(default)s)")
+    parser.add_argument("--interval", type=float, help="engine tick, seconds")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        hardware = LinuxHardware(args.root)
+        if hardware.battery_dir is None:
+            sys.exit("No battery under {}".format(args.root))
+        print(hardware.battery_dir)
+        print(hardware.read_snapshot())
+        print("charge_behaviour:", _read(hardware.battery_dir, "charge_behaviour"))
+        print("thresholds:", _read(hardware.battery_dir, "charge_control_start_threshold"),
+              _read(hardware.battery_dir, "charge_control_end_threshold"))
+        return
+
+    engine = create_engine(args.root, args.interval)
+    if engine.hw.battery_dir is None:
+        sys.exit("No battery under {}".format(args.root))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: engine.stop())
+    engine.start()
+    while engine.running:
+        engine.join(1)
+
+
+if __name__ == "__main__":
+    main()
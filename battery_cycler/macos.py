@@ -0,0 +1,187 @@
+"""macOS backend (see backend.py): one ioreg probe per reading, the battery
+CLI (or the SMC helper, see smc.py) for SMC changes, caffeinate/pmset power
+assertions and notifications."""
+
+import asyncio
+import os
+import subprocess
+import tempfile
+import time
+
+from . import metrics
+from .backend import Backend
+from .ioreg import IOREG_ARGS, parse_ioreg_plist, read_ioreg_snapshot
+
+BATTERY_CMD_TIMEOUT = 30  # seconds, same as battery_cycle.sh
+# How often a switching command's timing file is checked for the SMC write
+APPLIED_POLL = 0.1
+# bin/battery's timing mark once charge/discharge have written the SMC
+APPLIED_MARK = "smc_write"
+
+
+def _applied(path):
+    """Whether bin/battery has recorded its SMC write in `path`."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return any(line.split()[:1] == [APPLIED_MARK] for line in f)
+    except OSError:
+        return False
+
+
+def _read_timing(path, spawned):
+    """bin/battery's 'step timestamp' lines -> [(step, secs since the
+    previous step)], starting from `spawned`; None if it wrote none."""
+    stages = []
+    previous = spawned
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 2:
+                    continue
+                try:
+                    at = float(fields[1])
+                except ValueError:
+                    continue
+                stages.append((fields[0], max(0.0, at - previous)))
+                previous = at
+    except OSError:
+        pass
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return stages or None
+
+
+class MacHardware(Backend):
+    name = "macos"
+
+    def __init__(self, battery_cmd, smc=None):
+        self.battery_cmd = battery_cmd
+        self.smc = smc  # smc.ChargeControl when the helper is running
+        self.caffeinate = None
+        self.noidle = None
+
+    def read_snapshot(self):
+        return read_ioreg_snapshot()
+
+    async def read_battery(self):
+        """Read the AppleSmartBattery node once. Returns a BatterySnapshot or None."""
+        started = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *IOREG_ARGS, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            out, _ = await asyncio.wait_for(proc.communicate(), timeout=5)
+        except Exception:
+            metrics.observe_probe(IOREG_ARGS, time.perf_counter() - started, ok=False)
+            return None
+        metrics.observe_probe(IOREG_ARGS, time.perf_counter() - started, ok=proc.returncode == 0)
+        return parse_ioreg_plist(out)
+
+    async def run_battery(self, *args):
+        """Run the battery CLI. Returns False if it failed or timed out.
+
+        `battery charge/discharge` keep looping until the level is reached.
+        They record each step in BATTERY_TIMING_FILE, so we return as soon
+        as the SMC write is recorded, killing the loop; a CLI that never
+        records it is killed after BATTERY_CMD_TIMEOUT and counts as failed
+        (battery_cycle.sh just waits out the timeout). Other commands are
+        waited for, up to the same timeout. With the SMC helper,
+        charge/discharge are their SMC writes in one round trip instead,
+        which assumes the maintain daemon is stopped (see
+        smc.ChargeControl.apply).
+        """
+        started = time.perf_counter()
+        switching = bool(args) and args[0] in ("charge", "discharge")
+        if switching:
+            self.command_stages = None
+        if self.smc is not None and switching:
+            ok = self.smc.apply(args[0])
+            elapsed = time.perf_counter() - started
+            metrics.observe_probe(["smc-helper"], elapsed, ok)
+            if ok:
+                self.command_stages = [("smc_helper", elapsed)]
+                return True
+            started = time.perf_counter()  # fall back to the CLI
+        ok = False
+        env = timing_file = None
+        if switching:
+            # bin/battery writes a timestamp after each of its steps
+            fd, timing_file = tempfile.mkstemp(prefix="battery-timing-")
+            os.close(fd)
+            env = dict(os.environ, BATTERY_TIMING_FILE=timing_file)
+        spawned = time.time()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self.battery_cmd, *[str(a) for a in args],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+            ok = await self._wait_battery(proc, timing_file)
+        except OSError:
+            pass
+        metrics.observe_probe([self.battery_cmd], time.perf_counter() - started, ok)
+        if timing_file is not None:
+            self.command_stages = _read_timing(timing_file, spawned)
+        return ok
+
+    @staticmethod
+    async def _wait_battery(proc, timing_file):
+        """Wait for a battery CLI process: until it exits, or for a switch
+        (`timing_file` given) until it records the SMC write."""
+        deadline = time.monotonic() + BATTERY_CMD_TIMEOUT
+        while True:
+            left = max(0.0, deadline - time.monotonic())
+            try:
+                return await asyncio.wait_for(
+                    proc.wait(), timeout=left if timing_file is None else min(APPLIED_POLL, left)) == 0
+            except asyncio.TimeoutError:
+                pass
+            applied = timing_file is not None and _applied(timing_file)
+            if applied or time.monotonic() >= deadline:
+                proc.kill()
+                await proc.wait()
+                return applied
+
+    async def set_charge(self, target):
+        return await self.run_battery("charge", target)
+
+    async def set_discharge(self, target):
+        return await self.run_battery("discharge", target)
+
+    async def hold(self, level):
+        return await self.run_battery("maintain", "stop" if level is None else level)
+
+    def keep_awake(self):
+        """Hold caffeinate/pmset noidle assertions, restarting any that died.
+
+        Returns a list of (name, pid) for assertions that had to be restarted.
+        """
+        restarted = []
+        if self.caffeinate is None or self.caffeinate.poll() is not None:
+            # -d/-i/-m/-s: no display/idle/disk/AC sleep, -u: no timer coalescing
+            was_running = self.caffeinate is not None
+            self.caffeinate = subprocess.Popen(
+                ["caffeinate", "-dimsu", "-w", str(os.getpid())])
+            if was_running:
+                restarted.append(("CAFFEINATE", self.caffeinate.pid))
+        if self.noidle is None or self.noidle.poll() is not None:
+            was_running = self.noidle is not None
+            self.noidle = subprocess.Popen(["pmset", "noidle"], stdout=subprocess.DEVNULL)
+            if was_running:
+                restarted.append(("PMSET", self.noidle.pid))
+        return restarted
+
+    def allow_sleep(self):
+        for proc in (self.caffeinate, self.noidle):
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        self.caffeinate = None
+        self.noidle = None
+
+    def notify(self, title, message):
+        script = 'display notification "{}" with title "{}" sound name "Glass"'.format(
+            message.replace('"', "'"), title.replace('"', "'"))
+        subprocess.Popen(["osascript", "-e", script],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
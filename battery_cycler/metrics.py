@@ -0,0 +1,340 @@
+"""Prometheus / OpenMetrics endpoint for watching cyclers remotely.
+
+A tiny registry (counters, gauges, histograms with labels) plus an HTTP
+server thread serving it at /metrics. Scraping never probes anything:
+gauges are refreshed from values the sampler and the engine already hold
+(see StatusCollector), and probe latencies are recorded as the probes run,
+so a scrape costs one small string render.
+
+Enabled with the "metrics_port" config key (0 = off), bound to
+"metrics_address" (127.0.0.1 by default; use 0.0.0.0 to scrape from other
+machines).
+"""
+
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROBE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Phase switches include the time to notice a crossing, up to a poll interval
+TRANSITION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in pairs) + "}"
+
+
+def _value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, openmetrics=False):
+        family = self.name[:-len("_total")] if openmetrics and self.kind == "counter" else self.name
+        lines = ["# HELP {} {}".format(family, self.documentation),
+                 "# TYPE {} {}".format(family, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return ["{}{} {}".format(self.name, _labels(self.labelnames, key), _value(value))]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """For totals kept elsewhere (e.g. persisted cycle counts)."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if value is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=PROBE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per-bucket counts (last one is +Inf), then count and sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def _samples(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            lines.append("{}_bucket{} {}".format(
+                self.name, _labels(self.labelnames, key, [("le", _value(float(bound)))]), cumulative))
+        lines.append("{}_count{} {}".format(self.name, _labels(self.labelnames, key), counts[-2]))
+        lines.append("{}_sum{} {}".format(self.name, _labels(self.labelnames, key), _value(counts[-1])))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback):
+        """Call `callback()` before each render to refresh gauges."""
+        self._collectors.append(callback)
+
+    def remove_collector(self, callback):
+        if callback in self._collectors:
+            self._collectors.remove(callback)
+
+    def render(self, openmetrics=False):
+        for callback in list(self._collectors):
+            try:
+                callback()
+            except Exception as e:
+                print(f"metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+BATTERY_PERCENT = REGISTRY.register(Gauge(
+    "battery_cycler_battery_percent", "State of charge as reported to the menu bar."))
+CHARGING = REGISTRY.register(Gauge(
+    "battery_cycler_charging", "1 while on AC power or charging."))
+PHASE = REGISTRY.register(Gauge(
+    "battery_cycler_phase", "1 for the controller's current phase.", ["phase"]))
+CYCLES = REGISTRY.register(Counter(
+    "battery_cycler_cycles_total", "Discharge cycles completed by the cycler."))
+APPLE_CYCLES = REGISTRY.register(Gauge(
+    "battery_cycler_apple_cycle_count", "CycleCount reported by the battery."))
+HEALTH = REGISTRY.register(Gauge(
+    "battery_cycler_health_percent", "NominalChargeCapacity / DesignCapacity."))
+APPLE_HEALTH = REGISTRY.register(Gauge(
+    "battery_cycler_apple_health_percent", "Maximum Capacity from system_profiler."))
+TEMPERATURE = REGISTRY.register(Gauge(
+    "battery_cycler_temperature_celsius", "Battery temperature."))
+VOLTAGE = REGISTRY.register(Gauge(
+    "battery_cycler_voltage_volts", "Battery voltage."))
+CURRENT = REGISTRY.register(Gauge(
+    "battery_cycler_current_amperes", "Battery current, negative while discharging."))
+STRESS_RUNNING = REGISTRY.register(Gauge(
+    "battery_cycler_stress_running", "1 while the stress worker is running.", ["worker"]))
+STRESS_LEVEL = REGISTRY.register(Gauge(
+    "battery_cycler_stress_level", "Configured stress level (0=off, 1=low, 2=medium, 3=high).", ["worker"]))
+STRESS_RESTARTS = REGISTRY.register(Counter(
+    "battery_cycler_stress_restarts_total", "Stress workers restarted after dying, this engine run.", ["worker"]))
+STRESS_CPU_SECONDS = REGISTRY.register(Counter(
+    "battery_cycler_stress_cpu_seconds_total", "CPU time used by stress workers, this engine run.", ["worker"]))
+THROUGHPUT = REGISTRY.register(Counter(
+    "battery_cycler_throughput_mah_total", "Coulomb-counted charge moved, this cycling session.", ["direction"]))
+ENERGY = REGISTRY.register(Counter(
+    "battery_cycler_energy_wh_total", "Battery energy delivered/absorbed, this cycling session.", ["direction"]))
+EQUIVALENT_CYCLES = REGISTRY.register(Gauge(
+    "battery_cycler_equivalent_cycles", "Discharged mAh over full charge capacity, this cycling session."))
+DRAIN_TARGET = REGISTRY.register(Gauge(
+    "battery_cycler_drain_target_watts", "Discharge power the closed-loop stress controller aims for."))
+STRESS_LOAD = REGISTRY.register(Gauge(
+    "battery_cycler_stress_load_workers", "Closed-loop CPU load in workers (count x duty cycle)."))
+RATE = REGISTRY.register(Gauge(
+    "battery_cycler_rate_percent_per_hour", "Estimated rate of charge (negative while discharging)."))
+POWER = REGISTRY.register(Gauge(
+    "battery_cycler_battery_power_watts", "Smoothed battery power, negative while discharging."))
+LIMIT_ETA = REGISTRY.register(Gauge(
+    "battery_cycler_limit_eta_seconds", "Estimated time until the current phase reaches its limit."))
+SAMPLE_AGE = REGISTRY.register(Gauge(
+    "battery_cycler_sample_age_seconds", "Age of the newest battery sample."))
+PROBE_LATENCY = REGISTRY.register(Histogram(
+    "battery_cycler_probe_duration_seconds", "Wall time of external probe commands.", ["probe"]))
+PROBE_FAILURES = REGISTRY.register(Counter(
+    "battery_cycler_probe_failures_total", "Probe commands that failed or timed out.", ["probe"]))
+TRANSITION_LATENCY = REGISTRY.register(Histogram(
+    "battery_cycler_transition_stage_seconds", "Phase switch latency by stage (see transitions.py).",
+    ["kind", "stage"], buckets=TRANSITION_BUCKETS))
+OVERSHOOT = REGISTRY.register(Gauge(
+    "battery_cycler_switch_overshoot_percent", "How far past the limit the last switch was applied.", ["kind"]))
+BACKEND_CALLS = REGISTRY.register(Counter(
+    "battery_cycler_backend_calls_total", "Battery backend operations.", ["backend", "op"]))
+BACKEND_FAILURES = REGISTRY.register(Counter(
+    "battery_cycler_backend_failures_total", "Backend operations that failed or read nothing.", ["backend", "op"]))
+BACKEND_LATENCY = REGISTRY.register(Histogram(
+    "battery_cycler_backend_duration_seconds", "Wall time of backend operations.", ["backend", "op"]))
+
+PHASES = ("idle", "charging", "discharging", "holding", "stopping")
+STRESS_LEVELS = {"off": 0, "low": 1, "medium": 2, "high": 3}
+
+
+def observe_probe(args, seconds, ok=True):
+    """Record one external command run (args[0] names the probe)."""
+    probe = os.path.basename(str(args[0]))
+    PROBE_LATENCY.observe(seconds, probe=probe)
+    if not ok:
+        PROBE_FAILURES.inc(probe=probe)
+
+
+class StatusCollector:
+    """Refreshes the status gauges from the sampler's latest snapshot and
+    the running engine (`get_engine()` may return None) - no probing."""
+
+    def __init__(self, sampler, get_engine, config):
+        self.sampler = sampler
+        self.get_engine = get_engine
+        self.config = config
+
+    def __call__(self):
+        snapshot = self.sampler.latest
+        engine = self.get_engine()
+        running = engine is not None and engine.running
+        battery = engine.battery if running and engine.battery is not None else (
+            snapshot.battery if snapshot else None)
+
+        if snapshot is not None:
+            BATTERY_PERCENT.set(snapshot.percent)
+            CHARGING.set(1 if snapshot.charging else 0)
+            SAMPLE_AGE.set(round(time.time() - snapshot.taken_at, 3))
+            try:
+                APPLE_HEALTH.set(float(str(snapshot.health).rstrip("%")))
+            except ValueError:
+                APPLE_HEALTH.set(None)
+        if running:
+            phase = "stopping" if engine.stopping else engine.state
+            CYCLES.set(engine.cycles)
+            agg = engine.aggregates
+            THROUGHPUT.set(round(agg.discharged_mah, 1), direction="discharged")
+            THROUGHPUT.set(round(agg.charged_mah, 1), direction="charged")
+            EQUIVALENT_CYCLES.set(round(agg.equivalent_cycles, 4))
+            ENERGY.set(round(agg.delivered_wh, 3), direction="delivered")
+            ENERGY.set(round(agg.absorbed_wh, 3), direction="absorbed")
+        else:
+            phase = "idle"
+            if snapshot is not None:
+                CYCLES.set(snapshot.cycles)
+        for name in PHASES:
+            PHASE.set(1 if name == phase else 0, phase=name)
+
+        if battery is not None:
+            APPLE_CYCLES.set(battery.cycle_count)
+            HEALTH.set(battery.health_percent)
+            TEMPERATURE.set(battery.temperature)
+            VOLTAGE.set(battery.voltage / 1000.0 if battery.voltage is not None else None)
+            CURRENT.set(battery.amperage / 1000.0 if battery.amperage is not None else None)
+
+        estimate = engine.estimate() if running else self.sampler.estimate()
+        RATE.set(round(estimate.percent_per_hour, 3) if estimate else None)
+        POWER.set(round(estimate.watts, 3) if estimate and estimate.watts is not None else None)
+        LIMIT_ETA.set(round(estimate.eta_secs) if estimate and estimate.eta_secs is not None else None)
+
+        stress = engine.stress if running else None
+        stress_stats = stress.stats() if stress is not None else {}
+        for worker in ("cpu", "gpu"):
+            if worker in stress_stats:
+                STRESS_RESTARTS.set(stress_stats[worker]["restarts"], worker=worker)
+                STRESS_CPU_SECONDS.set(stress_stats[worker]["cpu_secs"], worker=worker)
+            running_worker = bool(stress and getattr(stress, worker + "_running") and not stress.suspended)
+            STRESS_RUNNING.set(1 if running_worker else 0, worker=worker)
+            STRESS_LEVEL.set(STRESS_LEVELS.get(self.config.get(worker + "_stress"), 0), worker=worker)
+        closed_loop = bool(stress and getattr(stress, "cpu_workers", None))
+        target = engine.drain_target if closed_loop else None
+        DRAIN_TARGET.set(round(target, 3) if target is not None and target != float("inf") else None)
+        STRESS_LOAD.set(round(stress.cpu_workers * stress.cpu_duty, 3) if closed_loop else None)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.registry.render(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serves `registry` over HTTP from a daemon thread."""
+
+    def __init__(self, port, address="127.0.0.1", registry=REGISTRY):
+        handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+        self.httpd = ThreadingHTTPServer((address, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="metrics-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,13 @@
+"""File locations used by the app and the cycling controller."""
+
+import os
+
+CONFIG_FILE = os.path.expanduser("~/battery_cycle_config.json")
+STATE_FILE = os.path.expanduser("~/battery_cycle_state.txt")
+LOG_FILE = os.path.expanduser("~/battery_cycles.log")
+HEALTH_LOG = os.path.expanduser("~/battery_health.csv")
+
+# Private working directory for caches shared with battery_cycle.sh
+DATA_DIR = os.path.expanduser("~/.battery_cycler")
+POWER_PROFILE_CACHE = os.path.join(DATA_DIR, "system_profiler_power.txt")
+STRESS_PIDS_FILE = os.path.join(DATA_DIR, "stress.pids")
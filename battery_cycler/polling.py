@@ -0,0 +1,62 @@
+"""Adaptive polling: wait longer the further the battery is from a limit.
+
+A fixed 10 s tick costs the same probe whether the battery is 2% or 40%
+away from the next switch. AdaptivePoller takes the level and rate from a
+RateEstimator (rate.py), which smooths the staircase of integer percents
+into the true slope, and sleeps for a `fraction` of the predicted time to
+the nearest limit ahead, clamped to [min_interval, max_interval]. Each
+tick roughly halves the remaining distance, so polling gets dense as the
+limit approaches and the switch is taken on time.
+
+Until the rate is known (the estimator isn't ready yet in the current
+phase) it falls back to `default_interval`. With predictive switching the
+engine acts `lead` seconds before the limit, so that is when it needs a
+reading.
+"""
+
+from .rate import RateEstimator
+
+MIN_INTERVAL = 2    # seconds, near a limit
+MAX_INTERVAL = 60   # seconds, far from one (stress/assertion checks still run this often)
+FRACTION = 0.5      # of the predicted time to the limit
+
+
+class AdaptivePoller:
+    def __init__(self, default_interval, estimator=None, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, fraction=FRACTION):
+        self.default_interval = default_interval
+        self.estimator = estimator if estimator is not None else RateEstimator()
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, default_interval)
+        self.fraction = fraction
+
+    def observe(self, t, level, phase=None, resolution=1.0):
+        """Feed a plain reading to the estimator (when nobody else does)."""
+        self.estimator.update(t, level, resolution, phase=phase)
+
+    def next_interval(self, level, targets, resolution=1.0, lead=0.0):
+        """Seconds to wait before the next reading, given the current
+        reading and the limits (`targets`) that would trigger a switch.
+
+        Distances are measured from the estimated level, which is finer
+        than a reading rounded to `resolution`; such a reading already
+        shows the limit half a step before the true level gets there.
+        The switch is due `lead` seconds before the limit is reached.
+        """
+        estimator = self.estimator
+        if not estimator.ready or level is None:
+            return self.default_interval
+        rate, fitted = estimator.rate, estimator.level
+        if not rate:
+            return self.max_interval
+        ahead = []
+        for target in targets:
+            # Ahead if the reading hasn't got there yet; the estimate may
+            # already be past it, in which case the switch is due now
+            if (target - level) / rate > 0:
+                eta = (target - fitted) / rate - resolution / 2.0 / abs(rate) - lead
+                ahead.append(max(0.0, eta))
+        if not ahead:
+            # Moving away from every limit: nothing to catch soon
+            return self.max_interval
+        return max(self.min_interval, min(self.max_interval, min(ahead) * self.fraction))
@@ -0,0 +1,37 @@
+"""Battery probes - thin wrappers around command-line tools such as pmset and
+system_profiler. These block, so the app only calls them from the background
+sampler or the engine's executor. Each run's latency is recorded in
+metrics.PROBE_LATENCY."""
+
+import re
+import subprocess
+import time
+
+from . import metrics
+
+
+def read_output(args, timeout):
+    """Run a probe command and return its raw stdout (b'' on failure)."""
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(args, capture_output=True, timeout=timeout)
+    except Exception:
+        metrics.observe_probe(args, time.perf_counter() - started, ok=False)
+        return b""
+    metrics.observe_probe(args, time.perf_counter() - started, ok=result.returncode == 0)
+    return result.stdout
+
+
+def run_command(args, timeout):
+    """Run a probe command and return its stdout as text ('' on failure)."""
+    return read_output(args, timeout).decode('utf-8', 'replace')
+
+
+def read_pmset_batt():
+    """Return (percent, charging) from `pmset -g batt`."""
+    output = run_command(["pmset", "-g", "batt"], timeout=5)
+    match = re.search(r'(\d+)%', output)
+    percent = int(match.group(1)) if match else 0
+    charging = "charging" in output.lower() or "AC Power" in output
+    return percent, charging
+
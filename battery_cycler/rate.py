@@ -0,0 +1,175 @@
+"""Streaming charge/discharge rate estimate with ETA to the next limit.
+
+RateEstimator is a two-state (level, rate) Kalman filter with a
+constant-rate model: O(1) time and memory per sample. Levels come from the
+raw mAh counters when the battery reports them (AppleRawCurrentCapacity /
+AppleRawMaxCapacity, charge_now / charge_full on Linux), otherwise from
+the whole-percent reading; either way the rounding step is modelled as
+measurement noise (step^2 / 12), so a staircase of integer percents gives
+a smooth rate instead of bursts of 1%-per-tick. Battery power is an
+exponentially weighted average of voltage x current, falling back to the
+rate times capacity when the battery doesn't report current.
+
+The filter starts over whenever the phase (charging, discharging, ...)
+changes, because the rate flips sign.
+"""
+
+import collections
+import math
+
+# Random walk of the rate, (%/s)^2 per second: lets the estimate follow
+# stress level changes and the charger's taper within a few minutes
+RATE_NOISE = 1e-9
+# Prior on the rate before any samples: ~3%/min either way
+RATE_PRIOR_STD = 0.05
+# Seconds of samples in the current phase before the estimate is reported
+MIN_SPAN = 120
+# Time constant of the power average, seconds
+POWER_TAU = 120.0
+
+Estimate = collections.namedtuple(
+    "Estimate", ["percent_per_hour", "watts", "eta_secs", "target", "level"])
+
+
+def battery_level(battery, percent=None):
+    """(level in percent, resolution) from a BatterySnapshot, preferring
+    the raw mAh counters over the whole-percent reading `percent`."""
+    if battery is not None:
+        soc = battery.state_of_charge
+        if soc is not None:
+            return soc, 100.0 / battery.raw_max_capacity
+        if percent is None:
+            percent = battery.current_capacity
+    if percent is None:
+        return None, None
+    return float(percent), 1.0
+
+
+def battery_watts(battery):
+    """Battery power from voltage x current (negative while discharging)."""
+    if battery is None or battery.voltage is None or battery.amperage is None:
+        return None
+    return battery.voltage * battery.amperage / 1e6
+
+
+class RateEstimator:
+    def __init__(self, rate_noise=RATE_NOISE, min_span=MIN_SPAN, power_tau=POWER_TAU):
+        self.rate_noise = rate_noise
+        self.min_span = min_span
+        self.power_tau = power_tau
+        self.phase = None
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.first_t = None
+        self.last_t = None
+        self.level = None       # filtered level, percent
+        self.rate = 0.0         # percent per second
+        self._p00 = self._p01 = self._p11 = 0.0
+        self._watts = None
+        self._capacity_wh = None
+
+    @property
+    def ready(self):
+        return self.samples >= 2 and self.last_t - self.first_t >= self.min_span
+
+    def update(self, t, level, resolution=1.0, watts=None, phase=None, capacity_wh=None):
+        """Add one reading at time `t`. `resolution` is the reading's
+        rounding step in percent; `capacity_wh` (full charge in Wh) lets
+        the rate stand in for power when `watts` is unknown."""
+        if phase != self.phase:
+            self.phase = phase
+            self.reset()
+        if level is None:
+            return
+        if capacity_wh:
+            self._capacity_wh = capacity_wh
+        r = resolution * resolution / 12.0
+        if self.last_t is None:
+            self.first_t = self.last_t = t
+            self.level = float(level)
+            self.rate = 0.0
+            self._p00, self._p01, self._p11 = r, 0.0, RATE_PRIOR_STD ** 2
+            self.samples = 1
+            self._watts = watts
+            return
+        dt = t - self.last_t
+        if dt <= 0:
+            return
+        self.last_t = t
+        self.samples += 1
+
+        # Predict: level moves at the current rate; the rate random-walks
+        q = self.rate_noise
+        self.level += self.rate * dt
+        p00, p01, p11 = self._p00, self._p01, self._p11
+        p00 += dt * (2 * p01 + dt * p11) + q * dt ** 3 / 3
+        p01 += dt * p11 + q * dt ** 2 / 2
+        p11 += q * dt
+
+        # Correct with the reading
+        s = p00 + r
+        k0, k1 = p00 / s, p01 / s
+        innovation = level - self.level
+        self.level += k0 * innovation
+        self.rate += k1 * innovation
+        self._p00, self._p01, self._p11 = (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01
+
+        if watts is not None:
+            alpha = 1 - math.exp(-dt / self.power_tau)
+            self._watts = watts if self._watts is None else self._watts + alpha * (watts - self._watts)
+
+    def observe(self, t, battery, percent=None, phase=None):
+        """update() from a BatterySnapshot (and/or a whole-percent reading)."""
+        level, resolution = battery_level(battery, percent)
+        capacity_wh = None
+        if battery is not None and battery.raw_max_capacity and battery.voltage:
+            capacity_wh = battery.raw_max_capacity * battery.voltage / 1e6
+        self.update(t, level, resolution, battery_watts(battery), phase, capacity_wh)
+
+    @property
+    def percent_per_hour(self):
+        return self.rate * 3600 if self.ready else None
+
+    @property
+    def watts(self):
+        if self._watts is not None:
+            return self._watts
+        if self.ready and self._capacity_wh:
+            return self.rate * 3600 / 100.0 * self._capacity_wh
+        return None
+
+    def eta(self, target):
+        """Seconds until the level reaches `target`, or None if it isn't
+        heading there (or the rate isn't known yet)."""
+        if not self.ready or not self.rate:
+            return None
+        secs = (target - self.level) / self.rate
+        return secs if secs >= 0 else None
+
+    def estimate(self, targets=()):
+        """Estimate for the nearest of `targets` ahead, or None if not ready."""
+        if not self.ready:
+            return None
+        eta, target = None, None
+        for candidate in targets:
+            secs = self.eta(candidate)
+            if secs is not None and (eta is None or secs < eta):
+                eta, target = secs, candidate
+        return Estimate(percent_per_hour=self.rate * 3600, watts=self.watts,
+                        eta_secs=eta, target=target, level=self.level)
+
+
+def format_estimate(estimate):
+    """'-18.2%/h · 14.1 W · 20% in 1h05m' for the menu."""
+    if estimate is None:
+        return ""
+    parts = ["{:+.1f}%/h".format(estimate.percent_per_hour)]
+    if estimate.watts is not None:
+        parts.append("{:.1f} W".format(abs(estimate.watts)))
+    if estimate.eta_secs is not None:
+        minutes = int(estimate.eta_secs // 60)
+        parts.append("{}% in {}h{:02d}m".format(estimate.target, minutes // 60, minutes % 60)
+                     if minutes >= 60 else "{}% in {}m".format(estimate.target, minutes))
+    return " · ".join(parts)
@@ -0,0 +1,114 @@
+"""Background battery sampler.
+
+The rumps timer runs on the main (UI) thread, so it must never wait on
+pmset or system_profiler. The sampler thread does the probing and publishes
+an immutable Snapshot; the timer callback just reads `sampler.latest`
+(a single attribute load) and applies it to the menu items. The snapshot
+also carries the backend's battery reading, Apple's profile and the
+journaled state, so Show Stats is built from it without probing.
+
+Given `targets`, the sampler polls adaptively (see polling.py): often
+while the level is moving quickly or nearing a limit, up to once a minute
+while it is steady.
+"""
+
+import collections
+import threading
+import time
+
+from . import probes
+from .cache import power_profile
+from .journal import load_current_state
+from .polling import AdaptivePoller
+from .rate import RateEstimator, battery_level
+
+Snapshot = collections.namedtuple(
+    "Snapshot", ["percent", "charging", "cycles", "health", "taken_at",
+                 "battery", "profile", "state"])
+
+
+def take_snapshot(backend):
+    """Run all probes once and return a Snapshot."""
+    battery = backend.read_snapshot()
+    if battery is not None and battery.current_capacity is not None:
+        percent = battery.current_capacity
+        charging = bool(battery.is_charging or battery.external_connected)
+    else:
+        # The backend read failed - fall back to pmset
+        percent, charging = probes.read_pmset_batt()
+    profile = power_profile.get()
+    state = load_current_state()
+    try:
+        cycles = int(state.get("TOTAL_DISCHARGE_CYCLES") or 0)
+    except ValueError:
+        cycles = 0
+    return Snapshot(
+        percent=percent,
+        charging=charging,
+        cycles=cycles,
+        health=profile["max_capacity"] or "--",
+        taken_at=time.time(),
+        battery=battery,
+        profile=profile,
+        state=state,
+    )
+
+
+class Sampler(threading.Thread):
+    """Daemon thread that refreshes a Snapshot from `backend` every
+    `interval` seconds, or adaptively when `targets()` returns the limits
+    to watch (None for a fixed interval)."""
+
+    def __init__(self, backend, interval=5, sample=take_snapshot, targets=None):
+        super().__init__(name="battery-sampler", daemon=True)
+        self.backend = backend
+        self.interval = interval
+        self.latest = None
+        self.estimator = RateEstimator()
+        self.poller = AdaptivePoller(interval, self.estimator, min_interval=interval)
+        self._targets = targets
+        self._sample = sample
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def refresh(self):
+        """Ask for a new sample now instead of at the next interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.latest = self._sample(self.backend)
+            except Exception as e:
+                print(f"battery sampler failed: {e}")
+            self.observe(self.latest)
+            self._wake.wait(self.next_interval(self.latest))
+            self._wake.clear()
+
+    def observe(self, snapshot):
+        if snapshot is not None:
+            self.estimator.observe(snapshot.taken_at, snapshot.battery, snapshot.percent,
+                                   snapshot.charging)
+
+    def estimate(self):
+        """Rate and power (no ETA) while the engine isn't running."""
+        return self.estimator.estimate()
+
+    def next_interval(self, snapshot):
+        targets = self._targets() if self._targets is not None else None
+        if targets is None or snapshot is None or snapshot.percent is None:
+            return self.interval
+        # The limits are checked against the raw-mAh state of charge, the
+        # scale the estimator works on
+        level, resolution = battery_level(snapshot.battery, snapshot.percent)
+        interval = self.poller.next_interval(level, list(targets), resolution)
+        # The menu shows whole percents: also catch the next one either way.
+        # That is on macOS's scale, where only the rate carries over
+        rate = self.estimator.rate if self.estimator.ready else None
+        if rate:
+            interval = min(interval, max(self.poller.min_interval, self.poller.fraction / abs(rate)))
+        return interval
@@ -0,0 +1,503 @@
+"""Deterministic battery simulator for running the cycling engine off-Mac.
+
+Simulation bundles a VirtualClock, a SimulatedBattery and stand-ins for
+MacHardware (ioreg, the battery CLI) and StressManager. The battery
+integrates state of charge, capacity fade, temperature and current from the
+load the stress levels put on it, in fixed steps of virtual time, so a
+given seed and config always produce the same run. CyclingEngine runs
+against it unmodified:
+
+    python -m battery_cycler.sim --days 3 --cpu high
+
+runs three simulated days of cycling in a few seconds and prints a summary.
+The battery also renders pmset, `ioreg -a` and system_profiler output
+(command_output), for code that reads those directly.
+"""
+
+import argparse
+import json
+import math
+import os
+import plistlib
+import random
+import tempfile
+import time
+
+from .backend import Backend
+from .cache import PowerProfileCache
+from .clock import VirtualClock
+from .drain import DrainController
+from .config import ConfigStore
+from .engine import CHECK_INTERVAL, CyclingEngine
+from .ioreg import parse_ioreg_plist
+from .journal import StateJournal
+from .store import HistoryStore
+from .stress import CPU_STRESS_ARGS, GPU_STRESS_ARGS
+
+# Extra system load per stress level, watts
+CPU_STRESS_WATTS = {"low": 8.0, "medium": 15.0, "high": 28.0}
+GPU_STRESS_WATTS = {"low": 4.0, "medium": 8.0, "high": 14.0}
+# One closed-loop stress-ng worker (drain.py), deliberately not the
+# controller's own guess so the loop has something to correct
+WORKER_WATTS = 2.8
+SIM_CPU_CORES = 10
+
+STEP = 5.0  # longest integration step, virtual seconds
+# Seconds from calling `battery charge|discharge` to its SMC write
+COMMAND_LATENCY = 1.5
+
+
+class SimulatedBattery:
+    """A 3-cell laptop pack behind an SMC that the battery CLI can drive.
+
+    Capacities are in mAh. `adapter_enabled` / `charging_enabled` /
+    `maintain_level` mirror what `battery discharge/charge/maintain` leave
+    set in the SMC; the physical adapter stays plugged in.
+    """
+
+    def __init__(self, design_capacity=6079, nominal_capacity=4610, cycle_count=898,
+                 percent=80.0, cells=3, ambient=25.0, base_watts=6.0, adapter_watts=96,
+                 charge_rate=0.7, fade_per_cycle=0.0001, resistance=0.06,
+                 thermal_tau=600.0, seed=0):
+        self.design_capacity = design_capacity
+        self.nominal_capacity = float(nominal_capacity)
+        self.charge_mah = self.nominal_capacity * percent / 100.0
+        self.cycle_count = cycle_count
+        self.cells = cells
+        self.ambient = ambient
+        self.base_watts = base_watts
+        self.adapter_watts = adapter_watts
+        self.charge_rate = charge_rate        # C-rate below the CV knee
+        self.fade_per_cycle = fade_per_cycle  # fraction of design per cycle at 25C
+        self.resistance = resistance          # pack ohms
+        self.thermal_tau = thermal_tau        # seconds
+        self.temperature = ambient
+        self.current = 0.0                    # amps, + charging / - discharging
+        self.load_watts = 0.0                 # stress on top of base_watts
+        self.system_watts = base_watts
+        self.time = None
+
+        self.adapter_connected = True
+        self.adapter_enabled = True
+        self.charging_enabled = True
+        self.maintain_level = None
+
+        self._discharged_mah = 0.0  # toward the next CycleCount increment
+        self._rng = random.Random(seed)
+
+    @property
+    def soc(self):
+        return self.charge_mah / self.nominal_capacity
+
+    @property
+    def percent(self):
+        return self.soc * 100.0
+
+    @property
+    def on_adapter(self):
+        return self.adapter_connected and self.adapter_enabled
+
+    def voltage(self, current=None):
+        """Pack voltage in volts: a linear OCV curve plus the IR drop."""
+        if current is None:
+            current = self.current
+        return self.cells * (3.3 + 0.9 * self.soc) + current * self.resistance
+
+    def advance_to(self, t):
+        if self.time is None:
+            self.time = t
+        while self.time < t:
+            dt = min(STEP, t - self.time)
+            self.step(dt)
+            self.time += dt
+
+    def step(self, dt):
+        if self.maintain_level is not None:
+            # bin/battery maintain_synchronous: charge below the level, stop at it
+            self.charging_enabled = self.percent < self.maintain_level
+        system_watts = self.base_watts + self.load_watts
+        self.system_watts = system_watts
+        if not self.on_adapter:
+            current = -system_watts / self.voltage(0.0)
+        elif self.charging_enabled and self.soc < 1.0:
+            current = self.charge_rate * self.nominal_capacity / 1000.0
+            if self.soc > 0.8:
+                # Constant-voltage phase: current tapers off towards full
+                current *= max(0.05, (1.0 - self.soc) / 0.2)
+            headroom = max(0.0, self.adapter_watts - system_watts) / self.voltage(0.0)
+            current = min(current, headroom)
+        else:
+            current = 0.0
+        self.current = current
+
+        delta = current * 1000.0 * dt / 3600.0
+        self.charge_mah = min(max(self.charge_mah + delta, 0.0), self.nominal_capacity)
+        if delta < 0:
+            self._discharged_mah -= delta
+            if self._discharged_mah >= self.nominal_capacity:
+                self._discharged_mah -= self.nominal_capacity
+                self.cycle_count += 1
+
+        # Fade per equivalent full cycle of throughput, doubling every 10C
+        # and growing with C-rate above 0.5C
+        c_rate = abs(current) * 1000.0 / self.nominal_capacity
+        factor = 2 ** ((self.temperature - 25.0) / 10.0) * (1.0 + max(0.0, c_rate - 0.5))
+        efc = abs(delta) / (2.0 * self.nominal_capacity)
+        self.nominal_capacity -= self.design_capacity * self.fade_per_cycle * efc * factor
+        self.charge_mah = min(self.charge_mah, self.nominal_capacity)
+
+        # First-order lag towards a steady state set by stress and current
+        target = self.ambient + 0.3 * self.load_watts + 2.0 * abs(current)
+        self.temperature += (target - self.temperature) * (1.0 - math.exp(-dt / self.thermal_tau))
+
+    # --- rendered probe output ---
+
+    def ioreg_node(self):
+        amperage = int(round(self.current * 1000.0 + self._rng.gauss(0.0, 10.0)))
+        voltage = int(round(self.voltage() * 1000.0))
+        cell = voltage // self.cells
+        return {
+            "CurrentCapacity": int(round(self.percent)),
+            "MaxCapacity": 100,
+            "AppleRawCurrentCapacity": int(self.charge_mah),
+            "AppleRawMaxCapacity": int(self.nominal_capacity),
+            "NominalChargeCapacity": int(self.nominal_capacity),
+            "DesignCapacity": self.design_capacity,
+            "CycleCount": self.cycle_count,
+            "Temperature": int(round(self.temperature * 100)),
+            "Voltage": voltage,
+            # ioreg prints negative currents as unsigned 64-bit integers
+            "Amperage": amperage & 0xFFFFFFFFFFFFFFFF,
+            "InstantAmperage": amperage & 0xFFFFFFFFFFFFFFFF,
+            "IsCharging": self.current > 0,
+            "ExternalConnected": self.on_adapter,
+            "FullyCharged": self.soc >= 0.999,
+            "BatteryData": {"DesignCapacity": self.design_capacity,
+                            "CellVoltage": [cell] * self.cells},
+            "AdapterDetails": {"Watts": self.adapter_watts} if self.on_adapter else {},
+            # Adapter input: the system plus what goes into the battery
+            "PowerTelemetryData": {"SystemPowerIn": int(round(
+                (self.system_watts + max(0.0, self.current) * self.voltage()) * 1000.0))
+                if self.on_adapter else 0},
+        }
+
+    def ioreg_plist(self):
+        return plistlib.dumps([self.ioreg_node()])
+
+    def pmset_text(self):
+        if self.current > 0:
+            status = "charging"
+        elif not self.on_adapter:
+            status = "discharging"
+        elif self.soc >= 0.999:
+            status = "charged"
+        else:
+            status = "AC attached; not charging"
+        return ("Now drawing from '{}'\n -InternalBattery-0 (id=4653155)\t{}%; {}; "
+                "(no estimate) present: true\n").format(
+                    "AC Power" if self.on_adapter else "Battery Power", int(round(self.percent)), status)
+
+    def system_profiler_text(self):
+        health = int(round(self.nominal_capacity * 100.0 / self.design_capacity))
+        return (
+            "Power:\n\n"
+            "    Battery Information:\n\n"
+            "      Charge Information:\n"
+            "          Fully Charged: {}\n"
+            "          Charging: {}\n"
+            "          State of Charge (%): {}\n"
+            "      Health Information:\n"
+            "          Cycle Count: {}\n"
+            "          Condition: {}\n"
+            "          Maximum Capacity: {}%\n"
+        ).format("Yes" if self.soc >= 0.999 else "No", "Yes" if self.current > 0 else "No",
+                 int(round(self.percent)), self.cycle_count,
+                 "Normal" if health >= 80 else "Service Recommended", health)
+
+
+class SimulatedHardware(Backend):
+    """The backend for a Simulation; controls act like the battery CLI's."""
+
+    name = "sim"
+
+    def __init__(self, sim, command_latency=0.0):
+        self.sim = sim
+        self.command_latency = command_latency
+        self.notifications = []
+
+    def read_snapshot(self):
+        return self.sim.read_battery()
+
+    async def read_battery(self):
+        return self.sim.read_battery()
+
+    async def _switch(self, action, target):
+        if self.command_latency:
+            # bin/battery's steps before its SMC write (see transitions.py)
+            self.sim.advance()
+            self.sim.clock.advance(self.command_latency)
+        return self.sim.battery_command(action, target)
+
+    async def set_charge(self, target):
+        return await self._switch("charge", target)
+
+    async def set_discharge(self, target):
+        return await self._switch("discharge", target)
+
+    async def hold(self, level):
+        return self.sim.battery_command("maintain", "stop" if level is None else level)
+
+    def notify(self, title, message):
+        self.notifications.append((self.sim.clock.time(), title, message))
+
+
+class SimulatedStress:
+    """Stands in for stress.StressManager; workers add load to the battery."""
+
+    def __init__(self, sim, log=print):
+        self.sim = sim
+        self.log = log
+        self.ffmpeg_cmd = "ffmpeg"
+        self.cpu_level = None
+        self.gpu_level = None
+        self.cpu_workers = None  # closed-loop mode only
+        self.cpu_duty = 1.0
+        self.suspended = False
+
+    @property
+    def cpu_running(self):
+        return self.cpu_level is not None or self.cpu_workers is not None
+
+    @property
+    def gpu_running(self):
+        return self.gpu_level is not None
+
+    @property
+    def watts(self):
+        if self.suspended:
+            return 0.0
+        cpu = CPU_STRESS_WATTS.get(self.cpu_level, 0.0)
+        if self.cpu_workers:
+            cpu = self.cpu_workers * self.cpu_duty * WORKER_WATTS
+        return cpu + GPU_STRESS_WATTS.get(self.gpu_level, 0.0)
+
+    def start_cpu(self, level, verb="Started"):
+        if level not in CPU_STRESS_ARGS or self.cpu_running:
+            return
+        self.sim.advance()
+        self.cpu_level = level
+        self.log("CPU-STRESS: {} {}".format(verb, CPU_STRESS_ARGS[level][1]))
+
+    def start_gpu(self, level, verb="Started"):
+        if level not in GPU_STRESS_ARGS or self.gpu_running:
+            return
+        self.sim.advance()
+        self.gpu_level = level
+        self.log("GPU-STRESS: {} {}".format(verb, GPU_STRESS_ARGS[level][3]))
+
+    def start(self, cpu_level, gpu_level):
+        self.start_cpu(cpu_level)
+        self.start_gpu(gpu_level)
+
+    def ensure(self, cpu_level, gpu_level):
+        # Simulated workers never die
+        pass
+
+    def set_cpu_load(self, workers, duty=1.0):
+        self.sim.advance()
+        if workers <= 0:
+            if self.cpu_workers:
+                self.log("CPU-STRESS: Paused (target met without stress)")
+            self.cpu_workers = None
+            return
+        if workers != self.cpu_workers:
+            self.log("CPU-STRESS: Load {} workers at {:.0f}% (closed loop)".format(workers, duty * 100))
+        self.cpu_workers = workers
+        self.cpu_duty = duty
+
+    def stop_cpu(self):
+        self.sim.advance()
+        self.cpu_level = None
+        self.cpu_workers = None
+
+    def stop_gpu(self):
+        self.sim.advance()
+        self.gpu_level = None
+
+    def stop(self):
+        self.stop_cpu()
+        self.log("CPU-STRESS: Stopped")
+        self.stop_gpu()
+        self.log("GPU-STRESS: Stopped")
+        self.suspended = False
+
+    def suspend(self):
+        if not (self.cpu_running or self.gpu_running):
+            return
+        self.sim.advance()
+        self.suspended = True
+        self.log("STRESS: Suspended (standby until next discharge)")
+
+    def resume(self):
+        if not self.suspended:
+            return
+        self.sim.advance()
+        self.suspended = False
+        self.log("STRESS: Resumed from standby")
+
+    def sample_cpu(self):
+        pass
+
+    def stats(self):
+        return {"cpu": {"running": self.cpu_running, "suspended": self.suspended and self.cpu_running,
+                        "pid": None, "restarts": 0, "cpu_secs": 0.0},
+                "gpu": {"running": self.gpu_running, "suspended": self.suspended and self.gpu_running,
+                        "pid": None, "restarts": 0, "cpu_secs": 0.0}}
+
+
+class Simulation:
+    def __init__(self, clock=None, battery=None, command_latency=COMMAND_LATENCY, **battery_options):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.battery = battery if battery is not None else SimulatedBattery(**battery_options)
+        self.hardware = SimulatedHardware(self, command_latency)
+        self.stress = SimulatedStress(self)
+        self.commands = []  # (time, args) of battery CLI calls
+
+    def advance(self):
+        """Integrate the battery up to the clock's current time."""
+        self.battery.advance_to(self.clock.time())
+        self.battery.load_watts = self.stress.watts
+
+    def read_battery(self):
+        self.advance()
+        return parse_ioreg_plist(self.battery.ioreg_plist(), taken_at=self.clock.time())
+
+    def battery_command(self, action, setting=None):
+        """Apply what `bin/battery ACTION SETTING` leaves set in the SMC.
+
+        charge/discharge keep looping until the level is reached, but the
+        engine kills them after BATTERY_CMD_TIMEOUT, so only their SMC
+        change persists. Any command replaces a running maintain daemon.
+        """
+        self.advance()
+        self.commands.append((self.clock.time(), (action, setting)))
+        b = self.battery
+        if action == "discharge":
+            b.maintain_level = None
+            b.adapter_enabled = False
+        elif action == "charge":
+            b.maintain_level = None
+            b.adapter_enabled = True
+            b.charging_enabled = True
+        elif action == "maintain":
+            b.adapter_enabled = True
+            if setting == "stop":
+                b.maintain_level = None
+                b.charging_enabled = True
+            else:
+                b.maintain_level = int(setting)
+        else:
+            return False
+        return True
+
+    def command_output(self, args):
+        """Output of pmset / ioreg / system_profiler as read_output returns it."""
+        self.advance()
+        name = os.path.basename(args[0])
+        if name == "ioreg":
+            return self.battery.ioreg_plist()
+        if name == "pmset":
+            return self.battery.pmset_text().encode()
+        if name == "system_profiler":
+            return self.battery.system_profiler_text().encode()
+        if name == "battery":
+            self.battery_command(*args[1:3])
+        return b""
+
+    def system_profiler_text(self):
+        self.advance()
+        return self.battery.system_profiler_text()
+
+    def create_engine(self, directory, config=None, interval=CHECK_INTERVAL):
+        """A CyclingEngine on this simulation with all files under `directory`."""
+        store = ConfigStore(os.path.join(directory, "battery_cycle_config.json"))
+        store.data.update(config or {})
+        store.save()
+        join = os.path.join
+        engine = CyclingEngine(
+            self.hardware, self.stress, store, interval=interval,
+            journal=StateJournal(join(directory, "state.journal"), join(directory, "state.checkpoint.json"),
+                                 join(directory, "battery_cycle_state.txt")),
+            store=HistoryStore(join(directory, "history.db"), csv_path=None),
+            log_file=join(directory, "battery_cycles.log"),
+            clock=self.clock,
+            profile=PowerProfileCache(join(directory, "system_profiler_power.txt"),
+                                      fetch=self.system_profiler_text))
+        # Closed-loop stress sizes itself to the simulated machine, not this one
+        engine.drain = DrainController(SIM_CPU_CORES)
+        return engine
+
+
+def run(days=1.0, directory=None, config=None, interval=CHECK_INTERVAL, seed=0,
+        command_latency=COMMAND_LATENCY, **battery_options):
+    """Cycle for `days` of virtual time and return a summary dict."""
+    directory = directory or tempfile.mkdtemp(prefix="battery-sim-")
+    os.makedirs(directory, exist_ok=True)
+    sim = Simulation(seed=seed, command_latency=command_latency, **battery_options)
+    start_health = sim.battery.nominal_capacity * 100.0 / sim.battery.design_capacity
+    start_cycles = sim.battery.cycle_count
+    engine = sim.create_engine(directory, config, interval)
+    sim.clock.call_at(sim.clock.time() + days * 86400, engine.stop)
+
+    started = time.monotonic()
+    engine.start()
+    engine.join()
+    b = sim.battery
+    agg = engine.aggregates
+    return {
+        "directory": directory,
+        "virtual_days": days,
+        "wall_secs": round(time.monotonic() - started, 3),
+        "app_cycles": engine.cycles,
+        "apple_cycles_added": b.cycle_count - start_cycles,
+        "equivalent_cycles": round(agg.equivalent_cycles, 3),
+        "discharged_mah": round(agg.discharged_mah),
+        "charged_mah": round(agg.charged_mah),
+        "delivered_wh": round(agg.delivered_wh, 1),
+        "absorbed_wh": round(agg.absorbed_wh, 1),
+        "health_start": round(start_health, 2),
+        "health_end": round(b.nominal_capacity * 100.0 / b.design_capacity, 2),
+        "discharge_hours": round(agg.discharge_secs / 3600.0, 2),
+        "charge_hours": round(agg.charge_secs / 3600.0, 2),
+        "max_temperature": agg.max_temperature,
+        "battery_commands": len(sim.commands),
+        "switch_overshoot": engine.transition_stats.overshoot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cycling engine against a simulated battery.")
+    parser.add_argument("--days", type=float, default=1.0, help="virtual days to run")
+    parser.add_argument("--upper", type=int, default=80)
+    parser.add_argument("--lower", type=int, default=20)
+    parser.add_argument("--cpu", default="high", choices=["off", "low", "medium", "high"])
+    parser.add_argument("--gpu", default="off", choices=["off", "low", "medium", "high"])
+    parser.add_argument("--watts", type=float, default=0, help="closed-loop discharge power (overrides --cpu)")
+    parser.add_argument("--minutes", type=float, default=0, help="closed-loop discharge duration (overrides --cpu)")
+    parser.add_argument("--percent", type=float, default=80.0, help="initial state of charge")
+    parser.add_argument("--interval", type=float, default=CHECK_INTERVAL, help="engine tick, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=COMMAND_LATENCY, help="battery CLI switch time, seconds")
+    parser.add_argument("--predictive", action="store_true", help="switch ahead of the limits")
+    parser.add_argument("--dir", help="where to write logs/state (default: a temp dir)")
+    args = parser.parse_args()
+    config = {"upper_limit": args.upper, "lower_limit": args.lower,
+              "cpu_stress": args.cpu, "gpu_stress": args.gpu,
+              "discharge_target_watts": args.watts, "discharge_target_minutes": args.minutes,
+              "predictive_switching": args.predictive}
+    print(json.dumps(run(args.days, args.dir, config, args.interval, args.seed, args.latency, percent=args.percent),
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""Persistent privileged SMC helper and its client.
+
+bin/battery runs `sudo smc -k KEY -r|-w` once per key, and re-probes the
+five capability keys on every invocation, so a single phase switch is a
+chain of sudo + exec round trips. The helper is one long-lived root process
+that holds the AppleSMC connection open (IOKit via ctypes, or the bundled
+`smc` binary as a fallback) and answers batched reads and writes over a
+Unix socket:
+
+    request:  {"ops": [["read", "CH0B"], ["write", "CH0B", "02"]]}\\n
+    response: {"results": [{"key": "CH0B", "value": "00"},
+                           {"key": "CH0B", "ok": true}]}\\n
+
+Failed ops carry {"key": ..., "error": "..."}. Values are hex strings as
+`smc -r` prints them. Only the charging-control keys can be written.
+
+Run it with `sudo python3 -m battery_cycler.smc serve` (or from a
+LaunchDaemon); the socket is owned by the user who ran sudo, mode 0600.
+`serve --fake --socket PATH` serves an in-memory SMC for tests on Linux.
+ChargeControl sits on SMCClient and performs bin/battery's
+enable/disable charging/discharging writes in one round trip.
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import threading
+
+SMC_SOCKET = "/var/run/battery-cycler-smc.sock"
+
+# Keys bin/battery probes to decide which charging-control scheme applies
+CAPABILITY_KEYS = ("CHTE", "CH0B", "CHIE", "CH0I", "CH0J")
+WRITABLE_KEYS = frozenset(CAPABILITY_KEYS + ("CH0C", "ACLC"))
+
+
+class SMCError(Exception):
+    pass
+
+
+# --- backends ---
+
+class _KeyDataVers(ctypes.Structure):
+    _fields_ = [("major", ctypes.c_uint8), ("minor", ctypes.c_uint8), ("build", ctypes.c_uint8),
+                ("reserved", ctypes.c_uint8), ("release", ctypes.c_uint16)]
+
+
+class _KeyDataPLimit(ctypes.Structure):
+    _fields_ = [("version", ctypes.c_uint16), ("length", ctypes.c_uint16),
+                ("cpu_limit", ctypes.c_uint32), ("gpu_limit", ctypes.c_uint32),
+                ("mem_limit", ctypes.c_uint32)]
+
+
+class _KeyInfo(ctypes.Structure):
+    _fields_ = [("data_size", ctypes.c_uint32), ("data_type", ctypes.c_uint32),
+                ("data_attributes", ctypes.c_uint8)]
+
+
+class _KeyData(ctypes.Structure):
+    # SMCKeyData_t from smc.h (80 bytes)
+    _fields_ = [("key", ctypes.c_uint32), ("vers", _KeyDataVers), ("p_limit", _KeyDataPLimit),
+                ("key_info", _KeyInfo), ("result", ctypes.c_uint8), ("status", ctypes.c_uint8),
+                ("data8", ctypes.c_uint8), ("data32", ctypes.c_uint32), ("bytes", ctypes.c_uint8 * 32)]
+
+
+class IOKitSMC:
+    """Talks to the AppleSMC user client directly (needs root for writes)."""
+
+    KERNEL_INDEX_SMC = 2
+    CMD_READ_BYTES = 5
+    CMD_WRITE_BYTES = 6
+    CMD_READ_KEYINFO = 9
+
+    def __init__(self):
+        iokit = ctypes.cdll.LoadLibrary("/System/Library/Frameworks/IOKit.framework/IOKit")
+        libsystem = ctypes.cdll.LoadLibrary("/usr/lib/libSystem.B.dylib")
+        iokit.IOServiceMatching.restype = ctypes.c_void_p
+        iokit.IOServiceMatching.argtypes = [ctypes.c_char_p]
+        iokit.IOServiceGetMatchingService.restype = ctypes.c_uint32
+        iokit.IOServiceGetMatchingService.argtypes = [ctypes.c_uint32, ctypes.c_void_p]
+        iokit.IOServiceOpen.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32,
+                                        ctypes.POINTER(ctypes.c_uint32)]
+        iokit.IOConnectCallStructMethod.argtypes = [
+            ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_size_t,
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t)]
+        iokit.IOServiceClose.argtypes = [ctypes.c_uint32]
+        iokit.IOObjectRelease.argtypes = [ctypes.c_uint32]
+        self._iokit = iokit
+
+        service = iokit.IOServiceGetMatchingService(0, iokit.IOServiceMatching(b"AppleSMC"))
+        if not service:
+            raise SMCError("AppleSMC service not found")
+        task = ctypes.c_uint32.in_dll(libsystem, "mach_task_self_").value
+        conn = ctypes.c_uint32()
+        result = iokit.IOServiceOpen(service, task, 0, ctypes.byref(conn))
+        iokit.IOObjectRelease(service)
+        if result != 0:
+            raise SMCError("IOServiceOpen failed: {:#x}".format(result & 0xFFFFFFFF))
+        self._conn = conn.value
+
+    def _call(self, data):
+        out = _KeyData()
+        size = ctypes.c_size_t(ctypes.sizeof(out))
+        result = self._iokit.IOConnectCallStructMethod(
+            self._conn, self.KERNEL_INDEX_SMC, ctypes.byref(data), ctypes.sizeof(data),
+            ctypes.byref(out), ctypes.byref(size))
+        if result != 0:
+            raise SMCError("IOConnectCallStructMethod failed: {:#x}".format(result & 0xFFFFFFFF))
+        if out.result != 0:
+            raise SMCError("no data")
+        return out
+
+    def _key_data(self, key):
+        if len(key) != 4:
+            raise SMCError("bad key {!r}".format(key))
+        data = _KeyData()
+        data.key = int.from_bytes(key.encode("ascii"), "big")
+        data.data8 = self.CMD_READ_KEYINFO
+        data.key_info.data_size = self._call(data).key_info.data_size
+        return data
+
+    def read(self, key):
+        data = self._key_data(key)
+        data.data8 = self.CMD_READ_BYTES
+        out = self._call(data)
+        return bytes(out.bytes[:data.key_info.data_size]).hex()
+
+    def write(self, key, value):
+        data = self._key_data(key)
+        raw = bytes.fromhex(value)
+        if len(raw) != data.key_info.data_size:
+            raise SMCError("{} takes {} bytes".format(key, data.key_info.data_size))
+        data.data8 = self.CMD_WRITE_BYTES
+        for i, b in enumerate(raw):
+            data.bytes[i] = b
+        self._call(data)
+
+    def close(self):
+        self._iokit.IOServiceClose(self._conn)
+
+
+class CommandSMC:
+    """Fallback through the bundled `smc` binary (still no sudo: we are root)."""
+
+    def __init__(self, smc_cmd="smc"):
+        self.smc_cmd = smc_cmd
+
+    def read(self, key):
+        out = subprocess.run([self.smc_cmd, "-k", key, "-r"], capture_output=True, text=True,
+                             timeout=5).stdout
+        if "no data" in out or "Error" in out or "bytes" not in out:
+            raise SMCError("no data")
+        return out.split("bytes", 1)[1].replace(")", "").replace(" ", "").strip()
+
+    def write(self, key, value):
+        if subprocess.run([self.smc_cmd, "-k", key, "-w", value], capture_output=True,
+                          timeout=5).returncode != 0:
+            raise SMCError("write failed")
+
+    def close(self):
+        pass
+
+
+# Key sets of the SMC generations bin/battery knows about
+FAKE_PROFILES = {
+    "legacy": {"CH0B": "00", "CH0C": "00", "CH0I": "00", "ACLC": "00"},
+    "ch0j": {"CH0B": "00", "CH0C": "00", "CH0J": "00", "ACLC": "00"},
+    "tahoe": {"CHTE": "00000000", "CHIE": "00", "ACLC": "00"},
+}
+
+
+class FakeSMC:
+    """In-memory SMC for tests off-Mac; absent keys read as "no data"."""
+
+    def __init__(self, keys=None, profile="legacy"):
+        self.keys = dict(FAKE_PROFILES[profile] if keys is None else keys)
+        self.writes = []
+
+    def read(self, key):
+        if key not in self.keys:
+            raise SMCError("no data")
+        return self.keys[key]
+
+    def write(self, key, value):
+        if key not in self.keys:
+            raise SMCError("no data")
+        if len(value) != len(self.keys[key]):
+            raise SMCError("{} takes {} bytes".format(key, len(self.keys[key]) // 2))
+        self.keys[key] = value.lower()
+        self.writes.append((key, value))
+
+    def close(self):
+        pass
+
+
+def open_backend(smc_cmd=None):
+    try:
+        return IOKitSMC()
+    except (OSError, AttributeError, SMCError):
+        return CommandSMC(smc_cmd or "smc")
+
+
+# --- helper daemon ---
+
+class SMCHelper:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+
+    def execute(self, ops):
+        results = []
+        with self._lock:
+            for op in ops:
+                action, key = op[0], str(op[1])
+                try:
+                    if action == "read":
+                        results.append({"key": key, "value": self.backend.read(key)})
+                    elif action == "write":
+                        if key not in WRITABLE_KEYS:
+                            raise SMCError("{} is not writable through the helper".format(key))
+                        self.backend.write(key, str(op[2]))
+                        results.append({"key": key, "ok": True})
+                    else:
+                        raise SMCError("unknown op {!r}".format(action))
+                except (SMCError, ValueError, IndexError, OSError, subprocess.SubprocessError) as e:
+                    results.append({"key": key, "error": str(e) or e.__class__.__name__})
+        return results
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # A client keeps its connection open and sends one request per line
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {"results": self.server.helper.execute(request.get("ops", []))}
+            except (ValueError, TypeError, AttributeError) as e:
+                response = {"error": "bad request: {}".format(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(backend, path=SMC_SOCKET, owner_uid=None):
+    """Serve `backend` on a Unix socket until interrupted."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    server = _Server(path, _Handler)
+    server.helper = SMCHelper(backend)
+    os.chmod(path, 0o600)
+    if owner_uid is not None:
+        os.chown(path, owner_uid, -1)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        backend.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# --- client ---
+
+class SMCClient:
+    """Blocking client; one connection reused for every batch."""
+
+    def __init__(self, path=SMC_SOCKET, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+
+    def batch(self, ops):
+        """Send ops in one round trip; returns the per-op result dicts."""
+        payload = (json.dumps({"ops": ops}) + "\n").encode("utf-8")
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write(payload)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise OSError("helper closed the connection")
+                    break
+                except OSError as e:
+                    self._close()
+                    if attempt == 2:
+                        raise SMCError("SMC helper unavailable: {}".format(e))
+        response = json.loads(line)
+        if "error" in response:
+            raise SMCError(response["error"])
+        return response["results"]
+
+    def read(self, key):
+        result = self.batch([["read", key]])[0]
+        if "error" in result:
+            raise SMCError(result["error"])
+        return result["value"]
+
+    def write(self, key, value):
+        result = self.batch([["write", key, value]])[0]
+        if "error" in result:
+            raise SMCError(result["error"])
+
+    def _close(self):
+        for f in (self._file, self._sock):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._sock = None
+        self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class ChargeControl:
+    """bin/battery's enable/disable charging/discharging as batched writes."""
+
+    def __init__(self, client):
+        self.client = client
+        self.caps = None
+
+    def capabilities(self):
+        if self.caps is None:
+            results = self.client.batch([["read", key] for key in CAPABILITY_KEYS])
+            self.caps = {r["key"]: "error" not in r for r in results}
+        return self.caps
+
+    def _adapter_key(self):
+        caps = self.capabilities()
+        if caps["CHIE"]:
+            return "CHIE", "08"
+        if caps["CH0J"]:
+            return "CH0J", "01"
+        return "CH0I", "01"
+
+    def _charging_writes(self, enabled):
+        caps = self.capabilities()
+        if caps["CHTE"]:
+            return [["write", "CHTE", "00000000" if enabled else "01000000"]]
+        if caps["CH0B"]:
+            value = "00" if enabled else "02"
+            return [["write", "CH0B", value], ["write", "CH0C", value]]
+        raise SMCError("Unable to determine SMC keys for charging control")
+
+    def _run(self, ops, led=None):
+        if led is not None:
+            ops = ops + [["write", "ACLC", led]]
+        results = self.client.batch(ops)
+        # The MagSafe LED is cosmetic; anything else failing is a failure
+        failed = [r for r in results if "error" in r and r["key"] != "ACLC"]
+        if failed:
+            # Re-probe the key set next time, like bin/battery does
+            self.caps = None
+            raise SMCError("{}: {}".format(failed[0]["key"], failed[0]["error"]))
+
+    def enable_discharging(self):
+        key, value = self._adapter_key()
+        self._run([["write", key, value]], led="01")
+
+    def disable_discharging(self):
+        key, _ = self._adapter_key()
+        self._run([["write", key, "00"]])
+
+    def enable_charging(self):
+        # Like bin/battery, enabling charging also turns forced discharge off
+        key, _ = self._adapter_key()
+        self._run(self._charging_writes(True) + [["write", key, "00"]], led="04")
+
+    def disable_charging(self):
+        self._run(self._charging_writes(False), led="03")
+
+    def apply(self, action):
+        """The SMC writes of `battery charge|discharge` (enable_charging
+        also turns the adapter back on, as their `adapter on` step does).
+        Their first step, `battery maintain stop`, is a CLI process the
+        helper can't do: the caller must have stopped the maintain daemon
+        (the engine does at startup and on resume). Returns True on success."""
+        try:
+            if action == "discharge":
+                self.enable_discharging()
+            elif action == "charge":
+                self.enable_charging()
+            else:
+                return False
+        except SMCError:
+            return False
+        return True
+
+
+def connect(path=SMC_SOCKET):
+    """ChargeControl on a running helper, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    client = SMCClient(path)
+    try:
+        client.batch([])
+    except SMCError:
+        client.close()
+        return None
+    return ChargeControl(client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Privileged SMC helper for Battery Cycler.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("serve", help="run the helper")
+    p.add_argument("--socket", default=SMC_SOCKET)
+    p.add_argument("--fake", nargs="?", const="legacy", choices=sorted(FAKE_PROFILES),
+                   help="serve an in-memory SMC (for tests)")
+    p.add_argument("--smc", help="smc binary for the fallback backend")
+    p = sub.add_parser("read", help="read keys through a running helper")
+    p.add_argument("keys", nargs="+")
+    p.add_argument("--socket", default=SMC_SOCKET)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        backend = FakeSMC(profile=args.fake) if args.fake else open_backend(args.smc)
+        uid = os.environ.get("SUDO_UID")
+        try:
+            serve(backend, args.socket, int(uid) if uid else None)
+        except KeyboardInterrupt:
+            pass
+    else:
+        client = SMCClient(args.socket)
+        for result in client.batch([["read", key] for key in args.keys]):
+            print("{} {}".format(result["key"], result.get("value", result.get("error"))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""Embedded SQLite history of battery samples, cycle events and sessions.
+
+~/battery_health.csv only grew; nothing read it back. The engine now writes
+here instead: periodic samples and health events go to `samples`, phase
+changes to `cycle_events`, one row per completed cycle (discharge and the
+recharge after it, with the charge and energy moved) to `cycles`, and each Start..Stop run is a row in
+`sessions`.
+Writes are buffered and committed in batches inside one transaction. The
+tables are indexed by timestamp and cycle number, so "health at cycle N"
+or "last 24 h" stay index lookups on years of data.
+
+Rows that battery_cycle.sh still appends to the CSV are imported when the
+store is opened (incrementally, by byte offset), so the history is complete
+whichever controller ran.
+"""
+
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from .paths import DATA_DIR, HEALTH_LOG
+
+HISTORY_DB = os.path.join(DATA_DIR, "history.db")
+
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    upper_limit INTEGER,
+    lower_limit INTEGER,
+    cpu_stress TEXT,
+    gpu_stress TEXT,
+    initial_health REAL,
+    initial_apple_cycles INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    session_id INTEGER,
+    script_cycles INTEGER,
+    percent REAL,
+    apple_cycles INTEGER,
+    max_capacity_mah INTEGER,
+    design_capacity_mah INTEGER,
+    calc_health REAL,
+    apple_health REAL,
+    condition TEXT,
+    temperature_c REAL,
+    voltage_mv INTEGER,
+    amperage_ma INTEGER,
+    event TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+CREATE INDEX IF NOT EXISTS samples_cycle ON samples (script_cycles, ts);
+CREATE TABLE IF NOT EXISTS cycle_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    session_id INTEGER,
+    cycle INTEGER,
+    event TEXT NOT NULL,
+    percent REAL,
+    duration_secs INTEGER
+);
+CREATE INDEX IF NOT EXISTS cycle_events_ts ON cycle_events (ts);
+CREATE INDEX IF NOT EXISTS cycle_events_cycle ON cycle_events (cycle, ts);
+CREATE TABLE IF NOT EXISTS cycles (
+    ts REAL NOT NULL,
+    session_id INTEGER,
+    cycle INTEGER,
+    started_at REAL,
+    discharged_mah REAL,
+    charged_mah REAL,
+    equivalent_cycles REAL,
+    gap_secs REAL,
+    apple_cycles_added INTEGER,
+    delivered_wh REAL,
+    absorbed_wh REAL,
+    discharge_avg_watts REAL,
+    discharge_peak_watts REAL,
+    charge_avg_watts REAL,
+    charge_peak_watts REAL,
+    adapter_wh REAL,
+    adapter_avg_watts REAL,
+    adapter_peak_watts REAL
+);
+CREATE INDEX IF NOT EXISTS cycles_cycle ON cycles (cycle, ts);
+"""
+
+SAMPLE_COLUMNS = ("ts", "session_id", "script_cycles", "percent", "apple_cycles",
+                  "max_capacity_mah", "design_capacity_mah", "calc_health", "apple_health",
+                  "condition", "temperature_c", "voltage_mv", "amperage_ma", "event")
+
+CYCLE_COLUMNS = ("ts", "session_id", "cycle", "started_at", "discharged_mah", "charged_mah",
+                 "equivalent_cycles", "gap_secs", "apple_cycles_added")
+# Added to `cycles` in schema version 3
+ENERGY_COLUMNS = ("delivered_wh", "absorbed_wh", "discharge_avg_watts", "discharge_peak_watts",
+                  "charge_avg_watts", "charge_peak_watts", "adapter_wh", "adapter_avg_watts",
+                  "adapter_peak_watts")
+CYCLE_COLUMNS += ENERGY_COLUMNS
+
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 60  # seconds a row may wait in the buffer
+
+
+def _num(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryStore:
+    """Write side is meant for a single thread (the engine); readers may
+    open their own HistoryStore on the same file (WAL mode)."""
+
+    def __init__(self, path=HISTORY_DB, csv_path=HEALTH_LOG):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self._samples = []
+        self._events = []
+        self._cycles = []
+        self._oldest_pending = None
+        self._migrate()
+        if csv_path:
+            self.import_health_csv(csv_path)
+
+    # --- schema ---
+
+    def _migrate(self):
+        with self._lock:
+            self.db.executescript(SCHEMA)
+            version = self._meta("schema_version")
+            if version is not None and int(version) == 2:
+                for column in ENERGY_COLUMNS:
+                    self.db.execute("ALTER TABLE cycles ADD COLUMN {} REAL".format(column))
+            if version is None or int(version) < SCHEMA_VERSION:
+                # 2: the cycles table (created above); 3: its energy columns
+                self._set_meta("schema_version", SCHEMA_VERSION)
+            # Future schema changes go here, keyed on int(version)
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def import_health_csv(self, csv_path=HEALTH_LOG):
+        """Import health CSV rows not seen before. Returns the number imported.
+
+        The byte offset reached is remembered in `meta`, so re-running only
+        picks up rows appended since (e.g. by battery_cycle.sh).
+        """
+        try:
+            size = os.path.getsize(csv_path)
+        except OSError:
+            return 0
+        key = "csv_offset:" + os.path.abspath(csv_path)
+        offset = int(self._meta(key) or 0)
+        if offset > size:
+            offset = 0  # file was replaced
+        if offset == size:
+            return 0
+        with open(csv_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # Only consume complete lines
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        rows = []
+        for row in csv.reader(io.StringIO(data[:end].decode('utf-8', 'replace'))):
+            if len(row) < 10 or row[0] == "timestamp":
+                continue
+            try:
+                ts = time.mktime(time.strptime(row[0], '%Y-%m-%d %H:%M:%S'))
+            except ValueError:
+                continue
+            rows.append((ts, None, _num(row[1], int), None, _num(row[2], int), _num(row[3], int),
+                         _num(row[4], int), _num(row[5]), _num(row[6]), row[7] or None,
+                         _num(row[8]), None, None, row[9] or None))
+        with self._lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(self._sample_sql(), rows)
+                self._set_meta(key, offset + end)
+        return len(rows)
+
+    # --- writes (buffered) ---
+
+    def begin_session(self, config, initial_health=None, initial_apple_cycles=None, ts=None):
+        with self._lock:
+            cur = self.db.execute(
+                "INSERT INTO sessions (started_at, upper_limit, lower_limit, cpu_stress, gpu_stress,"
+                " initial_health, initial_apple_cycles) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ts or time.time(), config.get("upper_limit"), config.get("lower_limit"),
+                 config.get("cpu_stress"), config.get("gpu_stress"),
+                 _num(initial_health), _num(initial_apple_cycles, int)))
+            return cur.lastrowid
+
+    def end_session(self, session_id, ts=None):
+        self.flush()
+        with self._lock:
+            self.db.execute("UPDATE sessions SET ended_at = ? WHERE id = ?",
+                            (ts or time.time(), session_id))
+
+    def add_sample(self, **fields):
+        """Buffer a sample row; keys are SAMPLE_COLUMNS (missing -> NULL)."""
+        fields.setdefault("ts", time.time())
+        self._buffer(self._samples, tuple(fields.get(c) for c in SAMPLE_COLUMNS))
+
+    def add_event(self, event, cycle, percent=None, duration_secs=None, session_id=None, ts=None):
+        self._buffer(self._events, (ts or time.time(), session_id, cycle, event, percent, duration_secs))
+
+    def add_cycle(self, **fields):
+        """Buffer a completed cycle row; keys are CYCLE_COLUMNS."""
+        fields.setdefault("ts", time.time())
+        self._buffer(self._cycles, tuple(fields.get(c) for c in CYCLE_COLUMNS))
+
+    def _buffer(self, rows, row):
+        with self._lock:
+            rows.append(row)
+            if self._oldest_pending is None:
+                self._oldest_pending = time.time()
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        pending = len(self._samples) + len(self._events) + len(self._cycles)
+        if pending >= BATCH_SIZE or (
+                self._oldest_pending is not None and time.time() - self._oldest_pending >= FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Commit all buffered rows in one transaction."""
+        with self._lock:
+            if not self._samples and not self._events and not self._cycles:
+                return
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(self._sample_sql(), self._samples)
+                self.db.executemany(
+                    "INSERT INTO cycle_events (ts, session_id, cycle, event, percent, duration_secs)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", self._events)
+                self.db.executemany(self._insert_sql("cycles", CYCLE_COLUMNS), self._cycles)
+            self._samples = []
+            self._events = []
+            self._cycles = []
+            self._oldest_pending = None
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    @staticmethod
+    def _sample_sql():
+        return HistoryStore._insert_sql("samples", SAMPLE_COLUMNS)
+
+    @staticmethod
+    def _insert_sql(table, columns):
+        return "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(columns), ", ".join("?" * len(columns)))
+
+    # --- queries ---
+
+    def _dicts(self, sql, args=()):
+        with self._lock:
+            cur = self.db.execute(sql, args)
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def health_at_cycle(self, cycle):
+        """Latest sample with a health value at or before app cycle `cycle`."""
+        rows = self._dicts(
+            "SELECT * FROM samples WHERE script_cycles <= ? AND calc_health IS NOT NULL"
+            " ORDER BY script_cycles DESC, ts DESC LIMIT 1", (cycle,))
+        return rows[0] if rows else None
+
+    def samples_since(self, since, until=None):
+        return self._dicts(
+            "SELECT * FROM samples WHERE ts >= ? AND ts <= ? ORDER BY ts",
+            (since, until if until is not None else time.time()))
+
+    def last_24h(self):
+        return self.samples_since(time.time() - 86400)
+
+    def events_for_cycle(self, cycle):
+        return self._dicts("SELECT * FROM cycle_events WHERE cycle = ? ORDER BY ts", (cycle,))
+
+    def cycles(self, limit=20):
+        """The latest completed cycles, newest first."""
+        return self._dicts("SELECT * FROM cycles ORDER BY ts DESC LIMIT ?", (limit,))
+
+    def sessions(self, limit=20):
+        return self._dicts("SELECT * FROM sessions ORDER BY started_at DESC LIMIT ?", (limit,))
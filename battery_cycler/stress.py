@@ -0,0 +1,492 @@
+"""CPU (stress-ng) and GPU (ffmpeg VideoToolbox) load used to speed up
+discharge. Levels match battery_cycle.sh. In closed-loop mode (drain.py)
+the CPU load is a worker count plus a duty cycle instead of a level.
+
+Each worker is its own process group, owned by a Worker: a thread blocks
+in wait4() on it, so an exit is noticed the moment it happens with no
+pgrep scans, and it is restarted after a backoff that doubles while runs
+keep failing quickly. Signals only ever go to our own process groups, so
+other stress-ng/ffmpeg jobs on the machine are left alone. The groups are
+listed in a pid file (shared with battery_cycle.sh) for kill_recorded().
+
+With "stress_standby" the workers are suspended (SIGSTOP) between
+discharges rather than killed, so the next discharge skips stress-ng's
+memory allocation and ffmpeg's encoder setup and is at full load at once.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from .paths import STRESS_PIDS_FILE
+
+# CPU "level" while drain.DrainController sets the load
+CLOSED_LOOP = "target"
+DUTY_PERIOD = 1.0  # seconds per run/pause cycle of a gated worker
+# Restart delay after a worker dies: doubled per quick failure, reset by a
+# run of at least STABLE_SECS
+RESTART_BACKOFF = 2.0
+MAX_RESTART_BACKOFF = 300.0
+STABLE_SECS = 60
+# Commands kill_recorded() accepts, so a reused PID is never killed
+RECORDED_COMMANDS = ("stress-ng", "ffmpeg")
+
+# level -> (stress-ng args, log description)
+CPU_STRESS_ARGS = {
+    "low": (["--cpu", "2", "--vm", "1", "--vm-bytes", "1G"], "LOW (2 CPU, 1GB RAM)"),
+    "medium": (["--cpu", "4", "--vm", "2", "--vm-bytes", "2G"], "MEDIUM (4 CPU, 2GB RAM)"),
+    "high": (["--cpu", "0", "--vm", "4", "--vm-bytes", "4G"], "HIGH (all CPUs, 4GB RAM)"),
+}
+
+# level -> (size, rate, bitrate, log description)
+GPU_STRESS_ARGS = {
+    "low": ("640x480", 30, "10M", "LOW (640x480@30fps, 10Mbps)"),
+    "medium": ("1280x720", 60, "30M", "MEDIUM (720p@60fps, 30Mbps)"),
+    "high": ("1920x1080", 60, "50M", "HIGH (1080p@60fps, 50Mbps)"),
+}
+
+
+def _spawn(args):
+    # Own session so the whole worker tree can be killed as a group
+    return subprocess.Popen(
+        args,
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def _describe(status):
+    if os.WIFSIGNALED(status):
+        return "signal {}".format(os.WTERMSIG(status))
+    return "exit {}".format(os.WEXITSTATUS(status))
+
+
+def _parse_cputime(text):
+    """ps TIME ('[[dd-]hh:]mm:ss[.cc]') -> seconds."""
+    days, _, text = text.strip().rpartition("-")
+    secs = 0.0
+    for part in text.split(":"):
+        secs = secs * 60 + float(part)
+    return secs + int(days or 0) * 86400
+
+
+def group_cpu_seconds(pgids):
+    """CPU seconds used so far by the live processes of each group in
+    `pgids`, from one ps call: {pgid: seconds}."""
+    totals = dict.fromkeys(pgids, 0.0)
+    if not totals:
+        return totals
+    try:
+        out = subprocess.run(["ps", "-A", "-o", "pgid=,time="], capture_output=True,
+                             text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return totals
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        try:
+            pgid = int(fields[0])
+            if pgid in totals:
+                totals[pgid] += _parse_cputime(fields[1])
+        except ValueError:
+            continue
+    return totals
+
+
+def read_recorded(path=STRESS_PIDS_FILE):
+    """[(name, pgid)] from the pid file, [] if there is none."""
+    entries = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2 and fields[1].isdigit():
+                    entries.append((fields[0], int(fields[1])))
+    except OSError:
+        pass
+    return entries
+
+
+def kill_recorded(path=STRESS_PIDS_FILE):
+    """Kill the worker groups listed in the pid file (left by
+    battery_cycle.sh or an app that didn't exit cleanly). A group is only
+    killed while its leader is still a stress-ng/ffmpeg process. Returns
+    the names of the groups killed."""
+    killed = []
+    for name, pgid in read_recorded(path):
+        try:
+            comm = subprocess.run(["ps", "-o", "comm=", "-p", str(pgid)], capture_output=True,
+                                  text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if os.path.basename(comm) not in RECORDED_COMMANDS:
+            continue
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+            killed.append(name)
+        except OSError:
+            pass
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return killed
+
+
+class Worker:
+    """One supervised stress process (and its process group).
+
+    Keeps the Popen handle so subprocess never reaps the child behind
+    wait4's back. `restarts` and `cpu_secs` (finished runs, from wait4's
+    rusage, plus the current run as of the last sample_cpu()) cover every
+    run since start().
+    """
+
+    def __init__(self, name, args, desc, log=print, on_change=None):
+        self.name = name
+        self.args = args
+        self.desc = desc
+        self.log = log
+        self.on_change = on_change
+        self.proc = None
+        self.started = None
+        self.restarts = 0
+        self.suspended = False
+        self.finished_cpu_secs = 0.0
+        self.live_cpu_secs = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def pid(self):
+        proc = self.proc
+        return proc.pid if proc is not None and proc.returncode is None else None
+
+    @property
+    def running(self):
+        return self.pid is not None
+
+    @property
+    def cpu_secs(self):
+        return self.finished_cpu_secs + self.live_cpu_secs
+
+    def start(self):
+        """Launch the process and supervise it. Raises OSError if it can't
+        be run (the command is missing)."""
+        self._launch()
+        self._thread = threading.Thread(target=self._supervise, name="stress-" + self.name.lower(), daemon=True)
+        self._thread.start()
+
+    def _launch(self):
+        self.proc = _spawn(self.args)
+        self.started = time.monotonic()
+        if self.suspended:
+            # Restarted while on standby - keep it that way
+            self.signal(signal.SIGSTOP)
+        if self.on_change:
+            self.on_change()
+
+    def _supervise(self):
+        failures = 0
+        while True:
+            proc = self.proc
+            try:
+                _, status, usage = os.wait4(proc.pid, 0)
+            except ChildProcessError:
+                status, usage = 0, None
+            with self._lock:
+                proc.returncode = status
+                self.live_cpu_secs = 0.0
+                if usage is not None:
+                    self.finished_cpu_secs += usage.ru_utime + usage.ru_stime
+                if self._stopped.is_set():
+                    return
+            if self.on_change:
+                self.on_change()
+            failures = 0 if time.monotonic() - self.started >= STABLE_SECS else failures + 1
+            delay = min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2 ** (failures - 1)) if failures else 0
+            self.log("{}: Process died ({}), restarting{}...".format(
+                self.name, _describe(status), " in {:.0f}s".format(delay) if delay else ""))
+            if self._stopped.wait(delay):
+                return
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+                try:
+                    self._launch()
+                except OSError as e:
+                    self.log("{}: Restart failed ({}), giving up".format(self.name, e))
+                    return
+                self.restarts += 1
+            self.log("{}: Restarted {}".format(self.name, self.desc))
+
+    def signal(self, signum):
+        pid = self.pid
+        if pid is None:
+            return
+        try:
+            os.killpg(pid, signum)
+        except OSError:
+            pass
+
+    def suspend(self):
+        with self._lock:
+            self.suspended = True
+            self.signal(signal.SIGSTOP)
+
+    def resume(self):
+        with self._lock:
+            self.suspended = False
+            self.signal(signal.SIGCONT)
+
+    def stop(self):
+        with self._lock:
+            self._stopped.set()
+            self.signal(signal.SIGKILL)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+
+
+class DutyGate(threading.Thread):
+    """Lets a worker's process group run `duty` of each period
+    (SIGCONT/SIGSTOP); follows the worker across restarts."""
+
+    def __init__(self, worker, duty, period=DUTY_PERIOD):
+        super().__init__(name="stress-duty-gate", daemon=True)
+        self.worker = worker
+        self.duty = duty
+        self.period = period
+        self._stopped = threading.Event()
+
+    def run(self):
+        signal_ = self.worker.signal
+        while not self._stopped.is_set():
+            duty = self.duty
+            signal_(signal.SIGCONT)
+            if duty >= 1.0:
+                self._stopped.wait(self.period)
+                continue
+            if self._stopped.wait(self.period * duty):
+                break
+            signal_(signal.SIGSTOP)
+            self._stopped.wait(self.period * (1.0 - duty))
+        # Never leave the workers stopped
+        signal_(signal.SIGCONT)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class StressManager:
+    """Starts, supervises and stops the stress workers for one engine.
+
+    `pid_file` lists the live worker groups (None to not keep one).
+    """
+
+    def __init__(self, stress_cmd, ffmpeg_cmd=None, log=print, pid_file=STRESS_PIDS_FILE):
+        self.stress_cmd = stress_cmd
+        self.ffmpeg_cmd = ffmpeg_cmd
+        self.log = log
+        self.pid_file = pid_file
+        self.cpu = None  # Worker
+        self.gpu = None
+        self.cpu_workers = None  # closed-loop mode only
+        self.cpu_duty = 1.0
+        self.suspended = False
+        self._gate = None
+        # Totals over workers already stopped, by "cpu"/"gpu"
+        self._restarts = {"cpu": 0, "gpu": 0}
+        self._cpu_secs = {"cpu": 0.0, "gpu": 0.0}
+
+    @property
+    def cpu_running(self):
+        return self.cpu is not None and self.cpu.running
+
+    @property
+    def gpu_running(self):
+        return self.gpu is not None and self.gpu.running
+
+    def _write_pids(self):
+        if self.pid_file is None:
+            return
+        lines = ["{} {}\n".format(kind, worker.pid)
+                 for kind, worker in (("cpu", self.cpu), ("gpu", self.gpu))
+                 if worker is not None and worker.pid is not None]
+        try:
+            if not lines:
+                if os.path.exists(self.pid_file):
+                    os.remove(self.pid_file)
+                return
+            os.makedirs(os.path.dirname(self.pid_file), exist_ok=True)
+            tmp = self.pid_file + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(tmp, self.pid_file)
+        except OSError:
+            pass
+
+    def _supervise(self, kind, args, desc):
+        """Start a worker for `kind`. If its command can't be run, that kind
+        of stress is disabled (logged) and discharge goes on without it;
+        returns whether the worker started."""
+        name = kind.upper() + "-STRESS"
+        worker = Worker(name, args, desc, log=lambda message: self.log(message),
+                        on_change=self._write_pids)
+        setattr(self, kind, worker)
+        try:
+            worker.start()
+        except OSError as e:
+            setattr(self, kind, None)
+            if kind == "cpu":
+                self.stress_cmd = None
+            else:
+                self.ffmpeg_cmd = None
+            self.log("{}: Failed to start {} ({}) - {} stress disabled".format(
+                name, os.path.basename(args[0]), e, kind.upper()))
+            return False
+        return True
+
+    def _retire(self, kind, worker):
+        worker.stop()
+        self._restarts[kind] += worker.restarts
+        self._cpu_secs[kind] += worker.cpu_secs
+
+    def start_cpu(self, level, verb="Started"):
+        if self.cpu is not None or level not in CPU_STRESS_ARGS and level != CLOSED_LOOP:
+            return
+        if not self.stress_cmd:
+            self.log("CPU-STRESS: stress-ng not found - CPU stress disabled")
+            return
+        if level == CLOSED_LOOP:
+            return  # set_cpu_load() starts it at the controller's load
+        args, desc = CPU_STRESS_ARGS[level]
+        if not self._supervise("cpu", [self.stress_cmd] + args + ["--timeout", "0"], desc):
+            return
+        self.log("CPU-STRESS: {} {}".format(verb, desc))
+
+    def start_gpu(self, level, verb="Started"):
+        if level not in GPU_STRESS_ARGS or self.gpu is not None:
+            return
+        if not self.ffmpeg_cmd:
+            self.log("GPU-STRESS: ffmpeg not found - GPU stress disabled")
+            return
+        size, rate, bitrate, desc = GPU_STRESS_ARGS[level]
+        if not self._supervise("gpu", [
+            self.ffmpeg_cmd, "-f", "lavfi",
+            "-i", "testsrc=duration=99999:size={}:rate={}".format(size, rate),
+            "-c:v", "hevc_videotoolbox", "-b:v", bitrate, "-f", "null", "-"
+        ], desc):
+            return
+        self.log("GPU-STRESS: {} {}".format(verb, desc))
+
+    def start(self, cpu_level, gpu_level):
+        self.start_cpu(cpu_level)
+        self.start_gpu(gpu_level)
+
+    def ensure(self, cpu_level, gpu_level):
+        """Start configured workers that aren't supervised yet; the
+        supervisor restarts the ones that die."""
+        if self.stress_cmd:
+            self.start_cpu(cpu_level)
+        if self.ffmpeg_cmd:
+            self.start_gpu(gpu_level)
+
+    def set_cpu_load(self, workers, duty=1.0):
+        """Closed-loop mode: `workers` stress-ng CPU workers, each running
+        `duty` of the time. stress-ng is only restarted when the worker
+        count changes; the duty cycle is applied live."""
+        if workers <= 0:
+            if self.cpu is not None:
+                self.stop_cpu()
+                self.log("CPU-STRESS: Paused (target met without stress)")
+            return
+        if not self.stress_cmd:
+            return
+        if workers != self.cpu_workers or self.cpu is None:
+            self.stop_cpu()
+            desc = "{} workers (closed loop)".format(workers)
+            if not self._supervise("cpu", [self.stress_cmd, "--cpu", str(workers), "--timeout", "0"], desc):
+                return
+            self.cpu_workers = workers
+            self.log("CPU-STRESS: Load {} workers at {:.0f}% (closed loop)".format(workers, duty * 100))
+        self.cpu_duty = duty
+        if duty < 1.0 and self._gate is None:
+            self._gate = DutyGate(self.cpu, duty)
+            self._gate.start()
+        elif self._gate is not None:
+            self._gate.duty = duty
+
+    def _stop_gate(self):
+        if self._gate is not None:
+            self._gate.stop()
+            self._gate = None
+
+    def stop_cpu(self):
+        self._stop_gate()
+        if self.cpu is not None:
+            self._retire("cpu", self.cpu)
+        self.cpu = None
+        self.cpu_workers = None
+        self.suspended = self.suspended and self.gpu is not None
+        self._write_pids()
+
+    def stop_gpu(self):
+        if self.gpu is not None:
+            self._retire("gpu", self.gpu)
+        self.gpu = None
+        self.suspended = self.suspended and self.cpu is not None
+        self._write_pids()
+
+    def suspend(self):
+        """Warm standby: keep the workers resident but stopped until
+        resume(). Does nothing if none are running."""
+        workers = [w for w in (self.cpu, self.gpu) if w is not None]
+        if not workers:
+            return
+        self._stop_gate()
+        for worker in workers:
+            worker.suspend()
+        self.suspended = True
+        self.log("STRESS: Suspended (standby until next discharge)")
+
+    def resume(self):
+        if not self.suspended:
+            return
+        for worker in (self.cpu, self.gpu):
+            if worker is not None:
+                worker.resume()
+        self.suspended = False
+        self.log("STRESS: Resumed from standby")
+
+    def stop(self):
+        self.stop_cpu()
+        self.log("CPU-STRESS: Stopped")
+        self.stop_gpu()
+        self.log("GPU-STRESS: Stopped")
+
+    def sample_cpu(self):
+        """Refresh the running workers' CPU time (one ps call)."""
+        workers = [w for w in (self.cpu, self.gpu) if w is not None and w.pid is not None]
+        totals = group_cpu_seconds([w.pid for w in workers])
+        for worker in workers:
+            worker.live_cpu_secs = totals.get(worker.pid, 0.0)
+
+    def stats(self):
+        """{"cpu"|"gpu": {running, pid, restarts, cpu_secs}} over this
+        manager's lifetime; cpu_secs is as of the last sample_cpu()."""
+        result = {}
+        for kind, worker in (("cpu", self.cpu), ("gpu", self.gpu)):
+            result[kind] = {
+                "running": worker is not None and worker.running,
+                "suspended": worker is not None and worker.suspended,
+                "pid": worker.pid if worker is not None else None,
+                "restarts": self._restarts[kind] + (worker.restarts if worker is not None else 0),
+                "cpu_secs": round(self._cpu_secs[kind] + (worker.cpu_secs if worker is not None else 0.0), 2),
+            }
+        return result
@@ -0,0 +1,189 @@
+"""Coulomb counting: the charge moved through the battery, in mAh, the
+equivalent full cycles it adds up to, and the energy it carried in Wh.
+
+TOTAL_DISCHARGE_CYCLES counts lower-limit crossings, so an 80->20 cycle
+and a 100->10 one count the same. CoulombCounter integrates the battery
+current (InstantAmperage, else Amperage) between consecutive readings
+instead, splitting each interval at a zero crossing so discharge and
+charge are counted separately.
+
+Readings further apart than MAX_GAP (the Mac slept, the loop stalled, a
+probe failed) aren't integrated across: a current from before the gap
+says nothing about what happened during it. The change in
+AppleRawCurrentCapacity over the gap is counted instead, a lower bound
+since it nets out anything that went both ways.
+
+Apple's CycleCount goes up by one per full charge capacity discharged,
+so equivalent cycles are discharged mAh over AppleRawMaxCapacity (else
+NominalChargeCapacity) at the time. Comparing the two per cycle and per
+session shows how much real wear a run adds for the cycles it counts.
+
+Battery power (Voltage x current) is integrated the same way into the
+energy delivered (discharging) and absorbed (charging), with the time
+spent and the peak power each way, so average power compares stress
+levels and machines by actual drain. Gaps are bridged with their mAh
+at the pack voltage. Adapter input (PowerTelemetryData SystemPowerIn,
+where the Mac reports it) is integrated only between readings that both
+have it, and averaged over the time it was drawing power.
+"""
+
+# Longest interval between readings that is integrated, seconds; the
+# engine and sampler read at least once a minute while running
+MAX_GAP = 180
+
+FIELDS = ("discharged_mah", "charged_mah", "equivalent_cycles", "gap_mah", "gap_secs",
+          "delivered_wh", "absorbed_wh", "discharge_secs", "charge_secs", "adapter_wh", "adapter_secs",
+          "peak_discharge_watts", "peak_charge_watts", "peak_adapter_watts")
+# Combined by max() rather than summed
+PEAKS = ("peak_discharge_watts", "peak_charge_watts", "peak_adapter_watts")
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Throughput:
+    """mAh moved out of and into the battery, the equivalent full cycles,
+    and how much of that was bridged over gaps (`gap_mah`, `gap_secs`);
+    Wh delivered/absorbed over `discharge_secs`/`charge_secs`, and
+    adapter input Wh over `adapter_secs`."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for name in FIELDS:
+            setattr(self, name, _float(values.get(name)))
+
+    def add(self, other):
+        for name in FIELDS:
+            if name in PEAKS:
+                setattr(self, name, max(getattr(self, name), getattr(other, name)))
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    @staticmethod
+    def _average(wh, secs):
+        return wh * 3600.0 / secs if secs else None
+
+    @property
+    def discharge_watts(self):
+        """Average battery power while discharging."""
+        return self._average(self.delivered_wh, self.discharge_secs)
+
+    @property
+    def charge_watts(self):
+        """Average battery power while charging."""
+        return self._average(self.absorbed_wh, self.charge_secs)
+
+    @property
+    def adapter_watts(self):
+        """Average adapter input power, where reported."""
+        return self._average(self.adapter_wh, self.adapter_secs)
+
+    def to_dict(self):
+        return {name: round(getattr(self, name), 4) for name in FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**(data if isinstance(data, dict) else {}))
+
+    def describe(self):
+        """'2450 mAh out, 2470 mAh in = 0.53 equivalent cycles' for the log."""
+        return "{:.0f} mAh out, {:.0f} mAh in = {:.2f} equivalent cycles".format(
+            self.discharged_mah, self.charged_mah, self.equivalent_cycles)
+
+    def describe_energy(self):
+        """'40.1 Wh delivered (avg 21.3 W, peak 25.0 W), ...' for the log."""
+        def phase(wh, average, peak, verb):
+            if average is None:
+                return "{:.1f} Wh {}".format(wh, verb)
+            return "{:.1f} Wh {} (avg {:.1f} W, peak {:.1f} W)".format(wh, verb, average, peak)
+        text = "{}, {}".format(
+            phase(self.delivered_wh, self.discharge_watts, self.peak_discharge_watts, "delivered"),
+            phase(self.absorbed_wh, self.charge_watts, self.peak_charge_watts, "absorbed"))
+        if self.adapter_watts is not None:
+            text += ", adapter avg {:.1f} W, peak {:.1f} W".format(self.adapter_watts, self.peak_adapter_watts)
+        return text
+
+
+def _split(value0, value1, secs):
+    """(out, in, out_secs, in_secs) for a signed rate moving linearly from
+    `value0` to `value1` over `secs`, integrated per hour: mAh from mA, Wh
+    from W."""
+    if value0 * value1 >= 0:
+        parts = [((value0 + value1) / 2.0, secs)]
+    else:
+        # Crosses zero part way: two triangles
+        f = value0 / (value0 - value1)
+        parts = [(value0 / 2.0, f * secs), (value1 / 2.0, (1.0 - f) * secs)]
+    out = into = out_secs = in_secs = 0.0
+    for mean, span in parts:
+        amount = mean * span / 3600.0
+        if amount < 0:
+            out -= amount
+            out_secs += span
+        elif amount > 0:
+            into += amount
+            in_secs += span
+    return out, into, out_secs, in_secs
+
+
+def _watts(battery, current):
+    if battery.voltage is None or current is None:
+        return None
+    return battery.voltage * current / 1e6
+
+
+class CoulombCounter:
+    def __init__(self, max_gap=MAX_GAP):
+        self.max_gap = max_gap
+        self._last = None  # (taken_at, current mA, raw mAh, battery W, adapter W)
+
+    def observe(self, battery):
+        """Fold in one BatterySnapshot. Returns the Throughput since the
+        previous reading, or None when there's nothing to count yet."""
+        if battery is None or battery.taken_at is None:
+            return None
+        current = battery.instant_amperage
+        if current is None:
+            current = battery.amperage
+        raw = battery.raw_current_capacity
+        watts, adapter = _watts(battery, current), battery.adapter_input_watts
+        previous, self._last = self._last, (battery.taken_at, current, raw, watts, adapter)
+        if previous is None:
+            return None
+        t0, current0, raw0, watts0, adapter0 = previous
+        secs = battery.taken_at - t0
+        if secs <= 0:
+            return None
+
+        step = Throughput()
+        if secs <= self.max_gap and current is not None and current0 is not None:
+            step.discharged_mah, step.charged_mah, _, _ = _split(current0, current, secs)
+            if watts is not None and watts0 is not None:
+                (step.delivered_wh, step.absorbed_wh,
+                 step.discharge_secs, step.charge_secs) = _split(watts0, watts, secs)
+                step.peak_discharge_watts = max(0.0, -watts0, -watts)
+                step.peak_charge_watts = max(0.0, watts0, watts)
+            if adapter is not None and adapter0 is not None and adapter0 + adapter > 0:
+                step.adapter_wh = (adapter0 + adapter) / 2.0 * secs / 3600.0
+                step.adapter_secs = secs
+                step.peak_adapter_watts = max(adapter0, adapter)
+        else:
+            step.gap_secs = secs
+            if raw is not None and raw0 is not None:
+                moved = raw - raw0
+                step.gap_mah = abs(moved)
+                wh = abs(moved) * battery.voltage / 1e6 if battery.voltage is not None else 0.0
+                if moved < 0:
+                    step.discharged_mah, step.delivered_wh = -moved, wh
+                else:
+                    step.charged_mah, step.absorbed_wh = moved, wh
+        full = battery.raw_max_capacity or battery.nominal_capacity
+        if full:
+            step.equivalent_cycles = step.discharged_mah / full
+        return step
@@ -0,0 +1,168 @@
+"""Phase-switch latency: where the seconds go between a limit being
+crossed and the new charging state being applied.
+
+Every switch (charging at the lower limit, discharging at the upper one)
+is timed in stages on the engine's clock:
+
+    detect   the level crossing the limit, as estimated by rate.py, until
+             the reading that showed it was started
+    read     that battery reading
+    prepare  bookkeeping before acting: state journal, history (the health
+             log and profile refresh wait until the change is applied)
+    stress   stopping, suspending or starting the stress workers
+    command  the backend call, up to when the change was applied; the
+             steps a backend reports (bin/battery's maintain stop, adapter
+             on, SMC write...) are kept as command.<step>
+    total    crossing (or the reading, if the rate isn't known yet) until
+             the change was applied
+    act      the decision to switch until the change was applied (the lead
+             time predictive switching allows for)
+
+With the level and rate at the decision, a switch also knows its
+overshoot: how far past the limit the level was when the change was
+applied (negative if it was applied early).
+
+Each switch is logged as a SWITCH line. TransitionStats keeps the latest
+durations of each stage for summary() (Show Stats) and feeds the
+battery_cycler_transition_stage_seconds histogram.
+"""
+
+import collections
+
+from . import metrics
+
+# Durations kept per (kind, stage) for the percentiles
+HISTORY = 200
+# Decision-to-applied time assumed before any switch of a kind was measured
+DEFAULT_LEAD = 2.0
+
+
+def crossing_time(estimator, limit, falling, before, resolution=1.0):
+    """When a reading rounded to `resolution` would first have shown
+    `limit`, by extrapolating `estimator` (not yet updated with the new
+    reading), or None if the rate isn't known. Clamped to between the
+    estimator's last sample and `before`, the start of the reading that
+    showed it."""
+    if not estimator.ready or not estimator.rate:
+        return None
+    # The rounded reading shows the limit half a step before the level gets there
+    edge = limit + (resolution / 2.0 if falling else -resolution / 2.0)
+    crossed = estimator.last_t + (edge - estimator.level) / estimator.rate
+    return min(before, max(estimator.last_t, crossed))
+
+
+class Transition:
+    """Stage marks for one switch. `kind` is the phase being entered."""
+
+    def __init__(self, kind, read_started, read_done, crossed=None, limit=None, level=None, rate=None):
+        self.kind = kind
+        self.limit = limit
+        self.level = level  # at read_done, percent
+        self.rate = rate    # percent per second, if known
+        self.read_done = read_done
+        self.started = crossed if crossed is not None else read_started
+        self.stages = []
+        if crossed is not None:
+            self.stages.append(("detect", read_started - crossed))
+        self.stages.append(("read", read_done - read_started))
+        self.applied = None
+        self._last = read_done
+
+    def mark(self, stage, now):
+        """End `stage` at `now` (it began at the previous mark)."""
+        self.stages.append((stage, max(0.0, now - self._last)))
+        self._last = now
+
+    def command(self, now, steps=None):
+        """End the command stage. `steps` [(name, secs)] are the backend's
+        own steps up to the point the change was applied, when known."""
+        began = self._last
+        self.mark("command", now)
+        if steps:
+            for name, secs in steps:
+                self.stages.append(("command." + name, secs))
+            self.applied = began + sum(secs for _, secs in steps)
+        else:
+            self.applied = now
+
+    @property
+    def total(self):
+        return max(0.0, self._applied - self.started)
+
+    @property
+    def act(self):
+        return max(0.0, self._applied - self.read_done)
+
+    @property
+    def _applied(self):
+        return self.applied if self.applied is not None else self._last
+
+    @property
+    def overshoot(self):
+        """Percent past the limit when the change was applied, or None."""
+        if self.limit is None or self.level is None:
+            return None
+        level = self.level + (self.rate or 0.0) * (self._applied - self.read_done)
+        return self.limit - level if self.kind == "charging" else level - self.limit
+
+    def describe(self):
+        """'1.8s (detect 0.9s, read 0.1s, ...), 0.03% past the limit' for the log."""
+        text = "{:.1f}s ({})".format(self.total, ", ".join(
+            "{} {:.1f}s".format(name, secs) for name, secs in self.stages if "." not in name))
+        overshoot = self.overshoot
+        if overshoot is not None:
+            text += ", {:.2f}% {} the limit".format(abs(overshoot), "past" if overshoot >= 0 else "short of")
+        return text
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class TransitionStats:
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.counts = collections.Counter()
+        self._durations = {}
+        self._overshoots = {}
+
+    def _keep(self, table, key, value):
+        table.setdefault(key, collections.deque(maxlen=self.history)).append(value)
+
+    def add(self, transition):
+        self.counts[transition.kind] += 1
+        for name, secs in transition.stages + [("total", transition.total), ("act", transition.act)]:
+            self._keep(self._durations, (transition.kind, name), secs)
+            metrics.TRANSITION_LATENCY.observe(secs, kind=transition.kind, stage=name)
+        overshoot = transition.overshoot
+        if overshoot is not None:
+            self._keep(self._overshoots, transition.kind, overshoot)
+            metrics.OVERSHOOT.set(round(overshoot, 3), kind=transition.kind)
+
+    def lead(self, kind):
+        """Typical decision-to-applied seconds for switches to `kind`."""
+        values = self._durations.get((kind, "act"))
+        return _percentile(values, 0.5) if values else DEFAULT_LEAD
+
+    @staticmethod
+    def _summarise(values):
+        return {
+            "count": len(values),
+            "mean": round(sum(values) / len(values), 3),
+            "p50": round(_percentile(values, 0.5), 3),
+            "p90": round(_percentile(values, 0.9), 3),
+            "max": round(max(values), 3),
+        }
+
+    def summary(self):
+        """{kind: {stage: {count, mean, p50, p90, max}}} over the latest
+        `history` switches of each kind, in seconds."""
+        result = {}
+        for (kind, stage), values in self._durations.items():
+            result.setdefault(kind, {})[stage] = self._summarise(values)
+        return result
+
+    def overshoot(self):
+        """{kind: {count, mean, p50, p90, max}} of the overshoot, percent."""
+        return {kind: self._summarise(values) for kind, values in self._overshoots.items()}
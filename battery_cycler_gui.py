@@ -4,10 +4,20 @@ No dependency on AlDente or Apple Shortcuts."""
 
 import rumps
 import subprocess
-import json
 import os
-import sys
-import signal
+import shutil
+import threading
+
+from battery_cycler import backend, metrics, smc
+from battery_cycler.aggregates import SessionAggregates
+from battery_cycler.cache import power_profile
+from battery_cycler.config import ConfigStore
+from battery_cycler.engine import CyclingEngine, HOLDING
+from battery_cycler.macos import MacHardware
+from battery_cycler.paths import LOG_FILE
+from battery_cycler.rate import format_estimate
+from battery_cycler.sampler import Sampler
+from battery_cycler.stress import StressManager, kill_recorded
 
 VERSION = "2.1.0"
 BUILD_COMMIT = "bf3e094"  # Update with each release
@@ -30,32 +40,6 @@ def get_version_string():
         pass
     return f"v{VERSION} ({BUILD_COMMIT})"
 
-CONFIG_FILE = os.path.expanduser("~/battery_cycle_config.json")
-STATE_FILE = os.path.expanduser("~/battery_cycle_state.txt")
-LOG_FILE = os.path.expanduser("~/battery_cycles.log")
-
-# Find script path - works both in dev and in app bundle
-def get_script_path():
-    # Check if running from app bundle
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, "battery_cycle.sh")
-    # Check in Resources folder (py2app)
-    bundle_dir = os.path.dirname(os.path.abspath(__file__))
-    resources_script = os.path.join(bundle_dir, "battery_cycle.sh")
-    if os.path.exists(resources_script):
-        return resources_script
-    # Fallback to Dropbox location
-    return os.path.expanduser("~/Dropbox/Claude Projects/battery-cycler-standalone/battery_cycle.sh")
-
-DEFAULT_CONFIG = {
-    "upper_limit": 80,
-    "lower_limit": 20,
-    "pause_limit": 50,
-    "reset_limit": 80,
-    "cpu_stress": "high",  # off, low, medium, high
-    "gpu_stress": "off"    # off, low, medium, high
-}
-
 STRESS_LEVELS = ["Off", "Low", "Medium", "High"]
 
 
@@ -83,20 +67,27 @@ def check_battery_cli():
     return os.path.exists(get_battery_cli_path())
 
 
-def run_battery_cmd(args):
-    """Run the bundled battery CLI command."""
-    try:
-        battery_path = get_battery_cli_path()
-        subprocess.run([battery_path] + args, capture_output=True, timeout=10)
-    except Exception as e:
-        print(f"battery command failed: {e}")
+def find_ffmpeg():
+    """ffmpeg is optional (GPU stress) - look in Homebrew locations too,
+    since apps launched from Finder get a minimal PATH."""
+    search = os.pathsep.join([os.environ.get("PATH", ""), "/opt/homebrew/bin", "/usr/local/bin"])
+    return shutil.which("ffmpeg", path=search)
+
+
+def show_dialog(script):
+    """Run an osascript dialog without blocking the menu bar (it waits for OK)."""
+    threading.Thread(target=subprocess.run, args=(["osascript", "-e", script],),
+                     daemon=True).start()
 
 
 class BatteryCyclerApp(rumps.App):
     def __init__(self):
         super().__init__("", quit_button=None)
-        self.script_process = None
-        self.config = self.load_config()
+        self.engine = None
+        self.config_store = ConfigStore()
+        self.config = self.config_store.data
+        power_profile.ttl = self.config["profiler_cache_ttl"]
+        self.config_store.subscribe(self.on_config_change)
 
         # Check for battery CLI
         if not check_battery_cli():
@@ -145,9 +136,6 @@ class BatteryCyclerApp(rumps.App):
 
         # CPU stress submenu
         cpu_level = self.config.get("cpu_stress", "high")
-        if isinstance(cpu_level, bool):  # migrate old config
-            cpu_level = "high" if cpu_level else "off"
-            self.config["cpu_stress"] = cpu_level
         self.cpu_stress_menu = rumps.MenuItem("CPU Stress: {}".format(cpu_level.title()))
         for level in STRESS_LEVELS:
             item = rumps.MenuItem(level, callback=self.set_cpu_stress)
@@ -157,9 +145,6 @@ class BatteryCyclerApp(rumps.App):
 
         # GPU stress submenu
         gpu_level = self.config.get("gpu_stress", "off")
-        if isinstance(gpu_level, bool):  # migrate old config
-            gpu_level = "high" if gpu_level else "off"
-            self.config["gpu_stress"] = gpu_level
         self.gpu_stress_menu = rumps.MenuItem("GPU Stress: {}".format(gpu_level.title()))
         for level in STRESS_LEVELS:
             item = rumps.MenuItem(level, callback=self.set_gpu_stress)
@@ -201,112 +186,122 @@ class BatteryCyclerApp(rumps.App):
             rumps.MenuItem("Quit", callback=self.quit_app)
         ]
 
-        # Start timer to update status
-        self.timer = rumps.Timer(self.update_status, 5)
+        # One battery backend for the menu, Show Stats and the engine
+        self.hardware = MacHardware(get_battery_cli_path())
+        self.backend = backend.Instrumented(self.hardware)
+
+        # Probe battery in the background; the timer only applies snapshots
+        self.sampler = Sampler(self.backend, interval=5, targets=self.poll_targets)
+        self.sampler.start()
+
+        # Optional Prometheus endpoint; scrapes only read what's sampled above
+        self.metrics_server = None
+        metrics.REGISTRY.add_collector(metrics.StatusCollector(self.sampler, lambda: self.engine, self.config))
+        self.start_metrics()
+
+        # Start timer to update status (cheap - it only applies the latest
+        # snapshot, so a short period just makes refreshes show up sooner)
+        self.timer = rumps.Timer(self.update_status, 1)
         self.timer.start()
         self.update_status(None)
 
-    def load_config(self):
-        if os.path.exists(CONFIG_FILE):
+    def poll_targets(self):
+        # Limits the sampler should poll densely around (None: fixed 5 s)
+        if not self.config.get("adaptive_polling", True):
+            return None
+        return (self.config["lower_limit"], self.config["upper_limit"])
+
+    def on_config_change(self, changed, config):
+        if "profiler_cache_ttl" in changed:
+            power_profile.ttl = config["profiler_cache_ttl"]
+        if changed & {"metrics_port", "metrics_address"}:
+            self.start_metrics()
+
+    def start_metrics(self):
+        # (Re)start the metrics endpoint on the configured port, 0 = off
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        try:
+            port = int(self.config.get("metrics_port") or 0)
+        except (TypeError, ValueError):
+            port = 0
+        if port:
             try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    # Merge with defaults
-                    for key in DEFAULT_CONFIG:
-                        if key not in config:
-                            config[key] = DEFAULT_CONFIG[key]
-                    return config
-            except:
-                pass
-        return DEFAULT_CONFIG.copy()
+                self.metrics_server = metrics.MetricsServer(
+                    port, self.config.get("metrics_address", "127.0.0.1")).start()
+            except OSError as e:
+                print(f"metrics endpoint on port {port} failed: {e}")
 
     def save_config(self):
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, indent=2)
-
-    def get_battery_info(self):
-        try:
-            result = subprocess.run(
-                ["pmset", "-g", "batt"],
-                capture_output=True, text=True, timeout=5
-            )
-            output = result.stdout
-            # Parse battery percentage
-            import re
-            match = re.search(r'(\d+)%', output)
-            percent = int(match.group(1)) if match else 0
-
-            # Check if charging
-            charging = "charging" in output.lower() or "AC Power" in output
-            return percent, charging
-        except:
-            return 0, False
-
-    def get_cycle_info(self):
-        cycles = 0
-        health = "--"
+        # Subscribers (the running engine) are notified of changed keys
         try:
-            if os.path.exists(STATE_FILE):
-                with open(STATE_FILE, 'rb') as f:
-                    content = f.read().decode('ascii', 'replace')
-                    for line in content.split('\n'):
-                        if line.startswith("TOTAL_DISCHARGE_CYCLES="):
-                            cycles = int(line.split("=")[1].strip())
-
-            # Get Apple health from system_profiler (official value)
-            result = subprocess.run(
-                ["system_profiler", "SPPowerDataType"],
-                capture_output=True, timeout=10
-            )
-            output = result.stdout.decode('utf-8', 'replace')
-            for line in output.split('\n'):
-                if "Maximum Capacity" in line and ":" in line:
-                    health = line.split(':')[-1].strip()
-                    break
-        except:
-            pass
-        return cycles, health
+            self.config_store.save()
+        except OSError as e:
+            print(f"saving config failed: {e}")
 
     def update_status(self, _):
-        percent, charging = self.get_battery_info()
-        cycles, health = self.get_cycle_info()
-
-        # Update title with battery percentage
-        self.title = "{} {}%".format("" if charging else "", percent)
+        # Runs on the main thread - only apply the sampler's latest snapshot,
+        # never probe here (system_profiler can block for seconds)
+        snapshot = self.sampler.latest
+        if snapshot is not None:
+            self.title = "{} {}%".format("" if snapshot.charging else "", snapshot.percent)
 
         # Update status
-        if self.script_process and self.script_process.poll() is None:
-            self.status_item.title = "Status: Cycling Active"
-            self.toggle_item.title = "Stop Cycling"
+        engine = self.engine
+        if engine and engine.running:
+            if engine.stopping:
+                self.status_item.title = "Status: Stopping..."
+                self.toggle_item.title = "Start Cycling"
+            elif engine.state == HOLDING:
+                self.status_item.title = "Status: Paused (holding at {}%)".format(engine.hold_level)
+                self.toggle_item.title = "Resume Cycling"
+            else:
+                self.status_item.title = self.with_rate("Status: Cycling Active", engine.estimate())
+                self.toggle_item.title = "Stop Cycling"
         else:
-            self.status_item.title = "Status: Idle"
+            self.status_item.title = self.with_rate("Status: Idle", self.sampler.estimate())
             self.toggle_item.title = "Start Cycling"
-            self.script_process = None
+            self.engine = None
 
         # Update info
-        self.info_item.title = "Cycles: {} | Health: {}".format(cycles, health)
+        if snapshot is not None:
+            self.info_item.title = "Cycles: {} | Health: {}".format(snapshot.cycles, snapshot.health)
+
+    @staticmethod
+    def with_rate(title, estimate):
+        # e.g. "Status: Cycling Active · -18.2%/h · 14.1 W · 20% in 1h05m"
+        text = format_estimate(estimate)
+        return "{} · {}".format(title, text) if text else title
+
+    def create_engine(self):
+        stress = StressManager(os.path.join(get_bundled_bin_path(), "stress-ng"), find_ffmpeg())
+        # Use the privileged SMC helper for phase switches if it's running
+        if self.hardware.smc is None:
+            self.hardware.smc = smc.connect()
+        return CyclingEngine(self.backend, stress, self.config_store)
 
     def toggle_cycling(self, _):
-        if self.script_process and self.script_process.poll() is None:
-            # Stop cycling
-            try:
-                os.killpg(os.getpgid(self.script_process.pid), signal.SIGTERM)
-            except:
-                self.script_process.terminate()
-            self.script_process = None
-            rumps.notification("Battery Cycler", "", "Cycling stopped")
+        engine = self.engine
+        if engine and engine.running:
+            if engine.stopping:
+                # Previous run is still restoring the battery - wait for it
+                return
+            if engine.state == HOLDING:
+                engine.resume()
+                rumps.notification("Battery Cycler", "", "Cycling resumed")
+            else:
+                # Stop cycling
+                engine.stop(maintain_level=80)
+                rumps.notification("Battery Cycler", "", "Cycling stopped")
         else:
             # Save current config before starting
             self.save_config()
             # Start cycling
-            script_path = get_script_path()
-            self.script_process = subprocess.Popen(
-                ["bash", script_path],
-                start_new_session=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
+            self.engine = self.create_engine()
+            self.engine.start()
             rumps.notification("Battery Cycler", "", "Cycling started")
+        self.sampler.refresh()
         self.update_status(None)
 
     def set_upper_limit(self, sender):
@@ -356,94 +351,69 @@ class BatteryCyclerApp(rumps.App):
         subprocess.run(["osascript", "-e", script])
 
     def show_stats(self, _):
-        # Use osascript to show stats (avoids rumps encoding issues)
+        # Everything here is precomputed: the sampler's latest snapshot and
+        # the engine's running aggregates. No probes on the main thread.
         try:
-            # Get current battery info from system_profiler
-            result = subprocess.run(
-                ["system_profiler", "SPPowerDataType"],
-                capture_output=True, timeout=10
-            )
-            output = result.stdout.decode('utf-8', 'replace')
-            apple_health = "N/A"
-            condition = "N/A"
-            apple_cycles = "N/A"
-            for line in output.split('\n'):
-                line = line.strip()
-                if "Maximum Capacity" in line and ":" in line:
-                    apple_health = line.split(':')[-1].strip()
-                elif "Condition" in line and ":" in line:
-                    condition = line.split(':')[-1].strip()
-                elif "Cycle Count" in line and ":" in line:
-                    apple_cycles = line.split(':')[-1].strip()
-
-            # Get calculated health from ioreg
-            result2 = subprocess.run(
-                ["ioreg", "-rn", "AppleSmartBattery"],
-                capture_output=True, timeout=5
-            )
-            output2 = result2.stdout.decode('utf-8', 'replace')
-            nominal_cap = None
-            design_cap = None
-            calc_health = "N/A"
-            for line in output2.split('\n'):
-                if '"NominalChargeCapacity"' in line and '=' in line:
-                    try:
-                        nominal_cap = int(line.split('=')[-1].strip())
-                    except:
-                        pass
-                if '"DesignCapacity"' in line and '=' in line:
-                    try:
-                        design_cap = int(line.split('=')[-1].strip())
-                    except:
-                        pass
-            if nominal_cap and design_cap and design_cap > 0:
-                calc_health = str(int(nominal_cap * 100 / design_cap)) + "%"
+            snapshot = self.sampler.latest
+            profile = snapshot.profile if snapshot else {}
+            battery = snapshot.battery if snapshot else None
+            state = snapshot.state if snapshot else {}
+
+            # Apple's values from the shared system_profiler cache
+            apple_health = profile.get("max_capacity") or "N/A"
+            condition = profile.get("condition") or "N/A"
+
+            engine = self.engine
+            if engine and engine.running:
+                agg = engine.aggregates
+                script_cycles = engine.cycles
+                stress_stats = engine.stress.stats()
+                switches = engine.transition_stats.summary()
+                overshoots = engine.transition_stats.overshoot()
+            else:
+                agg = SessionAggregates.from_state(state)
+                script_cycles = snapshot.cycles if snapshot else 0
+                stress_stats = None
+                switches = {}
+                overshoots = {}
+
+            nominal_cap = battery.nominal_capacity if battery else None
+            design_cap = battery.design_capacity if battery else None
+            health = battery.health_percent if battery else agg.current_health
+            calc_health = str(int(health)) + "%" if health else "N/A"
+            if nominal_cap and design_cap:
                 cap_info = str(nominal_cap) + "/" + str(design_cap) + " mAh"
             else:
                 cap_info = "N/A"
-
-            # Get state file info
-            script_cycles = 0
-            initial_health = "N/A"
-            initial_apple_cycles = "N/A"
-            total_active_secs = 0
-            total_discharge_secs = 0
-            total_charge_secs = 0
-            if os.path.exists(STATE_FILE):
-                try:
-                    with open(STATE_FILE, 'rb') as f:
-                        content = f.read().decode('ascii', 'replace')
-                        for line in content.split('\n'):
-                            if line.startswith("TOTAL_DISCHARGE_CYCLES="):
-                                script_cycles = int(line.split("=")[1].strip())
-                            elif line.startswith("INITIAL_HEALTH="):
-                                val = line.split("=")[1].strip().strip('"')
-                                if val and val != "":
-                                    initial_health = val + "%"
-                            elif line.startswith("INITIAL_APPLE_CYCLES="):
-                                val = line.split("=")[1].strip().strip('"')
-                                if val and val != "":
-                                    initial_apple_cycles = val
-                            elif line.startswith("TOTAL_ACTIVE_SECS="):
-                                try:
-                                    total_active_secs = int(line.split("=")[1].strip())
-                                except:
-                                    pass
-                            elif line.startswith("TOTAL_DISCHARGE_SECS="):
-                                try:
-                                    total_discharge_secs = int(line.split("=")[1].strip())
-                                except:
-                                    pass
-                            elif line.startswith("TOTAL_CHARGE_SECS="):
-                                try:
-                                    total_charge_secs = int(line.split("=")[1].strip())
-                                except:
-                                    pass
-                except:
-                    pass
+            soc = battery.state_of_charge if battery else None
+            if soc is not None:
+                charge_info = "{:.2f}% ({}/{} mAh)".format(soc, battery.raw_current_capacity, battery.raw_max_capacity)
+            else:
+                charge_info = str(snapshot.percent) + "%" if snapshot else "N/A"
+
+            apple_cycles = battery.cycle_count if battery and battery.cycle_count is not None else None
+            if apple_cycles is None:
+                apple_cycles = agg.current_apple_cycles
+            apple_cycles = "N/A" if apple_cycles is None else str(apple_cycles)
+            initial_health = "{:.2f}%".format(agg.initial_health) if agg.initial_health else "N/A"
+            initial_apple_cycles = "N/A" if agg.initial_apple_cycles is None else str(agg.initial_apple_cycles)
+            cycles_added = "N/A" if agg.apple_cycles_added is None else str(agg.apple_cycles_added)
+            # Coulomb-counted throughput vs the Apple cycles it added
+            ratio = agg.cycles_per_equivalent
+            equivalent = "{:.2f}{}".format(agg.equivalent_cycles,
+                                           "" if ratio is None else " ({:.2f} Apple cycles each)".format(ratio))
+            throughput = "{:.0f} mAh out, {:.0f} mAh in".format(agg.discharged_mah, agg.charged_mah)
+            energy = "{:.1f} Wh delivered, {:.1f} Wh absorbed".format(agg.delivered_wh, agg.absorbed_wh)
+            diff = agg.health_delta
+            health_change = "N/A" if diff is None else ("+" if diff >= 0 else "") + str(round(diff, 1)) + "%"
+            if agg.min_temperature is not None:
+                temp_range = "{:.1f} - {:.1f} C".format(agg.min_temperature, agg.max_temperature)
+            else:
+                temp_range = "N/A"
 
             # Format time
             def fmt_time(secs):
+                secs = int(secs or 0)
                 if secs == 0:
                     return "0m"
                 hours = secs // 3600
@@ -452,24 +422,27 @@ class BatteryCyclerApp(rumps.App):
                     return str(hours) + "h " + str(mins) + "m"
                 return str(mins) + "m"
 
-            # Calculate cycles added
-            cycles_added = "N/A"
-            if apple_cycles != "N/A" and initial_apple_cycles != "N/A":
-                try:
-                    cycles_added = str(int(apple_cycles) - int(initial_apple_cycles))
-                except:
-                    pass
-
-            # Calculate health change
-            health_change = "N/A"
-            if initial_health != "N/A" and calc_health != "N/A":
-                try:
-                    init_val = float(initial_health.replace("%", ""))
-                    curr_val = float(calc_health.replace("%", ""))
-                    diff = curr_val - init_val
-                    health_change = ("+" if diff >= 0 else "") + str(round(diff, 1)) + "%"
-                except:
-                    pass
+            if stress_stats:
+                cpu, gpu = stress_stats["cpu"], stress_stats["gpu"]
+                stress_line = "Stress CPU Time: {} ({} restarts)\\n".format(
+                    fmt_time(cpu["cpu_secs"] + gpu["cpu_secs"]), cpu["restarts"] + gpu["restarts"])
+            else:
+                stress_line = ""
+
+            # Phase switch latency: median/max from crossing to applied,
+            # and the stage that took longest on average
+            switch_lines = ""
+            for kind in ("charging", "discharging"):
+                stages = switches.get(kind)
+                if not stages:
+                    continue
+                total = stages["total"]
+                slowest = max((name for name in stages if name not in ("total", "act") and "." not in name),
+                              key=lambda name: stages[name]["mean"])
+                overshoot = overshoots.get(kind)
+                switch_lines += "To {}: {:.1f}s median, {:.1f}s max (mostly {}){}\\n".format(
+                    kind.title(), total["p50"], total["max"], slowest,
+                    ", {:+.2f}% vs limit".format(overshoot["p50"]) if overshoot else "")
 
             # Build stats message - pure ASCII
             stats = (
@@ -477,23 +450,31 @@ class BatteryCyclerApp(rumps.App):
                 "Apple Reported: " + str(apple_health) + "\\n"
                 "Calculated: " + str(calc_health) + "\\n"
                 "Capacity: " + str(cap_info) + "\\n"
+                "Charge: " + charge_info + "\\n"
                 "Condition: " + str(condition) + "\\n"
                 "\\n"
                 "=== CYCLE COUNTS ===\\n"
                 "Apple Cycles: " + str(apple_cycles) + "\\n"
                 "App Cycles: " + str(script_cycles) + "\\n"
                 "Apple Cycles Added: " + str(cycles_added) + "\\n"
+                "Equivalent Cycles: " + equivalent + "\\n"
+                "Throughput: " + throughput + "\\n"
+                "Energy: " + energy + "\\n"
                 "\\n"
                 "=== SESSION STATS ===\\n"
-                "Total Active: " + fmt_time(total_active_secs) + "\\n"
-                "Time Discharging: " + fmt_time(total_discharge_secs) + "\\n"
-                "Time Charging: " + fmt_time(total_charge_secs) + "\\n"
+                "Total Active: " + fmt_time(agg.active_secs) + "\\n"
+                "Time Discharging: " + fmt_time(agg.discharge_secs) + "\\n"
+                "Time Charging: " + fmt_time(agg.charge_secs) + "\\n"
+                "Time Holding: " + fmt_time(agg.hold_secs) + "\\n"
+                "Temperature: " + temp_range + "\\n"
+                + stress_line +
                 "\\n"
                 "=== CHANGES ===\\n"
                 "Initial Health: " + str(initial_health) + "\\n"
                 "Health Change: " + str(health_change) + "\\n"
                 "Initial Cycles: " + str(initial_apple_cycles) + "\\n"
                 "\\n"
+                + ("=== PHASE SWITCHES ===\\n" + switch_lines + "\\n" if switch_lines else "") +
                 "=== SETTINGS ===\\n"
                 "CPU: " + str(self.config.get("cpu_stress", "off")).title() + "  "
                 "GPU: " + str(self.config.get("gpu_stress", "off")).title()
@@ -501,9 +482,9 @@ class BatteryCyclerApp(rumps.App):
 
             # Use osascript to display dialog (avoids rumps encoding)
             script = 'display dialog "{}" with title "Battery Cycler Stats" buttons {{"OK"}} default button "OK"'.format(stats)
-            subprocess.run(["osascript", "-e", script])
         except Exception as e:
-            subprocess.run(["osascript", "-e", 'display dialog "Error: {}" with title "Error"'.format(str(e).replace('"', "'"))])
+            script = 'display dialog "Error: {}" with title "Error"'.format(str(e).replace('"', "'"))
+        show_dialog(script)
 
     def pause_at_percent(self, sender):
         # Get the percentage from the menu item
@@ -516,21 +497,18 @@ class BatteryCyclerApp(rumps.App):
         for item in self.pause_menu.values():
             item.state = 1 if item.title == sender.title else 0
 
-        # Stop the cycling script if running
-        if self.script_process and self.script_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(self.script_process.pid), signal.SIGTERM)
-            except:
-                self.script_process.terminate()
-            self.script_process = None
-
-        # Kill any stress processes
-        subprocess.run(["pkill", "-9", "stress-ng"], capture_output=True)
-        subprocess.run(["pkill", "-f", "ffmpeg.*videotoolbox"], capture_output=True)
+        if self.engine and self.engine.running:
+            # The engine stops its stress workers and holds the level itself
+            self.engine.hold(val)
+        else:
+            # Kill stress workers left by battery_cycle.sh or an unclean exit
+            kill_recorded()
 
-        # Use battery CLI to maintain at selected percentage
-        run_battery_cmd(["maintain", str(val)])
+            # Maintain the selected percentage through the backend
+            if not backend.run_sync(self.backend.hold(val)):
+                print(f"holding at {val}% failed")
         rumps.notification("Battery Cycler", "", "Paused - holding at {}%".format(val))
+        self.sampler.refresh()
         self.update_status(None)
 
     def stop_at_percent(self, sender):
@@ -544,29 +522,28 @@ class BatteryCyclerApp(rumps.App):
         for item in self.stop_menu.values():
             item.state = 1 if item.title == sender.title else 0
 
-        # Stop the cycling script if running
-        if self.script_process and self.script_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(self.script_process.pid), signal.SIGTERM)
-            except:
-                self.script_process.terminate()
-            self.script_process = None
-
-        # Kill any stress processes
-        subprocess.run(["pkill", "-9", "stress-ng"], capture_output=True)
-        subprocess.run(["pkill", "-f", "ffmpeg.*videotoolbox"], capture_output=True)
+        if self.engine and self.engine.running:
+            # The engine stops its stress workers and sets the maintain level on exit
+            self.engine.stop(maintain_level=val)
+        else:
+            # Kill stress workers left by battery_cycle.sh or an unclean exit
+            kill_recorded()
 
-        # Use battery CLI to maintain at selected percentage
-        run_battery_cmd(["maintain", str(val)])
+            # Maintain the selected percentage through the backend
+            if not backend.run_sync(self.backend.hold(val)):
+                print(f"holding at {val}% failed")
         rumps.notification("Battery Cycler", "", "Stopped - reset to {}% limit".format(val))
+        self.sampler.refresh()
         self.update_status(None)
 
     def quit_app(self, _):
-        if self.script_process and self.script_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(self.script_process.pid), signal.SIGTERM)
-            except:
-                self.script_process.terminate()
+        if self.engine and self.engine.running:
+            # Let the engine stop stress and restore charging before exiting
+            self.engine.stop(maintain_level=80)
+            self.engine.join(timeout=45)
+        self.sampler.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
         rumps.quit_application()
 
 
@@ -0,0 +1,283 @@
+"""Per-tick cost benchmarks for the menu bar refresh and the cycling engine.
+
+    python bench/tick_costs.py [--iterations N] [--scenario NAME] [--output FILE]
+
+Every probe is answered from the recorded dumps in fixtures/ (ioreg,
+pmset, system_profiler) by small shim executables put first on PATH, so
+the code under test runs unmodified and really spawns its processes, on
+any machine. HOME points at a scratch directory for the run.
+
+For each case we report, per iteration: wall time, CPU time of this
+process and of reaped children, process spawns, and bytes written to the
+files under the scratch HOME (log, state journal, history database,
+caches; an atomically replaced file counts in full). Results are written as JSON to bench_output.txt (or
+--output) so runs can be compared between releases.
+
+Cases:
+  sampler_snapshot   one background refresh of the menu's data
+  gui_update_status  the 1 s rumps timer callback (needs rumps)
+  stats_dialog       opening Show Stats (needs rumps)
+  health_log         CyclingEngine.log_health
+  controller_tick    one CyclingEngine.tick, on a virtual 10 s clock
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(REPO, "fixtures")
+DEFAULT_OUTPUT = os.path.join(REPO, "bench_output.txt")
+
+# Fixture-backed stand-ins for the tools the app runs. caffeinate, pmset
+# noidle and stress-ng stay alive like the real ones.
+SHIMS = {
+    "ioreg": 'cat "$BENCH_FIXTURES/ioreg/$BENCH_SCENARIO.plist"',
+    "pmset": 'case "$1" in noidle) exec sleep 86400 ;; esac\n'
+             'cat "$BENCH_FIXTURES/pmset/$BENCH_SCENARIO.txt"',
+    "system_profiler": 'cat "$BENCH_FIXTURES/system_profiler/SPPowerDataType.txt"',
+    "caffeinate": "exec sleep 86400",
+    "stress-ng": "exec sleep 86400",
+    "battery": "exit 0",
+    "osascript": "exit 0",
+}
+
+
+def install_shims(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, body in SHIMS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write("#!/bin/sh\n" + body + "\n")
+        os.chmod(path, 0o755)
+
+
+class Meter:
+    """Counts process spawns and bytes written under `home`.
+
+    /proc/self/io would be exact on Linux, but it also absorbs the pipe
+    output of reaped children and does not exist on macOS.
+    """
+
+    def __init__(self, home):
+        self.home = home
+        self.spawns = 0
+        meter = self
+        original = subprocess.Popen.__init__
+
+        # asyncio's subprocess transport goes through Popen too
+        def counting_init(popen, *args, **kwargs):
+            meter.spawns += 1
+            original(popen, *args, **kwargs)
+        subprocess.Popen.__init__ = counting_init
+
+    def written_mark(self):
+        files = {}
+        for root, _, names in os.walk(self.home):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_ino, st.st_size)
+        return files
+
+    def written_since(self, mark):
+        now = self.written_mark()
+        total = 0
+        for path, (ino, size) in now.items():
+            old = mark.get(path)
+            if old is None or old[0] != ino or size < old[1]:
+                total += size  # new or replaced (atomic rename) or truncated
+            else:
+                total += size - old[1]
+        return total
+
+
+def child_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(meter, fn, iterations, settle=None):
+    wall, cpu, children, spawns, written = [], [], [], [], []
+    for _ in range(iterations):
+        mark = meter.written_mark()
+        spawned = meter.spawns
+        c0, ch0 = time.process_time(), child_cpu()
+        w0 = time.perf_counter()
+        fn()
+        w1 = time.perf_counter()
+        c1 = time.process_time()
+        if settle is not None:
+            settle()
+        children.append(child_cpu() - ch0)
+        wall.append(w1 - w0)
+        cpu.append(c1 - c0)
+        spawns.append(meter.spawns - spawned)
+        written.append(meter.written_since(mark))
+    wall_ms = sorted(w * 1000 for w in wall)
+    return {
+        "iterations": iterations,
+        "wall_ms_mean": round(statistics.mean(wall_ms), 3),
+        "wall_ms_p50": round(wall_ms[len(wall_ms) // 2], 3),
+        "wall_ms_p95": round(wall_ms[min(len(wall_ms) - 1, int(len(wall_ms) * 0.95))], 3),
+        "wall_ms_max": round(wall_ms[-1], 3),
+        "cpu_ms_mean": round(statistics.mean(cpu) * 1000, 3),
+        "child_cpu_ms_mean": round(statistics.mean(children) * 1000, 3),
+        "spawns_per_tick": round(statistics.mean(spawns), 3),
+        "bytes_written_per_tick": round(statistics.mean(written), 1),
+    }
+
+
+def bench_sampler(meter, iterations, bin_dir):
+    from battery_cycler.macos import MacHardware
+    from battery_cycler.sampler import take_snapshot
+    backend = MacHardware(os.path.join(bin_dir, "battery"))
+    return measure(meter, lambda: take_snapshot(backend), iterations)
+
+
+def bench_engine(meter, iterations, bin_dir):
+    from battery_cycler.clock import VirtualClock
+    from battery_cycler.config import ConfigStore
+    from battery_cycler.engine import CyclingEngine
+    from battery_cycler.macos import MacHardware
+    from battery_cycler.stress import StressManager
+
+    config = ConfigStore()
+    config.data.update(upper_limit=80, lower_limit=20, cpu_stress="high", gpu_stress="off")
+    config.save()
+    engine = CyclingEngine(MacHardware(os.path.join(bin_dir, "battery")),
+                           StressManager(os.path.join(bin_dir, "stress-ng")),
+                           config, clock=VirtualClock())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    try:
+        loop.run_until_complete(engine._startup())
+
+        def tick():
+            engine.clock.advance(engine.interval)
+            loop.run_until_complete(engine.tick())
+        results["controller_tick"] = measure(meter, tick, iterations)
+
+        battery = loop.run_until_complete(engine.hw.read_battery())
+        results["health_log"] = measure(
+            meter, lambda: loop.run_until_complete(engine.log_health("bench", battery)), iterations)
+    finally:
+        loop.run_until_complete(engine._shutdown())
+        loop.close()
+    return results
+
+
+def bench_gui(meter, iterations):
+    try:
+        import rumps  # noqa: F401
+    except ImportError:
+        skipped = {"skipped": "rumps not installed"}
+        return {"gui_update_status": skipped, "stats_dialog": skipped}
+    import battery_cycler_gui
+    from battery_cycler.sampler import take_snapshot
+
+    app = battery_cycler_gui.BatteryCyclerApp()
+    app.timer.stop()
+    app.sampler.stop()
+    app.sampler.join()
+    app.sampler.latest = take_snapshot(app.backend)
+
+    # show_stats hands the dialog to a thread; wait for it outside the timing
+    # so its osascript spawn is still counted
+    existing = set()
+
+    def open_stats():
+        existing.clear()
+        existing.update(threading.enumerate())
+        app.show_stats(None)
+
+    def dialogs_done():
+        for thread in threading.enumerate():
+            if thread not in existing:
+                thread.join(5)
+    return {
+        "gui_update_status": measure(meter, lambda: app.update_status(None), iterations),
+        "stats_dialog": measure(meter, open_stats, iterations, settle=dialogs_done),
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--scenario", default="discharging_high_stress",
+                        help="fixture name under fixtures/ioreg and fixtures/pmset")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    commit = git_commit()
+    home = tempfile.mkdtemp(prefix="battery-bench-")
+    bin_dir = os.path.join(home, "bin")
+    install_shims(bin_dir)
+    os.environ.update(HOME=home, BENCH_FIXTURES=FIXTURES, BENCH_SCENARIO=args.scenario,
+                      PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""))
+    # Imported only now: battery_cycler.paths resolves ~ at import time
+    sys.path.insert(0, REPO)
+
+    meter = Meter(home)
+    try:
+        results = {"sampler_snapshot": bench_sampler(meter, args.iterations, bin_dir)}
+        results.update(bench_gui(meter, args.iterations))
+        results.update(bench_engine(meter, args.iterations, bin_dir))
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scenario": args.scenario,
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    for name, r in results.items():
+        if "skipped" in r:
+            print("{:<18} skipped ({})".format(name, r["skipped"]))
+        else:
+            print("{:<18} {:>9.3f} ms wall {:>9.3f} ms cpu {:>5.2f} spawns {:>9.1f} B written".format(
+                name, r["wall_ms_mean"], r["cpu_ms_mean"], r["spawns_per_tick"],
+                r["bytes_written_per_tick"]))
+    print("wrote", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,7 @@ OPTIONS = {
         'LSUIElement': True,  # Hide from Dock (menu bar app)
         'NSHighResolutionCapable': True,
     },
-    'packages': ['rumps'],
+    'packages': ['rumps', 'battery_cycler'],
 }
 
 setup(
@@ -0,0 +1,69 @@
+"""PowerProfileCache: one system_profiler run per TTL, and failures back off."""
+
+import os
+
+from battery_cycler import cache
+from battery_cycler.cache import PowerProfileCache
+
+PROFILE = os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "system_profiler",
+                       "SPPowerDataType.txt")
+
+
+class Fetch:
+    """A stand-in for system_profiler that counts its runs."""
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.outputs.pop(0) if len(self.outputs) > 1 else self.outputs[0]
+
+
+def profile_text():
+    with open(PROFILE) as f:
+        return f.read()
+
+
+def test_hit_does_not_refetch(tmp_path):
+    fetch = Fetch(profile_text())
+    profile = PowerProfileCache(str(tmp_path / "profile.txt"), fetch=fetch)
+    expected = {"max_capacity": "77%", "condition": "Service Recommended", "cycle_count": "898"}
+    assert profile.get() == expected
+    assert profile.get() == expected
+    assert fetch.calls == 1
+    profile.invalidate()
+    assert profile.get() == expected
+    assert fetch.calls == 2
+
+
+def test_failure_is_not_rerun_within_the_backoff(tmp_path):
+    fetch = Fetch("")
+    profile = PowerProfileCache(str(tmp_path / "profile.txt"), fetch=fetch)
+    assert profile.get() == {"max_capacity": None, "condition": None, "cycle_count": None}
+    assert profile.get()["max_capacity"] is None
+    assert fetch.calls == 1
+    # A completed cycle invalidates the cache, which retries at once
+    profile.invalidate()
+    profile.get()
+    assert fetch.calls == 2
+
+
+def test_failure_is_retried_after_the_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "FAILURE_BACKOFF", -1)
+    fetch = Fetch("")
+    profile = PowerProfileCache(str(tmp_path / "profile.txt"), fetch=fetch)
+    profile.get()
+    profile.get()
+    assert fetch.calls == 2
+
+
+def test_failure_keeps_the_last_good_values(tmp_path):
+    fetch = Fetch(profile_text(), "")
+    profile = PowerProfileCache(str(tmp_path / "profile.txt"), ttl=0, fetch=fetch)
+    assert profile.get()["max_capacity"] == "77%"
+    # Expired, and system_profiler now fails
+    assert profile.get()["max_capacity"] == "77%"
+    assert profile.get()["cycle_count"] == "898"
+    assert fetch.calls == 2
@@ -0,0 +1,77 @@
+"""DrainController: the PI loop behind closed-loop discharge."""
+
+import pytest
+
+from battery_cycler.drain import MIN_DUTY, DrainController, target_watts
+
+
+def plant(load, idle=9.0, per_worker=2.8):
+    """Discharge power of a machine that differs from the controller's guess."""
+    return idle + per_worker * load
+
+
+def run(controller, target, steps, dt=10.0):
+    measured = None
+    for _ in range(steps):
+        controller.update(dt, target, measured)
+        measured = plant(controller.workers * controller.duty)
+    return measured
+
+
+def test_converges_on_the_target():
+    controller = DrainController(10)
+    controller.reset(25.0)
+    assert run(controller, 25.0, 200) == pytest.approx(25.0, abs=0.3)
+    # 16 W above idle at 2.8 W per worker
+    assert controller.load == pytest.approx(16 / 2.8, rel=0.05)
+    assert controller.workers == 6
+
+
+def test_follows_a_new_target():
+    controller = DrainController(10)
+    controller.reset(25.0)
+    run(controller, 25.0, 200)
+    assert run(controller, 15.0, 200) == pytest.approx(15.0, abs=0.3)
+
+
+def test_no_windup_while_saturated():
+    controller = DrainController(4)
+    controller.reset(200.0)
+    # Far more than four workers can draw, for a long time
+    run(controller, 200.0, 500)
+    assert controller.load == 4
+    # The first step after the target becomes reachable already backs off
+    controller.update(10.0, 10.0, plant(4))
+    assert controller.load < 4
+    assert run(controller, 10.0, 200) == pytest.approx(10.0, abs=0.3)
+
+
+def test_load_split_into_workers_and_duty():
+    controller = DrainController(8)
+    controller.load = 4.6
+    assert controller._split() == (5, pytest.approx(0.92))
+    # Within the hysteresis band the count is kept and the duty drops
+    controller.load = 3.8
+    assert controller._split() == (5, pytest.approx(0.76))
+    controller.load = 0.05
+    assert controller._split() == (0, 1.0)
+    controller.load = 0.2
+    workers, duty = controller._split()
+    assert workers == 1 and duty >= MIN_DUTY
+
+
+def test_missing_measurement_holds_the_load():
+    controller = DrainController(8)
+    controller.reset(20.0)
+    load = controller.load
+    controller.update(10.0, 20.0, None)
+    assert controller.load == load
+
+
+def test_target_watts():
+    assert target_watts({"discharge_target_watts": 12}, 50, 20, 0, 60) == 12.0
+    assert target_watts({}, 50, 20, 0, 60) is None
+    # 30% of 60 Wh in the hour left of a 90 minute target
+    config = {"discharge_target_minutes": 90}
+    assert target_watts(config, 50, 20, 1800, 60) == pytest.approx(18.0)
+    assert target_watts(config, 50, 20, 5400, 60) == float("inf")
@@ -0,0 +1,70 @@
+"""parse_ioreg_plist against the recorded dumps in fixtures/ioreg."""
+
+import os
+import plistlib
+
+from battery_cycler.ioreg import parse_ioreg_plist
+
+FIXTURES = os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "ioreg")
+
+
+def dump(name):
+    with open(os.path.join(FIXTURES, name + ".plist"), 'rb') as f:
+        return f.read()
+
+
+def node(name):
+    return plistlib.loads(dump(name))[0]
+
+
+def parse(data):
+    return parse_ioreg_plist(data, taken_at=100.0)
+
+
+def test_discharging_currents_are_signed():
+    b = parse(dump("discharging_high_stress"))
+    # Stored as two's complement in an unsigned 64-bit integer
+    assert node("discharging_high_stress")["Amperage"] == (1 << 64) - 2850
+    assert b.amperage == -2850
+    assert b.instant_amperage == -2917
+
+
+def test_charging_currents_stay_positive():
+    b = parse(dump("charging"))
+    assert b.amperage == 2744
+    assert b.is_charging is True
+    assert b.external_connected is True
+
+
+def test_units():
+    b = parse(dump("battery_power"))
+    # Temperature is reported in hundredths of a degree
+    assert b.temperature == 30.12
+    assert b.voltage == 12002
+    assert (b.current_capacity, b.raw_current_capacity, b.raw_max_capacity) == (67, 3090, 4610)
+    assert (b.nominal_capacity, b.design_capacity, b.cycle_count) == (4610, 6079, 898)
+    assert b.cell_voltages == (4001, 4000, 4001)
+    assert b.external_connected is False
+    assert b.taken_at == 100.0
+
+
+def test_missing_keys():
+    data = node("holding")
+    for key in ("Temperature", "InstantAmperage", "CycleCount", "Voltage", "DesignCapacity"):
+        del data[key]
+    b = parse(plistlib.dumps([data]))
+    assert b.temperature is None
+    assert b.instant_amperage is None
+    assert b.cycle_count is None
+    assert b.amperage == 0
+    # Fall back to the raw voltage and BatteryData's design capacity
+    assert b.voltage == 12681
+    assert b.design_capacity == 6079
+
+
+def test_no_battery():
+    # Desktop Macs print an empty array; a failed probe prints nothing
+    assert parse(plistlib.dumps([])) is None
+    assert parse(b"") is None
+    assert parse(b"<plist>not a plist") is None
+
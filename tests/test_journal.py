@@ -0,0 +1,110 @@
+"""StateJournal: a completed cycle is never lost, whatever the crash."""
+
+import json
+import os
+import shutil
+
+from battery_cycler.journal import StateJournal, read_last_record
+
+
+def journal(directory, **options):
+    return StateJournal(os.path.join(directory, "state.journal"),
+                        os.path.join(directory, "state.checkpoint.json"),
+                        os.path.join(directory, "battery_cycle_state.txt"), **options)
+
+
+def state(cycles, current="charging"):
+    return {"TOTAL_DISCHARGE_CYCLES": cycles, "CURRENT_STATE": current}
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    j = journal(str(tmp_path))
+    j.append(state(1), "discharge_complete", durable=True)
+    j.append(state(1, "discharging"), "charge_complete", durable=True)
+    j.close()
+    # Crash part way through writing the next record
+    with open(j.path, 'ab') as f:
+        f.write(b'{"event":"discharge_complete","seq":3,"state":{"TOTAL_DISCH')
+    assert read_last_record(j.path)["seq"] == 2
+    assert journal(str(tmp_path)).load_state() == state(1, "discharging")
+
+
+def test_append_after_torn_line(tmp_path):
+    j = journal(str(tmp_path))
+    j.append(state(1), "discharge_complete", durable=True)
+    j.close()
+    with open(j.path, 'ab') as f:
+        f.write(b'{"event":"charge_complete","seq":2,"sta')
+    # The restarted engine appends after the fragment
+    j = journal(str(tmp_path))
+    j.load()
+    j.append(state(2), "discharge_complete", durable=True, ts=1000)
+    j.close()
+    record = journal(str(tmp_path)).load()
+    assert (record["seq"], record["ts"], record["state"]) == (2, 1000, state(2))
+
+
+def test_crash_between_checkpoint_and_truncate(tmp_path):
+    j = journal(str(tmp_path))
+    for cycles in range(1, 4):
+        j.append(state(cycles), "discharge_complete", durable=True)
+    saved = str(tmp_path / "journal.before")
+    shutil.copy(j.path, saved)
+    j.checkpoint()
+    j.close()
+    # The checkpoint was written but the journal never truncated
+    shutil.copy(saved, j.path)
+
+    again = journal(str(tmp_path))
+    assert again.load_state() == state(3)
+    # Numbering carries on after both copies of the newest record
+    assert again.append(state(4), "discharge_complete", durable=True)["seq"] == 4
+    again.close()
+    assert journal(str(tmp_path)).load_state() == state(4)
+
+
+def test_crash_before_checkpoint_rename(tmp_path):
+    j = journal(str(tmp_path))
+    j.append(state(1), "discharge_complete", durable=True)
+    j.checkpoint()
+    j.append(state(2), "discharge_complete", durable=True)
+    j.close()
+    # A half-written temp file next to the old checkpoint is ignored
+    with open(j.checkpoint_path + ".123", 'wb') as f:
+        f.write(b'{"seq":')
+    assert journal(str(tmp_path)).load_state() == state(2)
+
+
+def test_completed_cycles_replay_as_appended(tmp_path):
+    # Small enough to checkpoint and truncate every few records
+    j = journal(str(tmp_path), max_bytes=300)
+    appended = []
+    for cycles in range(1, 21):
+        for event in ("tick", "discharge_complete", "charge_complete"):
+            s = state(cycles, "discharging" if event == "charge_complete" else "charging")
+            s["TOTAL_ACTIVE_SECS"] = len(appended) * 60
+            appended.append(j.append(s, event, durable=event != "tick"))
+            # A restart at any point resumes from the last record
+            assert journal(str(tmp_path)).load_state() == s
+    j.close()
+
+    with open(j.checkpoint_path, 'rb') as f:
+        records = [json.loads(f.read())]
+    with open(j.path, 'rb') as f:
+        records += [json.loads(line) for line in f]
+    assert [r["seq"] for r in appended] == list(range(1, 61))
+    assert records[-1] == appended[-1]
+    assert [r["seq"] for r in records] == list(range(records[0]["seq"], 61))
+
+
+def test_legacy_state_file_follows_checkpoints(tmp_path):
+    j = journal(str(tmp_path))
+    j.append(dict(state(7), CYCLE_START_TIME="1700000000"), "discharge_complete", durable=True)
+    j.checkpoint()
+    j.close()
+    with open(j.legacy_path) as f:
+        lines = f.read().splitlines()
+    assert "TOTAL_DISCHARGE_CYCLES=7" in lines
+    assert 'CURRENT_STATE="charging"' in lines
+    assert 'CYCLE_START_TIME="1700000000"' in lines
+    assert "JOURNAL_SEQ=1" in lines
@@ -0,0 +1,146 @@
+"""The sysfs reader against the recorded trees in fixtures/sysfs."""
+
+import os
+import shutil
+
+from battery_cycler.clock import VirtualClock
+from battery_cycler.config import ConfigStore
+from battery_cycler.journal import StateJournal
+from battery_cycler.linux import LinuxHardware, create_engine, find_adapters, find_battery, parse_behaviour, read_sysfs_snapshot
+from battery_cycler.store import HistoryStore
+
+FIXTURES = os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "sysfs")
+
+
+def snapshot(machine):
+    root = os.path.join(FIXTURES, machine)
+    return read_sysfs_snapshot(find_battery(root), find_adapters(root), taken_at=100.0)
+
+
+def test_energy_driver_converts_with_design_voltage():
+    b = snapshot("thinkpad")
+    # energy_* uWh over voltage_min_design (11.52 V)
+    assert b.raw_current_capacity == 3580
+    assert b.raw_max_capacity == 4928
+    assert b.design_capacity == 4947
+    assert b.voltage == 11954
+    assert b.current_capacity == 73
+    assert b.cycle_count == 412
+    assert b.taken_at == 100.0
+
+
+def test_power_only_driver_gives_negative_current_when_discharging():
+    b = snapshot("thinkpad")
+    # power_now / voltage_now: 9.842 W at 11.954 V
+    assert b.amperage == -823
+    assert b.instant_amperage == -823
+    assert b.external_connected is False
+    assert not b.is_charging
+
+
+def test_charge_driver():
+    b = snapshot("framework")
+    assert find_battery(os.path.join(FIXTURES, "framework")).endswith("BAT1")
+    assert (b.raw_current_capacity, b.raw_max_capacity, b.design_capacity) == (2127, 3512, 3572)
+    assert b.amperage == 1830
+    assert b.temperature == 31.2
+    assert b.external_connected is True
+    assert b.is_charging
+
+
+def test_state_of_charge_from_raw_counters():
+    b = snapshot("framework")
+    assert abs(b.state_of_charge - 2127 * 100.0 / 3512) < 1e-9
+
+
+def test_missing_battery():
+    assert read_sysfs_snapshot(os.path.join(FIXTURES, "thinkpad", "AC")) is None
+
+
+def test_parse_behaviour():
+    assert parse_behaviour("[auto] inhibit-charge force-discharge") == (
+        "auto", ["auto", "inhibit-charge", "force-discharge"])
+    assert parse_behaviour(None) == (None, [])
+
+
+def cycling_engine(tmp_path, machine):
+    """A CyclingEngine on a writable copy of a fixture tree, on virtual
+    time, with every file under `tmp_path`."""
+    root = str(tmp_path / "sysfs")
+    shutil.copytree(os.path.join(FIXTURES, machine), root)
+    config = ConfigStore(str(tmp_path / "config.json"))
+    config.data.update(upper_limit=80, lower_limit=20, cpu_stress="high")
+    config.save()
+    join = lambda name: str(tmp_path / name)  # noqa: E731
+    engine = create_engine(root, config=config, clock=VirtualClock(),
+                           journal=StateJournal(join("state.journal"), join("state.checkpoint.json"),
+                                                join("state.txt")),
+                           store=HistoryStore(join("history.db"), csv_path=None),
+                           log_file=join("battery_cycles.log"))
+    return engine, root
+
+
+def set_level(battery_dir, percent, status):
+    """Move the thinkpad battery to `percent`."""
+    with open(os.path.join(battery_dir, "energy_full")) as f:
+        full = int(f.read())
+    for name, value in (("energy_now", full * percent // 100), ("capacity", percent), ("status", status)):
+        with open(os.path.join(battery_dir, name), 'w') as f:
+            f.write("{}\n".format(value))
+
+
+def test_cycle_without_stress_ng(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+    engine, root = cycling_engine(tmp_path, "thinkpad")
+    assert engine.stress.stress_cmd is None
+    battery = os.path.join(root, "BAT0")
+    clock = engine.clock
+    start = clock.time()
+    # Down through the lower limit, back up through the upper one
+    clock.call_at(start + 600, lambda: set_level(battery, 19, "Charging"))
+    clock.call_at(start + 1200, lambda: set_level(battery, 81, "Discharging"))
+    clock.call_at(start + 1800, engine.stop)
+    engine.start()
+    engine.join(30)
+    assert not engine.running
+
+    with open(str(tmp_path / "battery_cycles.log")) as f:
+        log = f.read()
+    assert "ERROR" not in log
+    assert log.count("CPU-STRESS: stress-ng not found - CPU stress disabled") == 2
+    assert engine.cycles == 1
+    store = HistoryStore(str(tmp_path / "history.db"), csv_path=None)
+    assert [row["cycle"] for row in store.cycles()] == [1]
+    store.close()
+
+
+def test_discharge_falls_back_to_inhibit_charge(tmp_path):
+    root = str(tmp_path / "sysfs")
+    shutil.copytree(os.path.join(FIXTURES, "thinkpad"), root)
+    behaviour = os.path.join(root, "BAT0", "charge_behaviour")
+    with open(behaviour, 'w') as f:
+        f.write("[auto] inhibit-charge\n")
+    hardware = LinuxHardware(root)
+    assert hardware.discharge_behaviour() == "inhibit-charge"
+    assert hardware.apply("discharge")
+    with open(behaviour) as f:
+        assert f.read() == "inhibit-charge"
+    assert hardware.apply("charge")
+    with open(behaviour) as f:
+        assert f.read() == "auto"
+
+
+def test_engine_stops_when_the_battery_cant_discharge(tmp_path):
+    engine, root = cycling_engine(tmp_path, "framework")
+    assert not engine.hw.can_discharge()
+    assert not engine.hw.apply("discharge")
+    engine.start()
+    engine.join(30)
+    assert not engine.running
+    assert engine.cycles == 0
+
+    with open(str(tmp_path / "battery_cycles.log")) as f:
+        log = f.read()
+    assert "ERROR: The linux backend can't discharge this battery on the adapter - stopping" in log
+    assert "SCRIPT STOPPED" in log
+    assert "starting discharge" not in log
@@ -0,0 +1,50 @@
+"""AdaptivePoller: tick interval from the predicted time to the next limit."""
+
+import pytest
+
+from battery_cycler.polling import AdaptivePoller
+from battery_cycler.rate import RateEstimator
+
+
+def poller_at(rate, level=50.0, **options):
+    """An AdaptivePoller whose estimator has seen a steady `rate` (%/s)
+    for five minutes, ending at `level`."""
+    estimator = RateEstimator()
+    for t in range(0, 301, 10):
+        estimator.update(t, level + rate * (t - 300), resolution=0.01)
+    return AdaptivePoller(10, estimator, **options)
+
+
+def test_default_until_the_rate_is_known():
+    poller = AdaptivePoller(10)
+    assert poller.next_interval(50, [20]) == 10
+    poller.observe(0, 50, "discharging")
+    assert poller.next_interval(50, [20]) == 10
+
+
+def test_far_from_the_limit_waits_the_longest():
+    poller = poller_at(-0.01)  # 36%/h, 30% to go
+    assert poller.next_interval(50.0, [20], 0.01) == poller.max_interval
+
+
+def test_near_the_limit_waits_a_fraction_of_the_eta():
+    poller = poller_at(-0.01, level=20.5)
+    interval = poller.next_interval(20.5, [20], 0.01)
+    # 50 s to go at 0.01%/s, less half a reading step
+    assert interval == pytest.approx(poller.fraction * (50 - 0.005 / 0.01))
+
+
+def test_never_below_the_minimum():
+    poller = poller_at(-0.01, level=20.01)
+    assert poller.next_interval(20.01, [20], 0.01) == poller.min_interval
+    # Already past the limit by the estimate: due now, still clamped
+    assert poller.next_interval(20.01, [20.009], 0.01) == poller.min_interval
+
+
+def test_moving_away_from_every_limit():
+    poller = poller_at(0.01, level=30)
+    assert poller.next_interval(30.0, [20], 0.01) == poller.max_interval
+
+
+def test_max_interval_is_at_least_the_default():
+    assert AdaptivePoller(90).max_interval == 90
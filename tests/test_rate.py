@@ -0,0 +1,86 @@
+"""RateEstimator and the level it is fed from a BatterySnapshot."""
+
+import pytest
+
+from battery_cycler.ioreg import BatterySnapshot
+from battery_cycler.rate import RateEstimator, battery_level, format_estimate
+
+
+def staircase(estimator, rate, start=80.0, secs=1800, step=10, phase="discharging"):
+    """Feed whole-percent readings of a level falling at `rate` (%/s)."""
+    for t in range(0, secs + 1, step):
+        estimator.update(t, int(start + rate * t), 1.0, phase=phase)
+
+
+def test_not_ready_until_min_span():
+    estimator = RateEstimator()
+    estimator.update(0, 80, phase="discharging")
+    estimator.update(60, 80, phase="discharging")
+    assert not estimator.ready
+    assert estimator.estimate([20]) is None
+    estimator.update(120, 79, phase="discharging")
+    assert estimator.ready
+
+
+def test_smooths_integer_steps_into_the_slope():
+    estimator = RateEstimator()
+    rate = -30 / 3600.0  # 30%/h
+    staircase(estimator, rate)
+    # The readings only ever move in whole percents, every two minutes
+    assert estimator.percent_per_hour == pytest.approx(-30, rel=0.05)
+    assert estimator.level == pytest.approx(80 + rate * 1800, abs=1.0)
+
+
+def test_fine_readings_track_closely():
+    estimator = RateEstimator()
+    for t in range(0, 601, 10):
+        estimator.update(t, 50 + 0.002 * t, 0.02, phase="charging")
+    assert estimator.rate == pytest.approx(0.002, rel=0.01)
+    assert estimator.eta(60) == pytest.approx((60 - 51.2) / 0.002, rel=0.02)
+    # Not heading there
+    assert estimator.eta(20) is None
+
+
+def test_phase_change_starts_over():
+    estimator = RateEstimator()
+    staircase(estimator, -30 / 3600.0)
+    assert estimator.ready
+    estimator.update(1810, 65, phase="charging")
+    assert not estimator.ready
+    assert estimator.samples == 1
+    assert estimator.rate == 0
+    assert estimator.level == 65
+
+
+def test_estimate_picks_the_nearest_limit_ahead():
+    estimator = RateEstimator()
+    staircase(estimator, -30 / 3600.0)
+    estimate = estimator.estimate([80, 20])
+    assert estimate.target == 20
+    assert estimate.eta_secs == pytest.approx((estimator.level - 20) / -estimator.rate)
+    assert format_estimate(estimate).startswith("-")
+
+
+def test_power_falls_back_to_rate_times_capacity():
+    estimator = RateEstimator()
+    for t in range(0, 301, 10):
+        estimator.update(t, 50 - 0.01 * t, 0.02, phase="discharging", capacity_wh=50.0)
+    # 36%/h of 50 Wh
+    assert estimator.watts == pytest.approx(-18.0, rel=0.02)
+
+
+def test_level_from_raw_counters():
+    battery = BatterySnapshot(current_capacity=34, raw_current_capacity=1563, raw_max_capacity=4610)
+    level, resolution = battery_level(battery, 34)
+    assert level == pytest.approx(33.904, abs=1e-3)
+    # One mAh
+    assert resolution == pytest.approx(100.0 / 4610)
+
+
+def test_level_falls_back_to_percent():
+    # No raw counters (older Macs, drivers without charge_now/energy_now)
+    assert battery_level(BatterySnapshot(current_capacity=34), None) == (34.0, 1.0)
+    assert battery_level(BatterySnapshot(raw_current_capacity=1563, raw_max_capacity=0), 35) == (35.0, 1.0)
+    # The probe failed and pmset gave the percent
+    assert battery_level(None, 36) == (36.0, 1.0)
+    assert battery_level(None, None) == (None, None)
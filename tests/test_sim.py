@@ -0,0 +1,53 @@
+"""A virtual day of cycling: CyclingEngine against the simulated battery."""
+
+import json
+import os
+import time
+
+import pytest
+
+from battery_cycler import sim
+
+
+@pytest.fixture(scope="module")
+def day(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("sim"))
+    return sim.run(days=1, directory=directory, config={"upper_limit": 80, "lower_limit": 20})
+
+
+def test_cycles(day):
+    # 80 -> 20 -> 80 on high CPU stress takes a little under two hours
+    assert 10 <= day["app_cycles"] <= 16
+    # Each cycle is 60% of the battery out and back in
+    assert day["equivalent_cycles"] == pytest.approx(day["app_cycles"] * 0.6, rel=0.1)
+
+
+def test_switches(day):
+    # Less the maintain stop at startup, the initial discharge and the
+    # maintain at shutdown, a charge command per completed discharge and a
+    # discharge per completed charge
+    switches = day["battery_commands"] - 3
+    assert switches in (2 * day["app_cycles"] - 1, 2 * day["app_cycles"])
+
+
+def test_overshoot_is_bounded(day):
+    overshoot = day["switch_overshoot"]
+    assert overshoot["charging"]["count"] == day["app_cycles"]
+    # Limits are checked on the raw mAh level, not the whole percent
+    for kind in ("charging", "discharging"):
+        assert -0.25 < overshoot[kind]["mean"] <= overshoot[kind]["max"] < 0.25
+
+
+def test_log_names_the_backend(day):
+    with open(os.path.join(day["directory"], "battery_cycles.log")) as f:
+        log = f.read()
+    assert "MODE: In-app engine (sim backend)" in log
+    assert "ERROR" not in log
+
+
+def test_journal_is_stamped_with_virtual_time(day):
+    with open(os.path.join(day["directory"], "state.checkpoint.json")) as f:
+        record = json.load(f)
+    # The shutdown record comes a virtual day after a start at wall-clock now
+    assert record["event"] == "stopped"
+    assert record["ts"] > time.time() + 0.9 * 86400
@@ -0,0 +1,86 @@
+"""The SMC helper protocol and ChargeControl against FakeSMC."""
+
+import os
+import threading
+
+import pytest
+
+from battery_cycler.smc import ChargeControl, FakeSMC, SMCClient, SMCError, SMCHelper, _Handler, _Server
+
+
+@pytest.fixture
+def helper(tmp_path):
+    """(FakeSMC, SMCClient) with a helper serving it on a socket."""
+    def start(profile="legacy"):
+        backend = FakeSMC(profile=profile)
+        path = os.path.join(str(tmp_path), "smc.sock")
+        server = _Server(path, _Handler)
+        server.helper = SMCHelper(backend)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        client = SMCClient(path)
+        servers.append((server, client))
+        return backend, client
+    servers = []
+    yield start
+    for server, client in servers:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_round_trip(helper):
+    backend, client = helper()
+    results = client.batch([["read", "CH0B"], ["write", "CH0B", "02"], ["read", "CHTE"]])
+    assert results[0] == {"key": "CH0B", "value": "00"}
+    assert results[1] == {"key": "CH0B", "ok": True}
+    assert "error" in results[2]
+    assert backend.keys["CH0B"] == "02"
+    # The connection is reused for the next request
+    assert client.read("CH0B") == "02"
+
+
+def test_only_charging_keys_are_writable(helper):
+    backend, client = helper()
+    backend.keys["FNum"] = "02"
+    with pytest.raises(SMCError):
+        client.write("FNum", "00")
+    assert backend.keys["FNum"] == "02"
+
+
+def test_bad_request_is_reported(helper):
+    _, client = helper()
+    with pytest.raises(SMCError):
+        client.batch("not a list of ops")
+
+
+@pytest.mark.parametrize("profile, discharge, charge", [
+    ("legacy", [("CH0I", "01"), ("ACLC", "01")],
+     [("CH0B", "00"), ("CH0C", "00"), ("CH0I", "00"), ("ACLC", "04")]),
+    ("tahoe", [("CHIE", "08"), ("ACLC", "01")],
+     [("CHTE", "00000000"), ("CHIE", "00"), ("ACLC", "04")]),
+])
+def test_apply_writes_bin_battery_keys(helper, profile, discharge, charge):
+    backend, client = helper(profile)
+    control = ChargeControl(client)
+    assert control.apply("discharge")
+    assert backend.writes == discharge
+    del backend.writes[:]
+    assert control.apply("charge")
+    assert backend.writes == charge
+    assert not control.apply("hold")
+
+
+def test_apply_fails_on_a_failed_write(helper):
+    backend, client = helper()
+    del backend.keys["CH0C"]
+    control = ChargeControl(client)
+    assert not control.apply("charge")
+    # A failure drops the probed capabilities so they're read again
+    assert control.caps is None
+
+
+def test_apply_fails_without_charging_keys(helper):
+    backend, client = helper("ch0j")
+    del backend.keys["CH0B"]
+    assert not ChargeControl(client).apply("charge")
+    assert backend.writes == []
@@ -0,0 +1,56 @@
+"""HistoryStore schema migrations."""
+
+import sqlite3
+
+from battery_cycler.store import ENERGY_COLUMNS, SCHEMA_VERSION, HistoryStore
+
+# The cycles table as schema version 2 created it
+V2_CYCLES = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE cycles (
+    ts REAL NOT NULL,
+    session_id INTEGER,
+    cycle INTEGER,
+    started_at REAL,
+    discharged_mah REAL,
+    charged_mah REAL,
+    equivalent_cycles REAL,
+    gap_secs REAL,
+    apple_cycles_added INTEGER
+);
+INSERT INTO meta VALUES ('schema_version', '2');
+INSERT INTO cycles (ts, cycle, discharged_mah) VALUES (1000.0, 7, 2767.3);
+"""
+
+
+def columns(store):
+    return [row[1] for row in store.db.execute("PRAGMA table_info(cycles)")]
+
+
+def test_migrates_v2_cycles_table(tmp_path):
+    path = str(tmp_path / "history.db")
+    db = sqlite3.connect(path)
+    db.executescript(V2_CYCLES)
+    db.close()
+
+    store = HistoryStore(path, csv_path=None)
+    assert store._meta("schema_version") == str(SCHEMA_VERSION)
+    assert set(ENERGY_COLUMNS) <= set(columns(store))
+    old, = store.cycles()
+    assert (old["cycle"], old["discharged_mah"], old["delivered_wh"]) == (7, 2767.3, None)
+
+    store.add_cycle(ts=2000.0, cycle=8, delivered_wh=30.6, discharge_peak_watts=33.8)
+    store.flush()
+    new = store.cycles(1)[0]
+    assert (new["cycle"], new["delivered_wh"], new["discharge_peak_watts"]) == (8, 30.6, 33.8)
+    store.close()
+
+    # Opening it again doesn't try to add the columns twice
+    HistoryStore(path, csv_path=None).close()
+
+
+def test_new_database_is_current(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"), csv_path=None)
+    assert store._meta("schema_version") == str(SCHEMA_VERSION)
+    assert set(ENERGY_COLUMNS) <= set(columns(store))
+    store.close()
@@ -0,0 +1,139 @@
+"""Stress worker supervision, with a stand-in for stress-ng."""
+
+import os
+import signal
+import time
+
+import pytest
+
+from battery_cycler import stress
+from battery_cycler.stress import StressManager, Worker
+
+
+@pytest.fixture
+def command(tmp_path, monkeypatch):
+    """A fake stress-ng that just sleeps; restarts without the backoff."""
+    path = str(tmp_path / "stress-ng")
+    with open(path, 'w') as f:
+        f.write("#!/bin/sh\nexec sleep 60\n")
+    os.chmod(path, 0o755)
+    monkeypatch.setattr(stress, "RESTART_BACKOFF", 0.01)
+    return path
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def process_state(pid):
+    """R, S, T (stopped), ... from /proc."""
+    with open("/proc/{}/stat".format(pid)) as f:
+        return f.read().rsplit(")", 1)[1].split()[0]
+
+
+def test_worker_restarts_when_killed(command):
+    logs = []
+    worker = Worker("CPU-STRESS", [command], "LOW", log=logs.append)
+    worker.start()
+    try:
+        first = worker.pid
+        assert first is not None
+        # Its own process group, so only our workers are ever signalled
+        assert os.getpgid(first) == first
+        os.killpg(first, signal.SIGKILL)
+        assert wait_for(lambda: worker.restarts == 1)
+        assert worker.pid not in (None, first)
+        assert logs[0].startswith("CPU-STRESS: Process died (signal 9), restarting")
+    finally:
+        worker.stop()
+    assert worker.pid is None
+    assert not worker.running
+
+
+def test_stopped_worker_is_not_restarted(command):
+    worker = Worker("CPU-STRESS", [command], "LOW", log=lambda message: None)
+    worker.start()
+    pid = worker.pid
+    worker.stop()
+    time.sleep(0.1)
+    assert worker.pid is None
+    assert worker.restarts == 0
+    with pytest.raises(ProcessLookupError):
+        os.killpg(pid, 0)
+
+
+def test_pid_file_lists_running_groups(command, tmp_path):
+    pid_file = str(tmp_path / "stress.pids")
+    manager = StressManager(command, log=lambda message: None, pid_file=pid_file)
+    manager.start_cpu("low")
+    try:
+        assert stress.read_recorded(pid_file) == [("cpu", manager.cpu.pid)]
+    finally:
+        manager.stop()
+    assert not os.path.exists(pid_file)
+
+
+def test_standby_stops_and_continues_the_group(command):
+    manager = StressManager(command, log=lambda message: None, pid_file=None)
+    manager.start_cpu("low")
+    try:
+        pid = manager.cpu.pid
+        manager.suspend()
+        assert manager.suspended
+        assert wait_for(lambda: process_state(pid) == "T")
+        manager.resume()
+        assert not manager.suspended
+        assert wait_for(lambda: process_state(pid) != "T")
+        # The same process throughout: no restart for the next discharge
+        assert manager.cpu.pid == pid
+        assert manager.stats()["cpu"]["restarts"] == 0
+    finally:
+        manager.stop()
+
+
+def test_worker_restarted_on_standby_stays_stopped(command):
+    manager = StressManager(command, log=lambda message: None, pid_file=None)
+    manager.start_cpu("low")
+    try:
+        manager.suspend()
+        first = manager.cpu.pid
+        os.killpg(first, signal.SIGKILL)
+        assert wait_for(lambda: manager.cpu.restarts == 1)
+        assert wait_for(lambda: process_state(manager.cpu.pid) == "T")
+    finally:
+        manager.stop()
+
+
+def test_missing_command_disables_cpu_stress(tmp_path):
+    logs = []
+    manager = StressManager(str(tmp_path / "stress-ng"), log=logs.append, pid_file=None)
+    manager.start("high", "off")
+    assert manager.cpu is None
+    assert logs == ["CPU-STRESS: Failed to start stress-ng ([Errno 2] No such file or directory: '{}') "
+                    "- CPU stress disabled".format(tmp_path / "stress-ng")]
+    # Discharge carries on without it: later checks neither retry nor fail
+    manager.ensure("high", "off")
+    manager.set_cpu_load(4, 0.5)
+    assert manager.cpu is None
+    assert len(logs) == 1
+    manager.start("high", "off")
+    assert logs[-1] == "CPU-STRESS: stress-ng not found - CPU stress disabled"
+
+
+def test_worker_gives_up_when_the_command_disappears(command):
+    logs = []
+    worker = Worker("CPU-STRESS", [command], "LOW", log=logs.append)
+    worker.start()
+    try:
+        os.remove(command)
+        os.killpg(worker.pid, signal.SIGKILL)
+        assert wait_for(lambda: any("Restart failed" in line for line in logs))
+        assert not worker.running
+        assert worker.restarts == 0
+    finally:
+        worker.stop()
@@ -0,0 +1,119 @@
+"""Coulomb counting across zero crossings and gaps."""
+
+import pytest
+
+from battery_cycler.ioreg import BatterySnapshot
+from battery_cycler.throughput import MAX_GAP, CoulombCounter, Throughput
+
+
+def reading(t, current, raw=3000, **fields):
+    return BatterySnapshot(taken_at=t, instant_amperage=current, raw_current_capacity=raw,
+                           raw_max_capacity=5000, **fields)
+
+
+def test_first_reading_counts_nothing():
+    assert CoulombCounter().observe(reading(0, -1800)) is None
+
+
+def test_steady_discharge():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800))
+    step = counter.observe(reading(60, -1800))
+    assert step.discharged_mah == pytest.approx(30.0)
+    assert step.charged_mah == 0
+    assert step.equivalent_cycles == pytest.approx(30.0 / 5000)
+
+
+def test_falls_back_to_amperage():
+    counter = CoulombCounter()
+    counter.observe(BatterySnapshot(taken_at=0, amperage=-1200))
+    step = counter.observe(BatterySnapshot(taken_at=60, amperage=-1200, nominal_capacity=4000))
+    assert step.discharged_mah == pytest.approx(20.0)
+    assert step.equivalent_cycles == pytest.approx(20.0 / 4000)
+
+
+def test_sign_change_is_split_at_zero():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800))
+    step = counter.observe(reading(60, 1200))
+    # Linear from -1800 to +1200 mA crosses zero at 36 s: two triangles
+    assert step.discharged_mah == pytest.approx(1800 / 2.0 * 36 / 3600)
+    assert step.charged_mah == pytest.approx(1200 / 2.0 * 24 / 3600)
+    assert step.gap_secs == 0
+
+
+def test_gap_is_bridged_with_the_raw_counter():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800, raw=3000))
+    step = counter.observe(reading(MAX_GAP + 1, -900, raw=2500))
+    # The currents either side of the gap aren't integrated across it
+    assert step.gap_secs == MAX_GAP + 1
+    assert step.gap_mah == 500
+    assert step.discharged_mah == 500
+    assert step.charged_mah == 0
+    # Integration resumes after the gap
+    step = counter.observe(reading(MAX_GAP + 61, -900, raw=2485))
+    assert step.gap_secs == 0
+    assert step.discharged_mah == pytest.approx(15.0)
+
+
+def test_gap_while_charging():
+    counter = CoulombCounter(max_gap=60)
+    counter.observe(reading(0, 2000, raw=1000))
+    step = counter.observe(reading(3600, 2000, raw=2900))
+    assert (step.charged_mah, step.discharged_mah, step.gap_mah) == (1900, 0, 1900)
+
+
+def test_throughput_adds_up():
+    total = Throughput(discharged_mah=10, gap_secs=5)
+    total.add(Throughput(discharged_mah=5, charged_mah=3))
+    assert (total.discharged_mah, total.charged_mah, total.gap_secs) == (15, 3, 5)
+    assert Throughput.from_dict(total.to_dict()).discharged_mah == 15
+    assert Throughput.from_dict(None).discharged_mah == 0
+    assert total.describe() == "15 mAh out, 3 mAh in = 0.00 equivalent cycles"
+
+
+def test_energy():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800, voltage=12000))
+    step = counter.observe(reading(60, -1800, voltage=12000))
+    # 1.8 A at 12 V for a minute
+    assert step.delivered_wh == pytest.approx(21.6 / 60)
+    assert step.discharge_secs == 60
+    assert step.peak_discharge_watts == pytest.approx(21.6)
+    assert step.discharge_watts == pytest.approx(21.6)
+    assert step.charge_watts is None
+
+
+def test_energy_split_at_zero():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800, voltage=12000))
+    step = counter.observe(reading(60, 1200, voltage=12000))
+    assert step.discharge_secs == pytest.approx(36)
+    assert step.charge_secs == pytest.approx(24)
+    assert step.peak_discharge_watts == pytest.approx(21.6)
+    assert step.peak_charge_watts == pytest.approx(14.4)
+
+
+def test_gap_energy_at_pack_voltage():
+    counter = CoulombCounter()
+    counter.observe(reading(0, -1800, raw=3000, voltage=12000))
+    step = counter.observe(reading(MAX_GAP + 1, -900, raw=2500, voltage=11800))
+    assert step.delivered_wh == pytest.approx(500 * 11.8 / 1000)
+    assert step.discharge_secs == 0
+
+
+def test_adapter_input_needs_both_readings():
+    counter = CoulombCounter()
+    counter.observe(reading(0, 1000, adapter_input_watts=None))
+    assert counter.observe(reading(60, 1000, adapter_input_watts=40.0)).adapter_secs == 0
+    step = counter.observe(reading(120, 1000, adapter_input_watts=50.0))
+    assert step.adapter_wh == pytest.approx(45.0 / 60)
+    assert step.adapter_watts == pytest.approx(45.0)
+    assert step.peak_adapter_watts == 50.0
+
+
+def test_peaks_combine_by_max():
+    total = Throughput(delivered_wh=1, peak_discharge_watts=20)
+    total.add(Throughput(delivered_wh=2, peak_discharge_watts=15))
+    assert (total.delivered_wh, total.peak_discharge_watts) == (3, 20)
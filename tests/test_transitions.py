@@ -0,0 +1,134 @@
+"""Phase-switch timing, overshoot and the predictive switch lead."""
+
+import pytest
+
+from battery_cycler.engine import CHARGING, DISCHARGING
+from battery_cycler.ioreg import BatterySnapshot
+from battery_cycler.rate import RateEstimator
+from battery_cycler.sim import Simulation
+from battery_cycler.transitions import DEFAULT_LEAD, Transition, TransitionStats, crossing_time
+
+
+def falling(rate=-0.01, level=20.5, end=300):
+    """A ready estimator that has followed a level falling at `rate` %/s."""
+    estimator = RateEstimator()
+    for t in range(0, end + 1, 10):
+        estimator.update(t, level + rate * (t - end), 0.01, phase="discharging")
+    return estimator
+
+
+def switch(act=0.6):
+    # Crossed at 99, read 100-100.2, applied `act` s after the reading
+    transition = Transition(CHARGING, 100.0, 100.2, crossed=99.0)
+    transition.mark("prepare", 100.3)
+    transition.mark("stress", 100.5)
+    transition.command(100.2 + act + 0.2, steps=[("maintain_stop", act - 0.5), ("smc_write", 0.2)])
+    return transition
+
+
+def test_stages():
+    transition = switch()
+    stages = dict(transition.stages)
+    assert stages["detect"] == pytest.approx(1.0)
+    assert stages["read"] == pytest.approx(0.2)
+    assert stages["prepare"] == pytest.approx(0.1)
+    assert stages["stress"] == pytest.approx(0.2)
+    assert stages["command"] == pytest.approx(0.5)
+    assert stages["command.smc_write"] == 0.2
+    # Applied at the SMC write, before the CLI returned
+    assert transition.total == pytest.approx(1.8)
+    assert transition.act == pytest.approx(0.6)
+    assert transition.describe().startswith("1.8s (detect 1.0s, read 0.2s, prepare 0.1s")
+
+
+def test_without_a_crossing_time_the_reading_starts_the_clock():
+    transition = Transition(DISCHARGING, 100.0, 100.2)
+    transition.command(101.2)
+    assert "detect" not in dict(transition.stages)
+    assert transition.total == pytest.approx(1.2)
+
+
+def test_crossing_time():
+    estimator = falling()
+    # A 0.01% reading shows 20 from 20.005, half a step early
+    assert crossing_time(estimator, 20, True, 400, 0.01) == pytest.approx(300 + 0.495 / 0.01)
+    # Never before the last sample nor after the reading that showed it
+    assert crossing_time(estimator, 20.5, True, 400, 0.01) == 300
+    assert crossing_time(estimator, 19, True, 320, 0.01) == 320
+    assert crossing_time(RateEstimator(), 20, True, 400) is None
+
+
+def test_stats_summary():
+    stats = TransitionStats()
+    for act in (0.6, 0.8, 1.0):
+        stats.add(switch(act))
+    summary = stats.summary()[CHARGING]
+    assert summary["act"]["count"] == 3
+    assert summary["act"]["p50"] == pytest.approx(0.8)
+    assert summary["total"]["max"] == pytest.approx(2.2)
+
+
+def test_overshoot():
+    # Level 20.02% falling at 0.01%/s at the reading, applied 3 s later
+    transition = Transition(CHARGING, 100.0, 100.2, limit=20, level=20.02, rate=-0.01)
+    transition.command(103.2)
+    assert transition.overshoot == pytest.approx(0.01)
+    assert "0.01% past the limit" in transition.describe()
+    early = Transition(DISCHARGING, 100.0, 100.2, limit=80, level=79.9, rate=0.01)
+    early.command(101.2)
+    assert early.overshoot == pytest.approx(-0.09)
+    assert "short of the limit" in early.describe()
+    assert Transition(CHARGING, 100.0, 100.2).overshoot is None
+
+
+def test_lead_is_the_median_switch_time():
+    stats = TransitionStats()
+    assert stats.lead(CHARGING) == DEFAULT_LEAD
+    for act in (3.0, 5.0, 4.0):
+        stats.add(switch(act))
+    assert stats.lead(CHARGING) == pytest.approx(4.0)
+    assert stats.lead(DISCHARGING) == DEFAULT_LEAD
+    stats.add(Transition(CHARGING, 0, 0.1, limit=20, level=20.0, rate=-0.01))
+    assert stats.overshoot()[CHARGING]["count"] == 1
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = Simulation().create_engine(str(tmp_path))
+    engine.state = DISCHARGING
+    yield engine
+    engine.store.close()
+
+
+def at_level(engine, level):
+    engine.rate_estimator = falling(level=level)
+    raw_max = 100000
+    engine.battery = BatterySnapshot(current_capacity=int(round(level)), raw_max_capacity=raw_max,
+                                     raw_current_capacity=int(round(level * raw_max / 100)))
+    engine.percent = engine.battery.current_capacity
+    engine.level = level
+
+
+def test_predictive_switch_leads_the_limit(engine):
+    config = {"predictive_switching": True}
+    # Due at 20% in half a second: within the default 2 s lead
+    at_level(engine, 20.005)
+    assert engine._at_limit(config, DISCHARGING, 20, False)
+    # Due in 5 s: not yet, until switches are measured to take that long
+    at_level(engine, 20.05)
+    assert not engine._at_limit(config, DISCHARGING, 20, False)
+    for act in (5.5, 6.0, 6.5):
+        engine.transition_stats.add(switch(act))
+    assert engine._at_limit(config, DISCHARGING, 20, False)
+
+
+def test_reading_decides_without_prediction(engine):
+    at_level(engine, 20.01)
+    assert not engine._at_limit({"predictive_switching": False}, DISCHARGING, 20, False)
+    # Not in the phase heading for this limit
+    engine.state = CHARGING
+    assert not engine._at_limit({"predictive_switching": True}, DISCHARGING, 20, False)
+    # Until the rate is known the reading decides
+    engine.state = DISCHARGING
+    engine.rate_estimator = RateEstimator()
+    assert engine._at_limit({"predictive_switching": True}, DISCHARGING, 20, True)